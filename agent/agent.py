@@ -17,6 +17,7 @@ except ImportError:
 
 import datetime
 import errno
+import hashlib
 import json
 import slycat.mime_type
 import os
@@ -27,12 +28,18 @@ import sys
 import tempfile
 import threading
 import uuid
+import zlib
 import abc
 import logging
 import ConfigParser
+import Queue
+import multiprocessing.pool
 
 session_cache = {}
 
+# Largest byte range sent in response to a single chunked 'get-file' command.
+max_chunked_length = 16 * 1024 * 1024
+
 
 class Agent(object):
     """
@@ -44,6 +51,8 @@ class Agent(object):
     log.setLevel(logging.INFO)
     log.addHandler(logging.FileHandler('slycat-agent.log'))
     log.handlers[0].setFormatter(logging.Formatter("[%(asctime)s] - [%(levelname)s] : %(message)s"))
+    # Directory where downsampled / converted images are kept between requests, or None.
+    thumbnail_cache = None
     @abc.abstractmethod
     def run_remote_command(self, command):
         """
@@ -197,6 +206,19 @@ class Agent(object):
         directory_reject = re.compile(command.get("directory-reject")) if "directory-reject" in command else None
         directory_allow = re.compile(command.get("directory-allow")) if "directory-allow" in command else None
 
+        # Report the modification time, so callers can revalidate their copies of the listing
+        # without listing the directory again.
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError as e:
+            raise Exception(e.strerror)
+
+        if command.get("mtime") == mtime:
+            sys.stdout.write("%s\n" % json.dumps({"ok": True, "message": "Directory not modified.", "path": path,
+                                                  "mtime": mtime}))
+            sys.stdout.flush()
+            return
+
         if os.path.isdir(path):
             names = sorted(os.listdir(path))
         else:
@@ -206,6 +228,7 @@ class Agent(object):
         listing = {
             "ok": True,
             "path": path,
+            "mtime": mtime,
             "names": [],
             "sizes": [],
             "types": [],
@@ -213,9 +236,22 @@ class Agent(object):
             "mime-types": [],
         }
 
-        for name in names:
-            fpath = os.path.join(path, name)
-            fstat = os.stat(fpath)
+        # Stat in parallel, since each stat can be a round-trip to a network filesystem.
+        paths = [os.path.join(path, name) for name in names]
+        if len(paths) > 64:
+            pool = multiprocessing.pool.ThreadPool(16)
+            try:
+                fstats = pool.map(_stat, paths, chunksize=64)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            fstats = [_stat(fpath) for fpath in paths]
+
+        for name, fpath, fstat in zip(names, paths, fstats):
+            # Skip files that were removed after we listed the directory, and broken links.
+            if fstat is None:
+                continue
             ftype = "d" if stat.S_ISDIR(fstat.st_mode) else "f"
 
             if ftype == "d":
@@ -256,8 +292,39 @@ class Agent(object):
         if os.path.isdir(path):
             raise Exception("Directory unreadable.")
 
+        # Callers may request a byte range, so large files can be streamed a piece at a time.
+        offset = command.get("offset", 0)
+        length = command.get("length", None)
+        chunk_size = command.get("chunk-size", None)
+        compression = command.get("compression", None)
+        if compression not in [None, "zlib"]:
+            raise Exception("Unsupported compression.")
+        # The whole response is buffered before it is sent, so chunked ranges are bounded,
+        # and callers page through the file, continuing from the end of each response.
+        if chunk_size is not None:
+            if length is None:
+                raise Exception("Chunked transfers require a length.")
+            length = min(length, max_chunked_length)
         try:
-            content = open(path, "rb").read()
+            with open(path, "rb") as file:
+                file_size = os.fstat(file.fileno()).st_size
+                file.seek(offset)
+                if chunk_size is None:
+                    content = file.read() if length is None else file.read(length)
+                    chunks = None
+                else:
+                    # Callers that specify a chunk size get the range as a sequence of framed chunks,
+                    # each optionally compressed, with a checksum of its uncompressed contents.
+                    # Chunks are encoded as they are read, so the range is never held uncompressed.
+                    chunks = []
+                    position = offset
+                    while position < offset + length:
+                        data = file.read(min(chunk_size, offset + length - position))
+                        if not data:
+                            break
+                        chunks.append(_encode_chunk(position, data, compression))
+                        position += len(data)
+                    content = "".join(chunks)
         except IOError as e:
             if e.errno == errno.EACCES:
                 raise Exception("Access denied.")
@@ -266,10 +333,13 @@ class Agent(object):
             raise Exception(e.message)
 
         content_type, encoding = slycat.mime_type.guess_type(path)
-        sys.stdout.write("%s\n%s" % (json.dumps(
-            {"ok": True, "message": "File retrieved.", "path": path, "content-type": content_type,
-             "size": len(content)}),
-                                     content))
+        metadata = {"ok": True, "message": "File retrieved.", "path": path, "content-type": content_type,
+                    "file-size": file_size}
+        if chunks is not None:
+            metadata["chunks"] = len(chunks)
+
+        metadata["size"] = len(content)
+        sys.stdout.write("%s\n%s" % (json.dumps(metadata), content))
         sys.stdout.flush()
 
     # Handle the 'get-image' command.
@@ -287,6 +357,27 @@ class Agent(object):
         file_content_type, encoding = slycat.mime_type.guess_type(path)
         requested_content_type = command.get("content-type", file_content_type)
 
+        # Identify this rendition of the image, so callers can revalidate their copies
+        # without transferring the image, and so we can reuse thumbnails we've already made.
+        try:
+            status = os.stat(path)
+        except OSError as e:
+            raise Exception(e.strerror)
+        etag = hashlib.sha1(json.dumps([path, status.st_mtime, status.st_size, requested_content_type,
+                                        command.get("max-size"), command.get("max-width"),
+                                        command.get("max-height")])).hexdigest()
+        metadata = {"ok": True, "message": "Image retrieved.", "path": path, "content-type": requested_content_type,
+                    "etag": etag, "mtime": status.st_mtime}
+
+        if command.get("etag") == etag:
+            if not os.access(path, os.R_OK):
+                raise Exception("Access denied.")
+            metadata["message"] = "Image not modified."
+            metadata["size"] = 0
+            sys.stdout.write("%s\n" % json.dumps(metadata))
+            sys.stdout.flush()
+            return
+
         # Optional fast path if the client hasn't requested anything that would alter the image contents:
         if "max-size" not in command and "max-width" not in command and "max-height" not in command and requested_content_type == file_content_type:
             try:
@@ -299,45 +390,160 @@ class Agent(object):
                 raise Exception(e.message)
 
             content_type, encoding = slycat.mime_type.guess_type(path)
-            sys.stdout.write("%s\n%s" % (json.dumps(
-                {"ok": True, "message": "Image retrieved.", "path": path, "content-type": content_type,
-                 "size": len(content)}), content))
+            metadata["content-type"] = content_type
+            metadata["size"] = len(content)
+            sys.stdout.write("%s\n%s" % (json.dumps(metadata), content))
             sys.stdout.flush()
             return
 
         if requested_content_type not in ["image/jpeg", "image/png"]:
             raise Exception("Unsupported image type.")
 
-        # Load the requested image.
-        try:
-            image = PIL.Image.open(path)
-        except IOError as e:
-            raise Exception(e.strerror)
+        content = self._cached_thumbnail(etag)
+        if content is None:
+            # Load the requested image.
+            try:
+                image = PIL.Image.open(path)
+            except IOError as e:
+                raise Exception(e.strerror)
 
-        # Optionally downsample the image.
-        size = image.size
-        if "max-size" in command:
-            size = (command["max-size"], command["max-size"])
-        if "max-width" in command:
-            size = (command["max-width"], size[1])
-        if "max-height" in command:
-            size = (size[0], command["max-height"])
-        if size != image.size:
-            image.thumbnail(size=size, resample=PIL.Image.ANTIALIAS)
-
-        # Save the image to the requested format.
-        content = StringIO.StringIO()
-        if requested_content_type == "image/jpeg":
-            image.save(content, "JPEG")
-        elif requested_content_type == "image/png":
-            image.save(content, "PNG")
+            # Optionally downsample the image.
+            size = image.size
+            if "max-size" in command:
+                size = (command["max-size"], command["max-size"])
+            if "max-width" in command:
+                size = (command["max-width"], size[1])
+            if "max-height" in command:
+                size = (size[0], command["max-height"])
+            if size != image.size:
+                image.thumbnail(size=size, resample=PIL.Image.ANTIALIAS)
+
+            # Save the image to the requested format.
+            content = StringIO.StringIO()
+            if requested_content_type == "image/jpeg":
+                image.save(content, "JPEG")
+            elif requested_content_type == "image/png":
+                image.save(content, "PNG")
+            content = content.getvalue()
+            self._cache_thumbnail(etag, content)
 
         # Send the results back to the caller.
-        sys.stdout.write("%s\n%s" % (json.dumps(
-            {"ok": True, "message": "Image retrieved.", "path": path, "content-type": requested_content_type,
-             "size": len(content.getvalue())}), content.getvalue()))
+        metadata["size"] = len(content)
+        sys.stdout.write("%s\n%s" % (json.dumps(metadata), content))
         sys.stdout.flush()
 
+    def _cached_thumbnail(self, etag):
+        """
+        return a thumbnail from the thumbnail cache, marking it as recently used
+        :param etag: identifies the source image and rendition
+        :return: thumbnail content, or None
+        """
+        if self.thumbnail_cache is None:
+            return None
+        path = os.path.join(self.thumbnail_cache, etag)
+        try:
+            with open(path, "rb") as file:
+                content = file.read()
+            os.utime(path, None)
+            return content
+        except (IOError, OSError):
+            return None
+
+    def _cache_thumbnail(self, etag, content):
+        """
+        add a thumbnail to the thumbnail cache.  Failures are logged, since the cache is only an optimization.
+        :param etag: identifies the source image and rendition
+        :param content: thumbnail content
+        """
+        if self.thumbnail_cache is None:
+            return
+        try:
+            # Write then rename, so other workers never read a partial thumbnail.
+            handle, temp_path = tempfile.mkstemp(dir=self.thumbnail_cache, prefix=".")
+            with os.fdopen(handle, "wb") as file:
+                file.write(content)
+            os.rename(temp_path, os.path.join(self.thumbnail_cache, etag))
+        except (IOError, OSError) as e:
+            self.log.error("Couldn't cache thumbnail: %s" % e)
+
+    def prune_thumbnail_cache(self, max_bytes):
+        """
+        remove the least recently used thumbnails until the thumbnail cache is no larger than max_bytes
+        :param max_bytes: upper bound on the size of the thumbnail cache
+        """
+        thumbnails = []
+        for name in os.listdir(self.thumbnail_cache):
+            try:
+                status = os.stat(os.path.join(self.thumbnail_cache, name))
+                thumbnails.append((status.st_mtime, status.st_size, name))
+            except OSError:
+                pass
+        total = sum(size for mtime, size, name in thumbnails)
+        for mtime, size, name in sorted(thumbnails):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.thumbnail_cache, name))
+                total -= size
+            except OSError:
+                pass
+
+    def dispatch(self, command):
+        """
+        parse a command and run its handler, which writes the response to stdout
+        :param command: one line of json read from the caller
+        :return: the parsed command
+        """
+        # Parse the command, which must be a JSON object containing an action.
+        try:
+            command = json.loads(command)
+        except:
+            self.log.error("Not a JSON object.")
+            raise Exception("Not a JSON object.")
+        if not isinstance(command, dict):
+            self.log.error("Not a JSON object.")
+            raise Exception("Not a JSON object.")
+        if "action" not in command:
+            self.log.error("Missing action for command: %s" % command)
+            raise Exception("Missing action.")
+
+        action = command["action"]
+        self.log.info("command: %s" % command)
+        if action in ["exit", "multiplex"]:
+            pass
+        elif action == "browse":
+            self.browse(command)
+        elif action == "get-file":
+            self.get_file(command)
+        elif action == "get-image":
+            self.get_image(command)
+        elif action == "create-video":
+            sys.stdout.write("%s\n" % json.dumps({"ok": False, "message": "this command is depricated and has "
+                                                                          "been removed"}))
+            sys.stdout.flush()
+        elif action == "video-status":
+            self.video_status(command)
+        elif action == "launch":
+            self.launch(command)
+        elif action == "submit-batch":
+            self.submit_batch(command)
+        elif action == "checkjob":
+            self.checkjob(command)
+        elif action == "get-job-output":
+            self.get_job_output(command)
+        elif action == "run-function":
+            self.run_function(command)
+        elif action == "cancel-job":
+            self.cancel_job(command)
+        elif action == "get-user-config":
+            self.get_user_config()
+        elif action == "set-user-config":
+            self.set_user_config(command)
+        else:
+            self.log.error("Unknown command.")
+            raise Exception("Unknown command.")
+        return command
+
     def run(self):
         self.log.info("\n")
         self.log.info("*agent started*")
@@ -347,11 +553,26 @@ class Agent(object):
                             help="Fail immediately on startup.  Obviously, this is for testing.")
         parser.add_argument("--fail-exit", default=False, action="store_true",
                             help="Fail during exit.  Obviously, this is for testing.")
+        parser.add_argument("--workers", type=int, default=4,
+                            help="Number of commands handled at once after the caller requests multiplexing.  Default: %(default)s")
+        parser.add_argument("--thumbnail-cache", default=os.path.join(os.path.expanduser("~"), ".slycat", "thumbnail-cache"),
+                            help="Directory where downsampled images are kept between requests.  Use an empty string to disable.  Default: %(default)s")
+        parser.add_argument("--thumbnail-cache-size", type=int, default=256 * 1024 * 1024,
+                            help="Upper bound on the size of the thumbnail cache in bytes, enforced at startup.  Default: %(default)s")
         arguments = parser.parse_args()
 
         if arguments.fail_startup:
             exit(-1)
 
+        if arguments.thumbnail_cache:
+            try:
+                if not os.path.isdir(arguments.thumbnail_cache):
+                    os.makedirs(arguments.thumbnail_cache)
+                self.thumbnail_cache = arguments.thumbnail_cache
+                self.prune_thumbnail_cache(arguments.thumbnail_cache_size)
+            except OSError as e:
+                self.log.error("Thumbnail cache disabled: %s" % e)
+
         # Let the caller know we're ready to handle commands.
         sys.stdout.write("%s\n" % json.dumps({"ok": True, "message": "Ready."}))
         sys.stdout.flush()
@@ -364,60 +585,139 @@ class Agent(object):
                 break
 
             try:
-                # Parse the command, which must be a JSON object containing an action.
-                try:
-                    command = json.loads(command)
-                except:
-                    self.log.error("Not a JSON object.")
-                    raise Exception("Not a JSON object.")
-                if not isinstance(command, dict):
-                    self.log.error("Not a JSON object.")
-                    raise Exception("Not a JSON object.")
-                if "action" not in command:
-                    self.log.error("Missing action for command: %s" % command)
-                    raise Exception("Missing action.")
-
-                action = command["action"]
-                self.log.info("command: %s" % command)
-                if action == "exit":
+                command = self.dispatch(command)
+                # Callers that understand multiplexing ask for it first; older callers never do.
+                if command["action"] == "multiplex":
+                    sys.stdout.write("%s\n" % json.dumps({"ok": True, "message": "Multiplexing.",
+                                                           "protocol": 2, "workers": arguments.workers}))
+                    sys.stdout.flush()
+                    self.run_multiplexed(arguments)
+                    break
+                if command["action"] == "exit":
                     self.log.info("*agent stopping*\n")
                     if not arguments.fail_exit:
                         break
-                elif action == "browse":
-                    self.browse(command)
-                elif action == "get-file":
-                    self.get_file(command)
-                elif action == "get-image":
-                    self.get_image(command)
-                elif action == "create-video":
-                    sys.stdout.write("%s\n" % json.dumps({"ok": False, "message": "this command is depricated and has "
-                                                                                  "been removed"}))
-                    sys.stdout.flush()
-                elif action == "video-status":
-                    self.video_status(command)
-                elif action == "launch":
-                    self.launch(command)
-                elif action == "submit-batch":
-                    self.submit_batch(command)
-                elif action == "checkjob":
-                    self.checkjob(command)
-                elif action == "get-job-output":
-                    self.get_job_output(command)
-                elif action == "run-function":
-                    self.run_function(command)
-                elif action == "cancel-job":
-                    self.cancel_job(command)
-                elif action == "get-user-config":
-                    self.get_user_config()
-                elif action == "set-user-config":
-                    self.set_user_config(command)
-                else:
-                    self.log.error("Unknown command.")
-                    raise Exception("Unknown command.")
             except Exception as e:
                 sys.stdout.write("%s\n" % json.dumps({"ok": False, "message": e.message}))
                 sys.stdout.flush()
 
+    def run_multiplexed(self, arguments):
+        """
+        handle commands on a pool of worker threads, so a slow command doesn't delay the others.
+
+        Every command carries an "id".  Each response is framed by a line of json
+        {"id": id, "size": size}, followed by exactly size bytes containing what the
+        command would have written in the unmultiplexed protocol, so responses can be
+        sent in any order.
+        :param arguments: parsed command-line arguments
+        :return:
+        """
+        output = _ThreadOutput(sys.stdout)
+        sys.stdout = output
+        commands = Queue.Queue()
+
+        def work():
+            while True:
+                request = commands.get()
+                if request is None:
+                    break
+                rid, command = request
+                output.capture()
+                try:
+                    self.dispatch(command)
+                except Exception as e:
+                    sys.stdout.write("%s\n" % json.dumps({"ok": False, "message": e.message}))
+                output.send(rid)
+
+        workers = [threading.Thread(target=work, name="agent-worker-%s" % i) for i in range(arguments.workers)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            while True:
+                command = sys.stdin.readline()
+                if command == "":
+                    break
+                try:
+                    parsed = json.loads(command)
+                    rid = parsed.get("id") if isinstance(parsed, dict) else None
+                    action = parsed.get("action") if isinstance(parsed, dict) else None
+                except:
+                    rid, action = None, None
+                if action == "exit":
+                    self.log.info("*agent stopping*\n")
+                    if not arguments.fail_exit:
+                        break
+                    continue
+                commands.put((rid, command))
+        finally:
+            # Finish the commands we've already accepted before shutting-down.
+            for worker in workers:
+                commands.put(None)
+            for worker in workers:
+                worker.join()
+            sys.stdout = output.stream
+
+
+def _stat(path):
+    """Return the status of a path, or None if the path doesn't exist."""
+    try:
+        return os.stat(path)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+
+
+def _encode_chunk(offset, data, compression):
+    """Return one frame of a chunked 'get-file' response."""
+    checksum = zlib.crc32(data) & 0xffffffff
+    encoding = "identity"
+    if compression == "zlib":
+        compressed = zlib.compress(data, 1)
+        # Incompressible data is sent as-is.
+        if len(compressed) < len(data):
+            data = compressed
+            encoding = "zlib"
+    return "%s\n%s" % (json.dumps({"offset": offset, "size": len(data), "encoding": encoding, "crc32": checksum}), data)
+
+
+class _ThreadOutput(object):
+    """
+    Stands in for sys.stdout while multiplexing, collecting what each worker thread writes
+    so its response can be framed and sent as a unit.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def capture(self):
+        self._local.buffer = StringIO.StringIO()
+
+    def send(self, rid):
+        content = self._local.buffer.getvalue()
+        del self._local.buffer
+        with self._lock:
+            self.stream.write("%s\n%s" % (json.dumps({"id": rid, "size": len(content)}), content))
+            self.stream.flush()
+
+    def write(self, data):
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            with self._lock:
+                self.stream.write(data)
+        else:
+            buffer.write(data)
+
+    def flush(self):
+        if getattr(self._local, "buffer", None) is None:
+            with self._lock:
+                self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
 
 if __name__ == "__main__":
     """
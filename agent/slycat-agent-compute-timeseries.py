@@ -17,14 +17,14 @@ import argparse
 import collections
 import datetime
 import h5py
-import IPython.parallel
 import itertools
 import json
 import numpy
 import os
-import scipy.cluster.hierarchy
-import scipy.spatial.distance
+import slycat.distance
 import slycat.hdf5
+import slycat.parallel
+import slycat.timeseries
 import json
 try:
   import cpickle as pickle
@@ -40,7 +40,11 @@ parser.add_argument("--cluster-type", default="average", choices=["single", "com
 parser.add_argument("--cluster-metric", default="euclidean", choices=["euclidean"], help="Hierarchical clustering distance metric.  Default: %(default)s")
 parser.add_argument("--workdir", default=None, help="Working directory to store data to be processed during model creation")
 parser.add_argument("--hash", default=None, help="Unique identifier for the output folder.")
-parser.add_argument("--profile", default=None, help="Name of the IPython profile to use")
+parser.add_argument("--profile", default=None, help="Name of the IPython profile to use with the ipython parallel backend")
+parser.add_argument("--parallel-backend", default="multiprocessing", choices=slycat.parallel.backends, help="Run resampling in local processes, or on a running IPython parallel cluster.  Default: %(default)s")
+parser.add_argument("--processes", type=int, default=None, help="Number of local processes used by the multiprocessing backend.  Defaults to the number of CPUs.")
+parser.add_argument("--distance-block-size", type=int, default=1024, help="Number of waveforms compared at a time when computing distance matrices.  Default: %(default)s")
+parser.add_argument("--distance-processes", type=int, default=1, help="Number of local processes used to compute distance matrices.  Default: %(default)s")
 arguments = parser.parse_args()
 
 if arguments.timeseries_name is None:
@@ -56,10 +60,82 @@ if arguments.cluster_sample_count < 1:
 
 _numSamples = arguments.cluster_sample_count
 
-try:
-  pool = IPython.parallel.Client(profile=arguments.profile)[:]
-except:
-  raise Exception("A running IPython parallel cluster is required to run this script.")
+def get_time_range(directory, timeseries_index):
+  """
+  Get the minimum and maximum times for the input timeseries and returns the
+  values as a tuple.
+
+  :param directory: working directory for the timeseries
+  :param timeseries_index:
+  :returns: timeseries time range as tuple
+  """
+  import h5py
+  import os
+  import slycat.hdf5
+  # We have to open the file with writing enabled in case the statistics cache gets updated.
+  with h5py.File(os.path.join(directory, "timeseries-%s.hdf5" % timeseries_index), "r+") as file:
+    statistics = slycat.hdf5.ArraySet(file)[0].get_statistics(0)
+  return statistics["min"], statistics["max"]
+
+def uniform_pla(directory, min_time, max_time, bin_count, timeseries_index, attribute_index):
+  """
+  Create waveforms using a piecewise linear approximation.
+
+  :param directory: working directory for the timeseries
+  :param min_time:
+  :param max_time:
+  :param bin_count:
+  :param timeseries_index:
+  :param attribute_index:
+  :return: resampled values, at the centers of bin_count evenly spaced bins
+  """
+  import h5py
+  import numpy
+  import os
+  import slycat.hdf5
+
+  # generate evenly spaced times
+  bin_edges = numpy.linspace(min_time, max_time, bin_count + 1)
+  bin_times = (bin_edges[:-1] + bin_edges[1:]) / 2
+  with h5py.File(os.path.join(directory, "timeseries-%s.hdf5" % timeseries_index), "r") as file:
+    original_times = slycat.hdf5.ArraySet(file)[0].get_data(0)[:]
+    original_values = slycat.hdf5.ArraySet(file)[0].get_data(attribute_index + 1)[:]
+  # interpolate original data with binned times
+  bin_values = numpy.interp(bin_times, original_times, original_values)
+  return bin_values
+
+def uniform_paa(directory, min_time, max_time, bin_count, timeseries_index, attribute_index):
+  """
+  Create waveforms using a piecewise aggregate approximation.
+
+  :param directory: working directory for the timeseries
+  :param min_time:
+  :param max_time:
+  :param bin_count:
+  :param timeseries_index:
+  :param attribute_index:
+  :return: resampled values, at the centers of bin_count evenly spaced bins
+  """
+  import h5py
+  import numpy
+  import os
+  import slycat.hdf5
+
+  bin_edges = numpy.linspace(min_time, max_time, bin_count + 1)
+  bin_times = (bin_edges[:-1] + bin_edges[1:]) / 2
+  with h5py.File(os.path.join(directory, "timeseries-%s.hdf5" % timeseries_index), "r") as file:
+    original_times = slycat.hdf5.ArraySet(file)[0].get_data(0)[:]
+    original_values = slycat.hdf5.ArraySet(file)[0].get_data(attribute_index + 1)[:]
+  bin_indices = numpy.digitize(original_times, bin_edges[1:])
+  bin_counts = numpy.bincount(bin_indices, minlength=bin_count+1)[1:]
+  bin_sums = numpy.bincount(bin_indices, original_values, minlength=bin_count+1)[1:]
+  lonely_bins = (bin_counts < 2)
+  bin_counts[lonely_bins] = 1
+  bin_sums[lonely_bins] = numpy.interp(bin_times, original_times, original_values)[lonely_bins]
+  bin_values = bin_sums / bin_counts
+  return bin_values
+
+pool = slycat.parallel.create(arguments.parallel_backend, processes=arguments.processes, profile=arguments.profile)
 
 # Compute the model.
 try:
@@ -156,25 +232,8 @@ try:
     json.dump(sorted(clusters.keys()), file_clusters_out)
 
 
-  def get_time_range(directory, timeseries_index):
-    """
-    Get the minimum and maximum times for the input timeseries and returns the
-    values as a tuple.
-
-    :param directory: working directory for the timeseries
-    :param timeseries_index:
-    :returns: timeseries time range as tuple
-    """
-    import h5py
-    import os
-    import slycat.hdf5
-    # We have to open the file with writing enabled in case the statistics cache gets updated.
-    with h5py.File(os.path.join(directory, "timeseries-%s.hdf5" % timeseries_index), "r+") as file:
-      statistics = slycat.hdf5.ArraySet(file)[0].get_statistics(0)
-    return statistics["min"], statistics["max"]
-
   print("Collecting timeseries statistics.")
-  time_ranges = pool.map_sync(get_time_range, list(itertools.repeat(directory_full_path, timeseries_count)), range(timeseries_count))
+  time_ranges = pool.map(get_time_range, list(itertools.repeat(directory_full_path, timeseries_count)), range(timeseries_count))
 
   # For each cluster ...
   for index, (name, storage) in enumerate(sorted(clusters.items())):
@@ -190,152 +249,33 @@ try:
     time_min = min(zip(*ranges)[0])
     time_max = max(zip(*ranges)[1])
 
-    if arguments.cluster_sample_type == "uniform-pla":
-
-      def uniform_pla(directory, min_time, max_time, bin_count, timeseries_index, attribute_index):
-        """
-        Create waveforms using a piecewise linear approximation.
-
-        :param directory: working directory for the timeseries
-        :param min_time:
-        :param max_time:
-        :param bin_count:
-        :param timeseries_index:
-        :param attribute_index:
-        :return: computed time series
-        """
-        import h5py
-        import numpy
-        import os
-        import slycat.hdf5
-
-        # generate evenly spaced times
-        bin_edges = numpy.linspace(min_time, max_time, bin_count + 1)
-        bin_times = (bin_edges[:-1] + bin_edges[1:]) / 2
-        with h5py.File(os.path.join(directory, "timeseries-%s.hdf5" % timeseries_index), "r") as file:
-          original_times = slycat.hdf5.ArraySet(file)[0].get_data(0)[:]
-          original_values = slycat.hdf5.ArraySet(file)[0].get_data(attribute_index + 1)[:]
-        # interpolate original data with binned times
-        bin_values = numpy.interp(bin_times, original_times, original_values)
-        return {
-          "input-index" : timeseries_index,
-          "times" : bin_times,
-          "values" : bin_values,
-        }
-
-      directories = list(itertools.repeat(directory_full_path, len(storage)))
-      min_times = list(itertools.repeat(time_min, len(storage)))
-      max_times = list(itertools.repeat(time_max, len(storage)))
-      bin_counts = list(itertools.repeat(_numSamples, len(storage)))
-      timeseries_indices = [timeseries for timeseries, attribute in storage]
-      attribute_indices = [attribute for timeseries, attribute in storage]
-      waveforms = pool.map_sync(uniform_pla, directories, min_times, max_times, bin_counts, timeseries_indices, attribute_indices)
-
-    elif arguments.cluster_sample_type == "uniform-paa":
-
-      def uniform_paa(directory, min_time, max_time, bin_count, timeseries_index, attribute_index):
-        """
-        Create waveforms using a piecewise aggregate approximation.
-
-        :param directory: working directory for the timeseries
-        :param min_time:
-        :param max_time:
-        :param bin_count:
-        :param timeseries_index:
-        :param attribute_index:
-        :return: computed time series
-        """
-        import h5py
-        import numpy
-        import os
-        import slycat.hdf5
-
-        bin_edges = numpy.linspace(min_time, max_time, bin_count + 1)
-        bin_times = (bin_edges[:-1] + bin_edges[1:]) / 2
-        with h5py.File(os.path.join(directory, "timeseries-%s.hdf5" % timeseries_index), "r") as file:
-          original_times = slycat.hdf5.ArraySet(file)[0].get_data(0)[:]
-          original_values = slycat.hdf5.ArraySet(file)[0].get_data(attribute_index + 1)[:]
-        bin_indices = numpy.digitize(original_times, bin_edges[1:])
-        bin_counts = numpy.bincount(bin_indices, minlength=bin_count+1)[1:]
-        bin_sums = numpy.bincount(bin_indices, original_values, minlength=bin_count+1)[1:]
-        lonely_bins = (bin_counts < 2)
-        bin_counts[lonely_bins] = 1
-        bin_sums[lonely_bins] = numpy.interp(bin_times, original_times, original_values)[lonely_bins]
-        bin_values = bin_sums / bin_counts
-        return {
-          "input-index" : timeseries_index,
-          "times" : bin_times,
-          "values" : bin_values,
-        }
-
-      directories = list(itertools.repeat(directory_full_path, len(storage)))
-      min_times = list(itertools.repeat(time_min, len(storage)))
-      max_times = list(itertools.repeat(time_max, len(storage)))
-      bin_counts = list(itertools.repeat(_numSamples, len(storage)))
-      timeseries_indices = [timeseries for timeseries, attribute in storage]
-      attribute_indices = [attribute for timeseries, attribute in storage]
-      waveforms = pool.map_sync(uniform_paa, directories, min_times, max_times, bin_counts, timeseries_indices, attribute_indices)
-
-    # Compute a distance matrix comparing every series to every other ...
-    observation_count = len(waveforms)
-    distance_matrix = numpy.zeros(shape=(observation_count, observation_count))
-    for i in range(0, observation_count):
-      print("Computing distance matrix for %s, %s of %s" % (name, i+1, observation_count))
-      for j in range(i + 1, observation_count):
-        distance = numpy.sqrt(numpy.sum(numpy.power(waveforms[j]["values"] - waveforms[i]["values"], 2.0)))
-        distance_matrix[i, j] = distance
-        distance_matrix[j, i] = distance
-
-    # Use the distance matrix to cluster observations ...
-    print("Clustering %s" % name)
-    distance = scipy.spatial.distance.squareform(distance_matrix)
-    linkage = scipy.cluster.hierarchy.linkage(distance, method=str(arguments.cluster_type), metric=str(arguments.cluster_metric))
-
-    # Identify exemplar waveforms for each cluster ...
-    summed_distances = numpy.zeros(shape=(observation_count))
-    exemplars = dict()
-    cluster_membership = []
-
-    for i in range(observation_count):
-      exemplars[i] = i
-      cluster_membership.append(set([i]))
-
-    print("Identifying examplars for %s" % (name))
-    for i in range(len(linkage)):
-      cluster_id = i + observation_count
-      (f_cluster1, f_cluster2, height, total_observations) = linkage[i]
-      cluster1 = int(f_cluster1)
-      cluster2 = int(f_cluster2)
-      # Housekeeping: assemble the membership of the new cluster
-      cluster_membership.append(cluster_membership[cluster1].union(cluster_membership[cluster2]))
-
-      # We need to update the distance from each member of the new
-      # cluster to all the other members of the cluster.  That means
-      # that for all the members of cluster1, we need to add in the
-      # distances to members of cluster2, and for all members of
-      # cluster2, we need to add in the distances to members of
-      # cluster1.
-      for cluster1_member in cluster_membership[cluster1]:
-        for cluster2_member in cluster_membership[cluster2]:
-          summed_distances[cluster1_member] += distance_matrix[cluster1_member][cluster2_member]
-
-      for cluster2_member in cluster_membership[int(cluster2)]:
-        for cluster1_member in cluster_membership[cluster1]:
-          summed_distances[cluster2_member] += distance_matrix[cluster2_member][cluster1_member]
-
-      min_summed_distance = None
-      max_summed_distance = None
-
-      exemplar_id = 0
-      for member in cluster_membership[cluster_id]:
-        if min_summed_distance is None or summed_distances[member] < min_summed_distance:
-          min_summed_distance = summed_distances[member]
-          exemplar_id = member
-
-        if max_summed_distance is None or summed_distances[member] > min_summed_distance:
-          max_summed_distance = summed_distances[member]
-
-      exemplars[cluster_id] = exemplar_id
+    resample = uniform_pla if arguments.cluster_sample_type == "uniform-pla" else uniform_paa
+    directories = list(itertools.repeat(directory_full_path, len(storage)))
+    min_times = list(itertools.repeat(time_min, len(storage)))
+    max_times = list(itertools.repeat(time_max, len(storage)))
+    bin_counts = list(itertools.repeat(_numSamples, len(storage)))
+    timeseries_indices = [timeseries for timeseries, attribute in storage]
+    attribute_indices = [attribute for timeseries, attribute in storage]
+    # Workers store each resampled waveform directly in a row of the matrix.
+    waveform_values = pool.map_rows(resample, (len(storage), _numSamples), "float64", directories, min_times, max_times, bin_counts, timeseries_indices, attribute_indices)
+    bin_edges = numpy.linspace(time_min, time_max, _numSamples + 1)
+    waveform_times = (bin_edges[:-1] + bin_edges[1:]) / 2
+
+    # Compute a distance matrix comparing every series to every other, storing it on disk ...
+    print("Computing distance matrix for %s" % name)
+    distances_path = os.path.join(dirname, "distances_%s.hdf5" % name)
+    with h5py.File(distances_path, "w") as distances_file:
+      distances = slycat.distance.create(distances_file, len(storage))
+      slycat.timeseries.condensed_distances(waveform_values, distances, block_size=arguments.distance_block_size, processes=arguments.distance_processes)
+
+      # Use the distance matrix to cluster observations ...
+      print("Clustering %s" % name)
+      linkage = slycat.distance.linkage(distances, method=str(arguments.cluster_type))
+
+      # Identify exemplar waveforms for each cluster ...
+      print("Identifying examplars for %s" % (name))
+      exemplars = slycat.timeseries.exemplars(linkage, slycat.distance.read(distances))
+    os.remove(distances_path)
 
     # Store the cluster.
     print("Storing %s" % name)
@@ -346,20 +286,20 @@ try:
       json.dump({
         "linkage": linkage.tolist(),
         "exemplars": exemplars,
-        "input-indices": [waveform["input-index"] for waveform in waveforms]
+        "input-indices": timeseries_indices
         }, file_cluster_n_out)
 
     arrayset_name = "preview-%s" % name
-    dimensions_array = numpy.empty(shape=(len(waveforms),), dtype=object)
-    attributes_array = numpy.empty(shape=(len(waveforms),), dtype=object)
-    waveform_times_array = numpy.empty(shape=(len(waveforms),), dtype=object)
-    waveform_values_array = numpy.empty(shape=(len(waveforms),), dtype=object)
+    dimensions_array = numpy.empty(shape=(len(storage),), dtype=object)
+    attributes_array = numpy.empty(shape=(len(storage),), dtype=object)
+    waveform_times_array = numpy.empty(shape=(len(storage),), dtype=object)
+    waveform_values_array = numpy.empty(shape=(len(storage),), dtype=object)
     
-    for index, waveform in enumerate(waveforms):
-      dimensions_array[index] = [dict(name="sample", end=len(waveform["times"]))]
+    for index in range(len(storage)):
+      dimensions_array[index] = [dict(name="sample", end=len(waveform_times))]
       attributes_array[index] = [dict(name="time", type="float64"), dict(name="value", type="float64")]
-      waveform_times_array[index] = waveform["times"]
-      waveform_values_array[index] = waveform["values"]
+      waveform_times_array[index] = waveform_times
+      waveform_values_array[index] = waveform_values[index]
 
     print("Creating array %s %s" % (attributes, dimensions))
     with open(os.path.join(dirname, "waveform_%s_dimensions.pickle" % name), "wb") as dimensions_file:
@@ -374,5 +314,7 @@ try:
 except:
   import traceback
   print(traceback.format_exc())
+finally:
+  pool.close()
 
 print("done.")
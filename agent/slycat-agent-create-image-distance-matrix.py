@@ -10,13 +10,25 @@
 This script loads data from a CSV file containing zero-or-more columns
 containing image variables (file: URIs that point to images on the local host).
 Distances between each pair of files is computed, and the resulting symmetric
-distance matrix is written to a CSV file.
+distance matrix is written in condensed form to an HDF5 file (see
+:mod:`slycat.distance`), a block of rows at a time.
 """
 
 import argparse
-import IPython.parallel
+import h5py
 import numpy
+import PIL
+import PIL.Image
 import re
+import scipy
+import scipy.spatial
+import scipy.spatial.distance
+import skimage
+import skimage.color
+import skimage.filter
+import slycat.distance
+import slycat.parallel
+import urlparse
 
 class ImageCache(object):
   def __init__(self):
@@ -157,6 +169,11 @@ def hamming_distance(left_index, right_index):
   return scipy.spatial.distance.hamming(left_image.ravel(), right_image.ravel())
 
 
+def distance_rows(measure, count, begin, end):
+  """Compute the condensed distances for rows begin through end-1."""
+  import numpy
+  return numpy.array([measure(i, j) for i in range(begin, end) for j in range(i + 1, count)], dtype="float64")
+
 # Map measure names to functions
 measures = {
   "jaccard" : jaccard_distance,
@@ -172,9 +189,12 @@ if __name__ == "__main__":
   parser = argparse.ArgumentParser()
   parser.add_argument("--distance-column", default=None, help="Name of a column containing images for computing distances.  Default: any detected image column.")
   parser.add_argument("input", help="Input CSV file containing image paths")
-  parser.add_argument("output", help="Output CSV file")
+  parser.add_argument("output", help="Output HDF5 file")
+  parser.add_argument("--block-size", type=int, default=100000, help="Approximate number of distances computed by each parallel task.  Default: %(default)s")
   parser.add_argument("--distance-measure", default="jaccard", help="Distance metric to be used. Options: jaccard, jaccard2 (for very light-colored images), one-norm, correlation, cosine, or hamming. For most image data, correlation or jaccard will yield best results.")
-  parser.add_argument("--profile", default=None, help="Name of the IPython profile to use")
+  parser.add_argument("--profile", default=None, help="Name of the IPython profile to use with the ipython parallel backend")
+  parser.add_argument("--parallel-backend", default="multiprocessing", choices=slycat.parallel.backends, help="Compute distances in local processes, or on a running IPython parallel cluster.  Default: %(default)s")
+  parser.add_argument("--processes", type=int, default=None, help="Number of local processes used by the multiprocessing backend.  Defaults to the number of CPUs.")
   arguments = parser.parse_args()
 
   ###########################################################################################
@@ -207,48 +227,29 @@ if __name__ == "__main__":
     raise Exception("You must specify a column containing images to be analyzed using --distance-column.  Available choices: %s" % (", ".join(image_columns)))
 
   ###########################################################################################
-  # Connect to our parallel workers, import required modules, and setup some globals
-  # for use by the parallel code.
+  # Start our parallel workers, import required modules, and setup some globals
+  # for use by the parallel code.  Each worker keeps its own image cache between tasks.
 
-  try:
-    workers = IPython.parallel.Client(profile=arguments.profile)[:]
-  except Exception, e:
-    print str(e)
-    raise Exception("A running IPython parallel cluster is required.")
-
-  workers.use_dill()
-  with workers.sync_imports():
-    import PIL
-    import PIL.Image
-    import numpy
-    import scipy
-    import scipy.spatial
-    import scipy.spatial.distance
-    import skimage
-    import skimage.color
-    import skimage.filter
-    import urlparse
-  workers.push({
-    "column": columns[arguments.distance_column],
-    "image_cache": ImageCache(),
-    })
+  pool = slycat.parallel.create(arguments.parallel_backend, processes=arguments.processes, profile=arguments.profile,
+    namespace={
+      "column": columns[arguments.distance_column],
+      "image_cache": ImageCache(),
+    },
+    imports=["PIL", "PIL.Image", "numpy", "scipy", "scipy.spatial", "scipy.spatial.distance", "skimage", "skimage.color", "skimage.filter", "urlparse"])
 
   ###########################################################################################
-  # Compute the distance between each pair of images.
+  # Compute the distance between each pair of images, a few blocks of rows per
+  # worker at a time, and store them in condensed form as they arrive.
 
-  left, right = numpy.triu_indices(len(column), k=1)
+  count = len(columns[arguments.distance_column])
   measure = measures[arguments.distance_measure]
-  distances = workers.map_sync(measure, left, right)
-
-  ###########################################################################################
-  # Convert the distances into a symmetric matrix and dump it to CSV.
-
-  distance_matrix = scipy.spatial.distance.squareform(distances)
-
-  with open(arguments.output, "w") as file:
-    file.write(",".join(numpy.arange(len(column)).astype("string")))
-    file.write("\n")
-    for row in distance_matrix:
-      file.write(",".join(row.astype("string")))
-      file.write("\n")
-
+  blocks = slycat.distance.row_blocks(count, arguments.block_size)
+  wave_size = 4 * pool.size
+
+  with pool, h5py.File(arguments.output, "w") as file:
+    distances = slycat.distance.create(file, count)
+    for wave in range(0, len(blocks), wave_size):
+      begins, ends = zip(*blocks[wave:wave + wave_size])
+      results = pool.map(distance_rows, [measure] * len(begins), [count] * len(begins), begins, ends)
+      for begin, result in zip(begins, results):
+        slycat.distance.write(distances, begin, result)
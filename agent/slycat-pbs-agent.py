@@ -125,18 +125,9 @@ class Agent(agent.Agent):
         f.write("unlimit\n")
         f.write("module load slycat\n")
 
-        f.write("echo \"++ Slycat job: launching ipcontroller at `date`\"\n")
-        f.write("ipcontroller --ip='*' &\n")
-        f.write("sleep 20\n")
-        f.write("echo \"++ Slycat job: launching ipython engines at `date`\"\n")
-        f.write("ipengine --location=$exechost &\n")
-        f.write("sleep 1\n")
-        f.write("ipengine --location=$exechost &\n")
-        f.write("sleep 1\n")
-        f.write("ipengine --location=$exechost &\n")
-        f.write("sleep 1\n")
-        f.write("ipengine --location=$exechost &\n")
-        f.write("sleep 20\n")
+        # The job runs on a single node, so computations use local worker processes.
+        f.write("set parallel_backend=multiprocessing\n")
+        f.write("set profile=\n")
         f.write("echo \"++ Slycat job: launching hdf5 conversion at `date`\"\n")
 
         for c in fn:
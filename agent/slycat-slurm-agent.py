@@ -110,15 +110,21 @@ class Agent(agent.Agent):
         f.write("#SBATCH --time=%s:%s:%s\n" % (time_hours, time_minutes, time_seconds))
         f.write("source /etc/profile.d/modules.sh\n")
         f.write("module load %s\n" % module_name)
-        f.write("profile=slurm_${SLURM_JOB_ID}_$(hostname)\n")
-        f.write("echo \"Creating profile ${profile}\"\n")
-        f.write("ipython profile create --parallel --profile=${profile}\n")
-        f.write("echo \"Launching controller\"\n")
-        f.write("ipcontroller --ip='*' --profile=${profile} &\n")
-        f.write("sleep 1m\n")
-        f.write("echo \"Launching engines\"\n")
-        f.write("srun ipengine --profile=${profile} --location=$(hostname) &\n")
-        f.write("sleep 1m\n")
+        if int(nnodes) > 1:
+            # Only computations spanning several nodes need an IPython cluster.
+            f.write("parallel_backend=ipython\n")
+            f.write("profile=slurm_${SLURM_JOB_ID}_$(hostname)\n")
+            f.write("echo \"Creating profile ${profile}\"\n")
+            f.write("ipython profile create --parallel --profile=${profile}\n")
+            f.write("echo \"Launching controller\"\n")
+            f.write("ipcontroller --ip='*' --profile=${profile} &\n")
+            f.write("sleep 1m\n")
+            f.write("echo \"Launching engines\"\n")
+            f.write("srun ipengine --profile=${profile} --location=$(hostname) &\n")
+            f.write("sleep 1m\n")
+        else:
+            f.write("parallel_backend=multiprocessing\n")
+            f.write("profile=\n")
         f.write("echo \"Launching job\"\n")
 
         for c in fn:
@@ -1,9 +1,101 @@
+# Generate CCA models of increasing size to measure CCA model performance.
+#
+# By default, models are created on a Slycat server, and their timings can be
+# collected afterwards with cca-performance-extract.py.  With --local, the same
+# seeded data are analyzed in-process instead, comparing slycat.cca.cca against
+# the legacy implementation that computed structure correlations one
+# (component, variable) pair at a time, and comparing slycat.cca.cca_batch
+# against repeated calls for a set of output permutations.
+
 import numpy
+import scipy.linalg
+import scipy.stats
+import slycat.cca
 import slycat.web.client
+import time
+
+def legacy_cca(X, Y, scale_inputs=True, significant_digits=None):
+  for column in numpy.column_stack((X, Y)).T:
+    if column.min() == column.max():
+      raise ValueError("Columns in X and Y cannot be constant.")
+
+  eps = numpy.finfo("double").eps
+  if significant_digits is None or significant_digits > numpy.abs(numpy.log10(eps)):
+    significant_digits = numpy.abs(numpy.log10(eps))
+
+  n = X.shape[0]
+  p1 = X.shape[1]
+  p2 = Y.shape[1]
+
+  X -= X.mean(axis=0)
+  Y -= Y.mean(axis=0)
+
+  if scale_inputs:
+    X /= X.std(axis=0)
+    Y /= Y.std(axis=0)
+
+  Q1, R1, P1 = scipy.linalg.qr(X, mode="economic", pivoting=True)
+  Q2, R2, P2 = scipy.linalg.qr(Y, mode="economic", pivoting=True)
+
+  Xrank = numpy.sum(numpy.abs(numpy.diag(R1)) > 10**(numpy.log10(numpy.abs(R1[0,0])) - significant_digits) * max(n, p1))
+  Yrank = numpy.sum(numpy.abs(numpy.diag(R2)) > 10**(numpy.log10(numpy.abs(R2[0,0])) - significant_digits) * max(n, p2))
+
+  L, D, M = scipy.linalg.svd(numpy.dot(Q1.T, Q2), full_matrices=False)
+
+  d = min(Xrank, Yrank)
+  L = L[:,:d]
+  M = M[:d,:]
+
+  A = numpy.linalg.solve(R1, L)
+  B = numpy.linalg.solve(R2, M.T)
+
+  A *= numpy.sqrt(n - 1)
+  B *= numpy.sqrt(n - 1)
+
+  A[P1] = numpy.copy(A)
+  B[P2] = numpy.copy(B)
+
+  x = numpy.dot(X, A)
+  y = numpy.dot(Y, B)
+
+  x_loadings = numpy.array([[scipy.stats.pearsonr(i, j)[0] for j in X.T] for i in x.T]).T
+  y_loadings = numpy.array([[scipy.stats.pearsonr(i, j)[0] for j in Y.T] for i in y.T]).T
+
+  r = numpy.minimum(numpy.maximum(D[:d], 0), 1)
+
+  nondegenerate = r < 1
+  wilks = numpy.exp(numpy.cumsum(numpy.log(1-(r[nondegenerate] ** 2))[::-1])[::-1])
+
+  return x, y, x_loadings, y_loadings, r, wilks
+
+def generate_data(rows, columns):
+  numpy.random.seed(1234)
+  return numpy.column_stack([numpy.random.normal(size=rows) for i in numpy.arange(columns)])
+
+def timed(function, *args, **kwargs):
+  start = time.time()
+  result = function(*args, **kwargs)
+  return time.time() - start, result
+
+def benchmark_model(rows, columns, repetition):
+  data = generate_data(rows, columns)
+  X = data[:, :columns // 2]
+  Y = data[:, columns // 2:]
+
+  legacy_time, legacy = timed(legacy_cca, X.copy(), Y.copy())
+  vectorized_time, vectorized = timed(slycat.cca.cca, X.copy(), Y.copy())
+  matches = all([numpy.allclose(a, b) for a, b in zip(legacy, vectorized)])
+
+  permutations = [Y[numpy.random.permutation(rows)] for i in range(arguments.permutations)]
+  repeated_time, repeated = timed(lambda: [slycat.cca.cca(X.copy(), permutation.copy()) for permutation in permutations])
+  batch_time, batch = timed(slycat.cca.cca_batch, X.copy(), [permutation.copy() for permutation in permutations])
+  matches = matches and all([numpy.allclose(a, b) for results in zip(repeated, batch) for a, b in zip(*results)])
+
+  print "%8s %8s %4s %12.4f %12.4f %8.1fx %12.4f %12.4f %8.1fx %s" % (rows, columns, repetition + 1, legacy_time, vectorized_time, legacy_time / vectorized_time, repeated_time, batch_time, repeated_time / batch_time, "" if matches else "results differ!")
 
 def create_model(rows, columns, repetition):
   print "Creating model with %s rows, %s columns ..." % (rows, columns)
-  numpy.random.seed(1234)
+  data = generate_data(rows, columns)
 
   pid = connection.find_or_create_project("cca-performance-final")
   mid = connection.post_project_models(pid, "cca", "%s x %s %s" % (rows, columns, repetition + 1), arguments.marking)
@@ -14,7 +106,7 @@ def create_model(rows, columns, repetition):
   connection.put_model_arrayset_array(mid, "data-table", 0, dimensions, attributes)
 
   for i in numpy.arange(columns):
-    connection.put_model_arrayset_data(mid, "data-table", (0, i, numpy.index_exp[...], numpy.random.normal(size=rows)))
+    connection.put_model_arrayset_data(mid, "data-table", (0, i, numpy.index_exp[...], data[:, i]))
 
   connection.put_model_parameter(mid, "input-columns", range(0, columns // 2))
   connection.put_model_parameter(mid, "output-columns", range(columns // 2, columns))
@@ -27,19 +119,32 @@ parser = slycat.web.client.ArgumentParser()
 parser.add_argument("--marking", default="", help="Marking type.  Default: %(default)s")
 parser.add_argument("--start-columns", type=int, default=4, help="Start index.  Default: %(default)s")
 parser.add_argument("--start-rows", type=int, default=10, help="Start index.  Default: %(default)s")
+parser.add_argument("--stop-columns", type=int, default=1024, help="Largest number of columns.  Default: %(default)s")
+parser.add_argument("--stop-rows", type=int, default=1000000, help="Largest number of rows.  Default: %(default)s")
+parser.add_argument("--repetitions", type=int, default=3, help="Number of times each size is repeated.  Default: %(default)s")
+parser.add_argument("--local", default=False, action="store_true", help="Benchmark slycat.cca in-process instead of creating models on a server.")
+parser.add_argument("--permutations", type=int, default=10, help="Number of output permutations analyzed with --local.  Default: %(default)s")
 arguments = parser.parse_args()
-connection = slycat.web.client.connect(arguments)
+
+if arguments.local:
+  print "%8s %8s %4s %12s %12s %9s %12s %12s %9s" % ("rows", "columns", "rep", "legacy (s)", "cca (s)", "speedup", "repeated (s)", "batch (s)", "speedup")
+else:
+  connection = slycat.web.client.connect(arguments)
 
 for columns in [4, 8, 16, 32, 64, 128, 256, 512, 1024]:
   for rows in [10, 100, 1000, 10000, 100000, 1000000]:
     if columns < arguments.start_columns or (columns == arguments.start_columns and rows < arguments.start_rows):
       continue
+    if columns > arguments.stop_columns or rows > arguments.stop_rows:
+      continue
     if rows <= columns:
       continue
     if columns == 512 and rows > 100000:
       continue
     if columns == 1024 and rows > 10000:
       continue
-    for repetition in range(3):
-      create_model(rows, columns, repetition)
-
+    for repetition in range(arguments.repetitions):
+      if arguments.local:
+        benchmark_model(rows, columns, repetition)
+      else:
+        create_model(rows, columns, repetition)
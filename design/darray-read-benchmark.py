@@ -0,0 +1,68 @@
+# Compare peak memory and latency of reading a large float64 attribute through
+# slycat.hdf5.DArray.get_data() against the legacy always-astype() read path.
+#
+# Each measurement runs in a fresh child process, since peak RSS only ever grows.
+
+import argparse
+import h5py
+import numpy
+import os
+import resource
+import shutil
+import slycat.hdf5
+import subprocess
+import sys
+import tempfile
+import time
+
+def create(path, rows):
+  with h5py.File(path, "w") as file:
+    arrayset = slycat.hdf5.start_arrayset(file)
+    array = arrayset.start_array(0, [dict(name="row", end=rows)], [dict(name="value", type="float64"), dict(name="single", type="float")])
+    array.set_data(0, Ellipsis, numpy.random.normal(size=rows))
+    array.set_data(1, Ellipsis, numpy.random.normal(size=rows).astype("float32"))
+
+def measure(path, mode, attribute):
+  with h5py.File(path, "r") as file:
+    array = slycat.hdf5.ArraySet(file)[0]
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    if mode == "legacy":
+      data = file["array/0/attribute/%s" % attribute][...].astype(array.attributes[attribute]["type"])
+    elif mode == "get_data":
+      data = array.get_data(attribute)[...]
+    elif mode == "read_direct":
+      data = numpy.empty(array.shape, dtype="float64")
+      array.get_data(attribute).read_direct(data)
+    elapsed = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # ru_maxrss is reported in kilobytes on Linux.
+  print "%s %s" % (elapsed, (peak - baseline) / 1024.0)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--rows", type=int, default=10000000, help="Number of rows to read.  Default: %(default)s")
+parser.add_argument("--repetitions", type=int, default=3, help="Number of times to repeat each measurement.  Default: %(default)s")
+parser.add_argument("--measure", nargs=3, default=None, help=argparse.SUPPRESS)
+arguments = parser.parse_args()
+
+if arguments.measure is not None:
+  measure(arguments.measure[0], arguments.measure[1], int(arguments.measure[2]))
+  sys.exit(0)
+
+directory = tempfile.mkdtemp()
+try:
+  path = os.path.join(directory, "benchmark.hdf5")
+  print "Creating %s rows ..." % arguments.rows
+  create(path, arguments.rows)
+
+  print "%-12s %-10s %12s %14s" % ("mode", "attribute", "seconds", "peak RSS (MB)")
+  for attribute, name in [(0, "float64"), (1, "float")]:
+    for mode in ["legacy", "get_data", "read_direct"]:
+      results = []
+      for repetition in range(arguments.repetitions):
+        output = subprocess.check_output([sys.executable, __file__, "--measure", path, mode, str(attribute)])
+        results.append([float(value) for value in output.split()])
+      elapsed, peak = numpy.median(results, axis=0)
+      print "%-12s %-10s %12.3f %14.1f" % (mode, name, elapsed, peak)
+finally:
+  shutil.rmtree(directory)
@@ -0,0 +1,84 @@
+# Compare the cost of computing timeseries distance matrices and cluster
+# exemplars with slycat.timeseries against the legacy pure-Python loops that
+# slycat-agent-compute-timeseries.py used to run.
+#
+# The legacy implementation is only measured up to --legacy-limit series, since
+# it takes hours beyond that.  The dense distance matrix needs 8 * n * n bytes,
+# so the largest default size needs roughly 20 GB of memory.  Exemplars aren't
+# compared, since the legacy code broke ties between equally central members
+# in set iteration order.
+
+import argparse
+import numpy
+import scipy.cluster.hierarchy
+import scipy.spatial.distance
+import slycat.timeseries
+import time
+
+def legacy_distance_matrix(waveforms):
+  count = len(waveforms)
+  distances = numpy.zeros(shape=(count, count))
+  for i in range(0, count):
+    for j in range(i + 1, count):
+      distance = numpy.sqrt(numpy.sum(numpy.power(waveforms[j] - waveforms[i], 2.0)))
+      distances[i, j] = distance
+      distances[j, i] = distance
+  return distances
+
+def legacy_exemplars(linkage, distances):
+  count = len(linkage) + 1
+  summed_distances = numpy.zeros(shape=(count))
+  exemplars = dict()
+  cluster_membership = []
+  for i in range(count):
+    exemplars[i] = i
+    cluster_membership.append(set([i]))
+  for i in range(len(linkage)):
+    cluster1, cluster2 = int(linkage[i][0]), int(linkage[i][1])
+    cluster_membership.append(cluster_membership[cluster1].union(cluster_membership[cluster2]))
+    for cluster1_member in cluster_membership[cluster1]:
+      for cluster2_member in cluster_membership[cluster2]:
+        summed_distances[cluster1_member] += distances[cluster1_member][cluster2_member]
+    for cluster2_member in cluster_membership[cluster2]:
+      for cluster1_member in cluster_membership[cluster1]:
+        summed_distances[cluster2_member] += distances[cluster2_member][cluster1_member]
+    min_summed_distance = None
+    exemplar_id = 0
+    for member in cluster_membership[i + count]:
+      if min_summed_distance is None or summed_distances[member] < min_summed_distance:
+        min_summed_distance = summed_distances[member]
+        exemplar_id = member
+    exemplars[i + count] = exemplar_id
+  return exemplars
+
+def timed(function, *args, **kwargs):
+  start = time.time()
+  result = function(*args, **kwargs)
+  return time.time() - start, result
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 5000, 10000, 20000, 50000], help="Numbers of timeseries to cluster.  Default: %(default)s")
+parser.add_argument("--samples", type=int, default=1000, help="Number of samples per timeseries.  Default: %(default)s")
+parser.add_argument("--block-size", type=int, default=1024, help="Number of waveforms compared at a time.  Default: %(default)s")
+parser.add_argument("--processes", type=int, default=1, help="Number of local processes used to compute distances.  Default: %(default)s")
+parser.add_argument("--legacy-limit", type=int, default=2000, help="Largest size measured with the legacy implementation.  Default: %(default)s")
+parser.add_argument("--cluster-type", default="average", choices=["single", "complete", "average", "weighted"], help="Hierarchical clustering method.  Default: %(default)s")
+arguments = parser.parse_args()
+
+print "%-8s %-10s %12s %12s %12s" % ("series", "mode", "distance (s)", "linkage (s)", "exemplar (s)")
+for size in arguments.sizes:
+  waveforms = numpy.random.normal(size=(size, arguments.samples)).cumsum(axis=1)
+
+  distance_time, distances = timed(slycat.timeseries.distance_matrix, waveforms, block_size=arguments.block_size, processes=arguments.processes)
+  linkage_time, linkage = timed(scipy.cluster.hierarchy.linkage, scipy.spatial.distance.squareform(distances, checks=False), method=arguments.cluster_type)
+  exemplar_time, exemplars = timed(slycat.timeseries.exemplars, linkage, distances)
+  print "%-8s %-10s %12.3f %12.3f %12.3f" % (size, "vectorized", distance_time, linkage_time, exemplar_time)
+
+  if size <= arguments.legacy_limit:
+    legacy_distance_time, legacy_distances = timed(legacy_distance_matrix, waveforms)
+    legacy_exemplar_time, legacy = timed(legacy_exemplars, linkage, distances)
+    print "%-8s %-10s %12.3f %12.3f %12.3f" % (size, "legacy", legacy_distance_time, linkage_time, legacy_exemplar_time)
+    if not numpy.allclose(distances, legacy_distances):
+      print "  distance matrices differ!"
+
+  del distances
@@ -22,6 +22,11 @@ Feature: Slycat Agent
     When an unknown command is received
     Then the agent should return an unknown command error
 
+  Scenario: Multiplexed commands
+    Given a running Slycat agent
+    When multiplexing is requested
+    Then the agent should return responses framed with command ids
+
   # Browse command
 
   Scenario: Browse without path
@@ -44,6 +49,11 @@ Feature: Slycat Agent
     When browsing a directory
     Then the agent should return the directory information
 
+  Scenario: Revalidate directory
+    Given a running Slycat agent
+    When revalidating a directory
+    Then the agent should return a directory not modified response
+
   Scenario: Browse directory with file reject rule
     Given a running Slycat agent
     When browsing a directory with a file reject rule
@@ -108,6 +118,24 @@ Feature: Slycat Agent
     When retrieving a file
     Then the agent should return the csv file
 
+  Scenario: Get part of a csv file
+    Given a running Slycat agent
+    And a sample csv file
+    When retrieving a byte range from a file
+    Then the agent should return the byte range
+
+  Scenario: Get part of a csv file in chunks
+    Given a running Slycat agent
+    And a sample csv file
+    When retrieving a byte range from a file in compressed chunks
+    Then the agent should return the byte range in chunks
+
+  Scenario: Get a csv file in chunks without a length
+    Given a running Slycat agent
+    And a sample csv file
+    When retrieving a file in chunks without a length
+    Then the agent should return a missing length error
+
   # Image retrieval
 
   Scenario: Get image without path
@@ -158,6 +186,12 @@ Feature: Slycat Agent
     When retrieving an image with maximum size
     Then the agent should return a jpeg image with maximum size
 
+  Scenario: Revalidate jpeg image
+    Given a running Slycat agent
+    And a sample jpeg image
+    When revalidating an image
+    Then the agent should return an image not modified response
+
   Scenario: Get jpeg image converted to png image
     Given a running Slycat agent
     And a sample jpeg image
@@ -13,6 +13,7 @@ import sys
 import subprocess
 import tempfile
 import time
+import zlib
 
 root_dir = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 data_dir = os.path.join(root_dir, "features/data/agent")
@@ -96,6 +97,20 @@ def step_impl(context):
   nose.tools.assert_in("sizes", listing)
   nose.tools.assert_equal(listing["types"], ["f", "f", "f", "d"])
 
+@when(u'revalidating a directory')
+def step_impl(context):
+  context.agent.stdin.write("%s\n" % json.dumps({"action":"browse", "path":data_dir}))
+  context.agent.stdin.flush()
+  listing = json.loads(context.agent.stdout.readline())
+  context.agent.stdin.write("%s\n" % json.dumps({"action":"browse", "path":data_dir, "mtime":listing["mtime"]}))
+  context.agent.stdin.flush()
+
+@then(u'the agent should return a directory not modified response')
+def step_impl(context):
+  listing = json.loads(context.agent.stdout.readline())
+  nose.tools.assert_equal(listing["message"], "Directory not modified.")
+  nose.tools.assert_not_in("names", listing)
+
 @when(u'browsing a directory with a file reject rule')
 def step_impl(context):
   context.agent.stdin.write("%s\n" % json.dumps({"action":"browse", "file-reject":"[.]png$", "path":data_dir}))
@@ -160,6 +175,31 @@ def step_impl(context):
   nose.tools.assert_equal(listing["sizes"], [16])
   nose.tools.assert_equal(listing["types"], ["f"])
 
+#########################################################################################
+# Multiplexing
+
+@when(u'multiplexing is requested')
+def step_impl(context):
+  context.agent.stdin.write("%s\n" % json.dumps({"action":"multiplex"}))
+  context.agent.stdin.flush()
+  response = json.loads(context.agent.stdout.readline())
+  nose.tools.assert_true(response["ok"])
+  nose.tools.assert_equal(response["protocol"], 2)
+
+@then(u'the agent should return responses framed with command ids')
+def step_impl(context):
+  context.agent.stdin.write("%s\n" % json.dumps({"action":"browse", "path":data_dir, "id":0}))
+  context.agent.stdin.write("%s\n" % json.dumps({"action":"browse", "path":"foo", "id":1}))
+  context.agent.stdin.flush()
+
+  responses = {}
+  for i in range(2):
+    frame = json.loads(context.agent.stdout.readline())
+    responses[frame["id"]] = json.loads(context.agent.stdout.read(frame["size"]))
+  nose.tools.assert_equal(sorted(responses.keys()), [0, 1])
+  nose.tools.assert_in("slycat-logo.png", responses[0]["names"])
+  nose.tools.assert_equal(responses[1], {"ok": False, "message": "Path must be absolute."})
+
 #########################################################################################
 # File retrieval
 
@@ -212,6 +252,52 @@ def step_impl(context):
   reference = "a,b\n1,2\n3,4\n5,6\n"
   nose.tools.assert_equal(content, reference)
 
+@when(u'retrieving a byte range from a file')
+def step_impl(context):
+  context.agent.stdin.write("%s\n" % json.dumps({"action":"get-file", "path":context.path, "offset":4, "length":8}))
+  context.agent.stdin.flush()
+
+@then(u'the agent should return the byte range')
+def step_impl(context):
+  metadata = json.loads(context.agent.stdout.readline())
+  nose.tools.assert_equal(metadata["message"], "File retrieved.")
+  nose.tools.assert_equal(metadata["size"], 8)
+  nose.tools.assert_equal(metadata["file-size"], 16)
+  content = context.agent.stdout.read(metadata["size"])
+  nose.tools.assert_equal(content, "1,2\n3,4\n")
+
+@when(u'retrieving a byte range from a file in compressed chunks')
+def step_impl(context):
+  context.agent.stdin.write("%s\n" % json.dumps({"action":"get-file", "path":context.path, "offset":4, "length":8, "chunk-size":4, "compression":"zlib"}))
+  context.agent.stdin.flush()
+
+@then(u'the agent should return the byte range in chunks')
+def step_impl(context):
+  metadata = json.loads(context.agent.stdout.readline())
+  nose.tools.assert_equal(metadata["message"], "File retrieved.")
+  nose.tools.assert_equal(metadata["chunks"], 2)
+  nose.tools.assert_equal(metadata["file-size"], 16)
+  content = StringIO.StringIO(context.agent.stdout.read(metadata["size"]))
+  chunks = []
+  for i in range(metadata["chunks"]):
+    chunk = json.loads(content.readline())
+    data = content.read(chunk["size"])
+    if chunk["encoding"] == "zlib":
+      data = zlib.decompress(data)
+    nose.tools.assert_equal(chunk["offset"], 4 + 4 * i)
+    nose.tools.assert_equal(zlib.crc32(data) & 0xffffffff, chunk["crc32"])
+    chunks.append(data)
+  nose.tools.assert_equal(chunks, ["1,2\n", "3,4\n"])
+
+@when(u'retrieving a file in chunks without a length')
+def step_impl(context):
+  context.agent.stdin.write("%s\n" % json.dumps({"action":"get-file", "path":context.path, "chunk-size":4}))
+  context.agent.stdin.flush()
+
+@then(u'the agent should return a missing length error')
+def step_impl(context):
+  nose.tools.assert_equal(json.loads(context.agent.stdout.readline()), {"ok": False, "message": "Chunked transfers require a length."})
+
 ###########################################################################################
 # Image retrieval
 
@@ -244,6 +330,22 @@ def step_impl(context):
 def step_impl(context):
   nose.tools.assert_equal(json.loads(context.agent.stdout.readline()), {"ok": False, "message": "Unsupported image type."})
 
+@when(u'revalidating an image')
+def step_impl(context):
+  context.agent.stdin.write("%s\n" % json.dumps({"action":"get-image", "max-width":200, "content-type":"image/jpeg", "path":context.path}))
+  context.agent.stdin.flush()
+  metadata = json.loads(context.agent.stdout.readline())
+  context.agent.stdout.read(metadata["size"])
+  context.agent.stdin.write("%s\n" % json.dumps({"action":"get-image", "max-width":200, "content-type":"image/jpeg", "path":context.path, "etag":metadata["etag"]}))
+  context.agent.stdin.flush()
+
+@then(u'the agent should return an image not modified response')
+def step_impl(context):
+  metadata = json.loads(context.agent.stdout.readline())
+  nose.tools.assert_equal(metadata["message"], "Image not modified.")
+  nose.tools.assert_equal(metadata["size"], 0)
+  nose.tools.assert_in("mtime", metadata)
+
 @when(u'retrieving an image with maximum width')
 def step_impl(context):
   context.agent.stdin.write("%s\n" % json.dumps({"action":"get-image", "max-width":200, "content-type":"image/jpeg", "path":context.path}))
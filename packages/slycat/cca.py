@@ -5,43 +5,9 @@
 import numbers
 import numpy
 import scipy.linalg
-import scipy.stats
 import slycat.email
 
-def cca(X, Y, scale_inputs=True, force_positive=None, significant_digits=None):
-  """Compute Canonical Correlation Analysis (CCA).
-
-  Parameters
-  ----------
-  X : numpy.ndarray
-    :math:`M \\times I` matrix containing :math:`M` observations and :math:`I` input features.
-  Y : numpy.ndarray
-    :math:`M \\times O` matrix containing :math:`M` observations and :math:`O` output features.
-  scale_inputs : bool, optional
-    Scale input and output features to unit variance.
-  force_positive : integer, optional
-    If specified, flip signs in the `x`, `y`, `x_loadings`, and `y_loadings` output values so
-    that the values in row :math:`n` of `y_loadings` are all positive.
-  significant_digits: integer, optional
-    Optionally specify the number of significant digits used to compute the `X` and `Y` ranks.
-
-  Returns
-  -------
-  x : numpy.ndarray
-    :math:`M \\times C` matrix containing input metavariable values for :math:`M` observations and :math:`C` CCA components.
-  y : numpy.ndarray
-    :math:`M \\times C` matrix containing output metavariable values for :math:`M` observations and :math:`C` CCA components.
-  x_loadings : numpy.ndarray
-    :math:`I \\times C` matrix containing weights for :math:`I` input variables and :math:`C` CCA components.
-  y_loadings : numpy.ndarray
-    :math:`O \\times C` matrix containing weights for :math:`O` output variables and :math:`C` CCA components.
-  r2 : numpy.ndarray
-    length-:math:`C` vector containing :math:`r^2` values for :math:`C` CCA components.
-  wilks : numpy.ndarray
-    length-:math:`C` vector containing the likelihood-ratio for :math:`C` CCA components.
-  """
-
-  # Validate our inputs ...
+def _validate(X, Y, scale_inputs, force_positive, significant_digits):
   if not isinstance(X, numpy.ndarray) or not isinstance(Y, numpy.ndarray):
     slycat.email.send_error("cca.py", "X and Y must be numpy.ndarray instances.")
     raise TypeError("X and Y must be numpy.ndarray instances.")
@@ -57,10 +23,6 @@ def cca(X, Y, scale_inputs=True, force_positive=None, significant_digits=None):
   if X.shape[1] < 1 or Y.shape[1] < 1:
     slycat.email.send_error("cca.py", "X and Y must each contain at least one column.")
     raise ValueError("X and Y must each contain at least one column.")
-  for column in numpy.column_stack((X, Y)).T:
-    if column.min() == column.max():
-      slycat.email.send_error("cca.py", "Columns in X and Y cannot be constant.")
-      raise ValueError("Columns in X and Y cannot be constant.")
   if not isinstance(scale_inputs, bool):
     slycat.email.send_error("cca.py", "scale_inputs must be a boolean.")
     raise TypeError("scale_inputs must be a boolean.")
@@ -74,29 +36,42 @@ def cca(X, Y, scale_inputs=True, force_positive=None, significant_digits=None):
     slycat.email.send_error("cca.py", "significant_digits must be an integer or None.")
     raise TypeError("significant_digits must be an integer or None.")
 
+def _require_nonconstant(data):
+  if numpy.any(data.min(axis=0) == data.max(axis=0)):
+    slycat.email.send_error("cca.py", "Columns in X and Y cannot be constant.")
+    raise ValueError("Columns in X and Y cannot be constant.")
+
+def _factor(data, scale_inputs, significant_digits):
+  """Center (and optionally scale) data in place, returning its pivoted QR factorization and numerical rank."""
   eps = numpy.finfo("double").eps
   if significant_digits is None or significant_digits > numpy.abs(numpy.log10(eps)):
     significant_digits = numpy.abs(numpy.log10(eps))
 
-  n = X.shape[0]
-  p1 = X.shape[1]
-  p2 = Y.shape[1]
-
-  X -= X.mean(axis=0)
-  Y -= Y.mean(axis=0)
-
+  n, p = data.shape
+  data -= data.mean(axis=0)
   if scale_inputs:
-    X /= X.std(axis=0)
-    Y /= Y.std(axis=0)
-
-  Q1, R1, P1 = scipy.linalg.qr(X, mode="economic", pivoting=True)
-  Q2, R2, P2 = scipy.linalg.qr(Y, mode="economic", pivoting=True)
-
-  Xrank = numpy.sum(numpy.abs(numpy.diag(R1)) > 10**(numpy.log10(numpy.abs(R1[0,0])) - significant_digits) * max(n, p1))
-  Yrank = numpy.sum(numpy.abs(numpy.diag(R2)) > 10**(numpy.log10(numpy.abs(R2[0,0])) - significant_digits) * max(n, p2))
+    data /= data.std(axis=0)
+
+  Q, R, P = scipy.linalg.qr(data, mode="economic", pivoting=True)
+  rank = numpy.sum(numpy.abs(numpy.diag(R)) > 10**(numpy.log10(numpy.abs(R[0,0])) - significant_digits) * max(n, p))
+  return Q, R, P, rank
+
+def _structure_correlations(data, variates):
+  """Return the correlation between every column of `data` and every column of `variates`, both already centered."""
+  data_norms = numpy.sqrt(numpy.einsum("ij,ij->j", data, data))
+  variate_norms = numpy.sqrt(numpy.einsum("ij,ij->j", variates, variates))
+  correlations = numpy.dot(data.T, variates)
+  correlations /= data_norms[:, None]
+  correlations /= variate_norms[None, :]
+  return numpy.clip(correlations, -1, 1, out=correlations)
+
+def _cca(X, Y, x_factors, y_factors, force_positive):
+  n = X.shape[0]
+  Q1, R1, P1, Xrank = x_factors
+  Q2, R2, P2, Yrank = y_factors
 
   # We validate this here, to avoid computing the rank twice.
-  if X.shape[0] < Xrank or X.shape[0] < Yrank:
+  if n < Xrank or n < Yrank:
     slycat.email.send_error("cca.py", "Number of rows must be >= rank(X), and >= rank(Y).")
     raise ValueError("Number of rows must be >= rank(X), and >= rank(Y).")
 
@@ -118,16 +93,16 @@ def cca(X, Y, scale_inputs=True, force_positive=None, significant_digits=None):
   x = numpy.dot(X, A)
   y = numpy.dot(Y, B)
 
-  x_loadings = numpy.array([[scipy.stats.pearsonr(i, j)[0] for j in X.T] for i in x.T]).T
-  y_loadings = numpy.array([[scipy.stats.pearsonr(i, j)[0] for j in Y.T] for i in y.T]).T
+  # X and Y are centered, so their canonical variates are too.
+  x_loadings = _structure_correlations(X, x)
+  y_loadings = _structure_correlations(Y, y)
 
   if force_positive is not None:
-    for j in range(y_loadings.shape[1]):
-      if y_loadings[force_positive, j] < 0:
-        x_loadings[:,j] = -x_loadings[:,j]
-        y_loadings[:,j] = -y_loadings[:,j]
-        x[:,j] = -x[:,j]
-        y[:,j] = -y[:,j]
+    signs = numpy.where(y_loadings[force_positive] < 0, -1.0, 1.0)
+    x_loadings *= signs
+    y_loadings *= signs
+    x *= signs
+    y *= signs
 
   r = numpy.minimum(numpy.maximum(D[:d], 0), 1)
 
@@ -136,3 +111,77 @@ def cca(X, Y, scale_inputs=True, force_positive=None, significant_digits=None):
 
   return x, y, x_loadings, y_loadings, r, wilks
 
+def cca(X, Y, scale_inputs=True, force_positive=None, significant_digits=None):
+  """Compute Canonical Correlation Analysis (CCA).
+
+  Parameters
+  ----------
+  X : numpy.ndarray
+    :math:`M \\times I` matrix containing :math:`M` observations and :math:`I` input features.
+  Y : numpy.ndarray
+    :math:`M \\times O` matrix containing :math:`M` observations and :math:`O` output features.
+  scale_inputs : bool, optional
+    Scale input and output features to unit variance.
+  force_positive : integer, optional
+    If specified, flip signs in the `x`, `y`, `x_loadings`, and `y_loadings` output values so
+    that the values in row :math:`n` of `y_loadings` are all positive.
+  significant_digits: integer, optional
+    Optionally specify the number of significant digits used to compute the `X` and `Y` ranks.
+
+  Returns
+  -------
+  x : numpy.ndarray
+    :math:`M \\times C` matrix containing input metavariable values for :math:`M` observations and :math:`C` CCA components.
+  y : numpy.ndarray
+    :math:`M \\times C` matrix containing output metavariable values for :math:`M` observations and :math:`C` CCA components.
+  x_loadings : numpy.ndarray
+    :math:`I \\times C` matrix containing weights for :math:`I` input variables and :math:`C` CCA components.
+  y_loadings : numpy.ndarray
+    :math:`O \\times C` matrix containing weights for :math:`O` output variables and :math:`C` CCA components.
+  r2 : numpy.ndarray
+    length-:math:`C` vector containing :math:`r^2` values for :math:`C` CCA components.
+  wilks : numpy.ndarray
+    length-:math:`C` vector containing the likelihood-ratio for :math:`C` CCA components.
+
+  Notes
+  -----
+  `X` and `Y` are centered (and scaled, if requested) in place.
+  """
+
+  _validate(X, Y, scale_inputs, force_positive, significant_digits)
+  _require_nonconstant(X)
+  _require_nonconstant(Y)
+  return _cca(X, Y, _factor(X, scale_inputs, significant_digits), _factor(Y, scale_inputs, significant_digits), force_positive)
+
+def cca_batch(X, Ys, scale_inputs=True, force_positive=None, significant_digits=None):
+  """Compute Canonical Correlation Analysis (CCA) between one set of inputs and several sets of outputs.
+
+  `X` is only centered, scaled, and factored once, so this is much cheaper than
+  calling :func:`cca` for each output matrix - for example, when testing the
+  significance of a result against many permutations of the rows of `Y`.
+
+  Parameters
+  ----------
+  X : numpy.ndarray
+    :math:`M \\times I` matrix containing :math:`M` observations and :math:`I` input features.
+  Ys : sequence of numpy.ndarray
+    :math:`M \\times O` matrices containing :math:`M` observations and :math:`O` output features.
+    Each may contain a different number of output features.
+
+  See :func:`cca` for the remaining parameters.
+
+  Returns
+  -------
+  results : list
+    One (x, y, x_loadings, y_loadings, r2, wilks) tuple for each output matrix,
+    identical to those returned by :func:`cca`.
+  """
+  Ys = list(Ys)
+  for Y in Ys:
+    _validate(X, Y, scale_inputs, force_positive, significant_digits)
+  _require_nonconstant(X)
+  for Y in Ys:
+    _require_nonconstant(Y)
+
+  x_factors = _factor(X, scale_inputs, significant_digits)
+  return [_cca(X, Y, x_factors, _factor(Y, scale_inputs, significant_digits), force_positive) for Y in Ys]
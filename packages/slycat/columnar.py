@@ -0,0 +1,151 @@
+# Copyright 2013, Sandia Corporation. Under the terms of Contract
+# DE-AC04-94AL85000 with Sandia Corporation, the U.S. Government retains certain
+# rights in this software.
+
+"""Self-describing columnar binary format for sending array data over the wire.
+
+A message is the magic string ``SLYCOLS1``, followed by a frame containing a
+JSON header with the number of columns and any message metadata, followed by
+one frame per column.  Every frame starts with a little-endian uint32 length
+and is padded with zeros to a multiple of 8 bytes.  A column frame is a JSON
+header describing the column, followed by its buffers:
+
+* ``name`` - column name.
+* ``dtype`` - numpy type string (always little-endian) or ``"string"``.
+* ``shape`` - column shape.
+* ``null-count`` - number of null values.
+* ``buffers`` - lengths of the buffers that follow the header: a validity
+  bitmap if ``null-count`` is nonzero (one bit per value in C order, least
+  significant bit first, set for valid values), then for strings an int64
+  offsets buffer and a utf-8 data buffer, or for everything else the raw
+  values in C order.
+
+Floating point NaNs are reported as nulls (their values are still sent), to
+match the JSON representation.
+"""
+
+import json
+import numpy
+import struct
+
+content_type = "application/x-slycat-columns"
+magic = b"SLYCOLS1"
+
+def _frame(data):
+  padding = -(4 + len(data)) % 8
+  return struct.pack("<I", len(data)) + data + b"\0" * padding
+
+def _buffer(data):
+  return data + b"\0" * (-len(data) % 8)
+
+def _bytes(values):
+  return numpy.ascontiguousarray(values).tobytes()
+
+def _validity(nulls):
+  bits = numpy.invert(nulls.ravel())
+  padded = numpy.zeros(-(-len(bits) // 8) * 8, dtype="bool")
+  padded[:len(bits)] = bits
+  return _bytes(numpy.packbits(padded.reshape(-1, 8)[:, ::-1]))
+
+def _column(name, values):
+  if isinstance(values, numpy.ma.MaskedArray):
+    nulls = numpy.ma.getmaskarray(values)
+    values = values.data
+  else:
+    values = numpy.asarray(values)
+    nulls = None
+
+  if values.dtype.kind in "OSU":
+    flat = values.ravel()
+    if nulls is None:
+      nulls = numpy.array([value is None for value in flat], dtype="bool").reshape(values.shape)
+    strings = [(value if isinstance(value, unicode) else str(value).decode("utf-8")).encode("utf-8") if value is not None else b"" for value in flat]
+    offsets = numpy.zeros(len(strings) + 1, dtype="<i8")
+    numpy.cumsum([len(value) for value in strings], out=offsets[1:])
+    dtype = "string"
+    buffers = [_bytes(offsets), b"".join(strings)]
+  else:
+    if nulls is None and values.dtype.kind in "fc":
+      nulls = numpy.isnan(values)
+    values = values.astype(values.dtype.newbyteorder("<"), copy=False)
+    dtype = values.dtype.str
+    buffers = [_bytes(values)]
+
+  null_count = int(numpy.count_nonzero(nulls)) if nulls is not None else 0
+  if null_count:
+    buffers.insert(0, _validity(nulls))
+
+  header = {"name": name, "dtype": dtype, "shape": list(values.shape), "null-count": null_count, "buffers": [len(buffer) for buffer in buffers]}
+  return [_frame(json.dumps(header).encode("utf-8"))] + [_buffer(buffer) for buffer in buffers]
+
+def encode(columns, metadata=None):
+  """Encode a sequence of columns, yielding the message a piece at a time.
+
+  Parameters
+  ----------
+  columns: sequence of (name, values) tuples, required.
+    Column values are numpy arrays (optionally masked, to mark nulls).
+    Arrays of objects or strings are sent as utf-8 strings.
+  metadata: JSON-compatible object, optional.
+    Additional information to be sent with the columns.
+  """
+  columns = list(columns)
+  yield magic
+  yield _frame(json.dumps({"columns": len(columns), "metadata": metadata}).encode("utf-8"))
+  for name, values in columns:
+    for piece in _column(name, values):
+      yield piece
+
+def decode(data):
+  """Decode a message created with :func:`encode`.
+
+  Returns
+  -------
+  metadata: JSON-compatible object
+  columns: list of (name, values) tuples.  Columns containing nulls are returned
+    as :class:`numpy.ma.MaskedArray`, string columns as arrays of objects.
+  """
+  data = numpy.frombuffer(data, dtype="uint8")
+  if data[:len(magic)].tobytes() != magic:
+    raise ValueError("Not a columnar message.")
+  position = len(magic)
+
+  def frame(position):
+    length, = struct.unpack("<I", data[position:position + 4].tobytes())
+    content = data[position + 4:position + 4 + length].tobytes()
+    return content, position + 4 + length + (-(4 + length) % 8)
+
+  content, position = frame(position)
+  message = json.loads(content.decode("utf-8"))
+
+  columns = []
+  for index in range(message["columns"]):
+    content, position = frame(position)
+    header = json.loads(content.decode("utf-8"))
+    buffers = []
+    for length in header["buffers"]:
+      buffers.append(data[position:position + length])
+      position += length + (-length % 8)
+
+    shape = tuple(header["shape"])
+    size = int(numpy.prod(shape))
+    nulls = None
+    if header["null-count"]:
+      bits = numpy.unpackbits(buffers.pop(0).reshape(-1, 1), axis=1)[:, ::-1].ravel()
+      nulls = numpy.invert(bits[:size].astype("bool")).reshape(shape)
+
+    if header["dtype"] == "string":
+      offsets = buffers[0].view("<i8")
+      strings = buffers[1].tobytes()
+      values = numpy.empty(size, dtype="object")
+      for i in range(size):
+        values[i] = strings[offsets[i]:offsets[i + 1]].decode("utf-8")
+      values = values.reshape(shape)
+    else:
+      values = buffers[0].view(header["dtype"]).reshape(shape)
+
+    if nulls is not None:
+      values = numpy.ma.masked_array(values, mask=nulls)
+    columns.append((header["name"], values))
+
+  return message["metadata"], columns
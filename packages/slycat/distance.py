@@ -0,0 +1,143 @@
+# Copyright 2013, Sandia Corporation. Under the terms of Contract
+# DE-AC04-94AL85000 with Sandia Corporation, the U.S. Government retains certain
+# rights in this software.
+
+"""Condensed distance matrices stored in HDF5.
+
+A condensed distance matrix contains the upper triangle of a symmetric
+:math:`M \\times M` distance matrix in row-major order, the same layout used by
+:func:`scipy.spatial.distance.pdist` and :func:`scipy.cluster.hierarchy.linkage`.
+The distances for each row follow those of the previous row, so a block of
+consecutive rows is a contiguous range of the condensed matrix, and can be
+computed and written without ever holding the whole matrix in memory.
+
+Matrices are stored as a chunked float64 dataset named ``distances``, with the
+observation count in its ``count`` attribute.
+"""
+
+import numpy
+import scipy.cluster.hierarchy
+
+try:
+  import fastcluster
+except ImportError:
+  fastcluster = None
+
+def size(count):
+  """Return the number of distances in the condensed matrix for `count` observations."""
+  return count * (count - 1) // 2
+
+def count(size):
+  """Return the number of observations for a condensed matrix containing `size` distances."""
+  result = int((1 + numpy.sqrt(1 + 8 * size)) // 2)
+  if result * (result - 1) // 2 != size:
+    raise ValueError("%s is not a valid condensed distance matrix size." % size)
+  return result
+
+def offset(count, row):
+  """Return the position of the first distance for a row (its distance to the following observation)."""
+  return row * (2 * count - row - 1) // 2
+
+def index(count, i, j):
+  """Return the position of the distance between observations `i` and `j` (in either order, i != j).
+
+  `i` and `j` may be arrays, which are broadcast against each other.
+  """
+  i, j = numpy.minimum(i, j), numpy.maximum(i, j)
+  return offset(count, i) + j - i - 1
+
+def row_blocks(count, pairs):
+  """Partition the rows of a condensed matrix into blocks containing roughly `pairs` distances each.
+
+  Returns
+  -------
+  blocks : list of (begin, end) row ranges.
+  """
+  blocks = []
+  begin = 0
+  while begin < count - 1:
+    end = begin + 1
+    while end < count - 1 and offset(count, end + 1) - offset(count, begin) <= pairs:
+      end += 1
+    blocks.append((begin, end))
+    begin = end
+  return blocks
+
+def upper(block):
+  """Extract the condensed distances from a block of rows of a square distance matrix.
+
+  Parameters
+  ----------
+  block : numpy.ndarray
+    Distances from rows :math:`b` through :math:`e-1` to observations :math:`b` through
+    :math:`M-1`, i.e. the :math:`(e-b) \\times (M-b)` upper right corner of the block of rows.
+  """
+  return block[numpy.triu_indices(block.shape[0], k=1, m=block.shape[1])]
+
+def create(file, count, chunk_size=1024 * 1024):
+  """Create storage for a condensed distance matrix in an open HDF5 file.
+
+  Returns
+  -------
+  dataset : :class:`h5py.Dataset`
+  """
+  dataset = file.create_dataset("distances", (size(count),), dtype="float64", chunks=(max(1, min(chunk_size, size(count))),))
+  dataset.attrs["count"] = count
+  return dataset
+
+def open(file):
+  """Return the condensed distance matrix stored in an open HDF5 file."""
+  return file["distances"]
+
+def write(dataset, begin, distances):
+  """Store the condensed distances for a block of rows starting with row `begin`."""
+  start = offset(int(dataset.attrs["count"]), begin)
+  dataset[start:start + len(distances)] = distances
+
+def read(dataset, begin=0, end=None, block_size=16 * 1024 * 1024):
+  """Load part (by default all) of a condensed distance matrix into memory, a block at a time."""
+  end = len(dataset) if end is None else end
+  result = numpy.empty(end - begin, dtype="float64")
+  for block_begin in range(begin, end, block_size):
+    block_end = min(block_begin + block_size, end)
+    dataset.read_direct(result, numpy.s_[block_begin:block_end], numpy.s_[block_begin - begin:block_end - begin])
+  return result
+
+def leading(distances, observations):
+  """Return the condensed distances between the first few observations of a larger condensed matrix.
+
+  Parameters
+  ----------
+  distances : :class:`numpy.ndarray` or :class:`h5py.Dataset`
+    Condensed distance matrix.
+  observations : integer
+    Number of leading observations to keep.
+  """
+  total = count(len(distances))
+  if observations == total:
+    return read(distances) if not isinstance(distances, numpy.ndarray) else distances
+  result = numpy.empty(size(observations), dtype="float64")
+  for row in range(observations - 1):
+    start = offset(total, row)
+    result[offset(observations, row):offset(observations, row + 1)] = distances[start:start + observations - row - 1]
+  return result
+
+def linkage(distances, method="average"):
+  """Compute a hierarchical clustering from a condensed distance matrix.
+
+  Uses fastcluster when it is installed, which clusters in place instead of
+  making a copy of the matrix.
+
+  Parameters
+  ----------
+  distances : :class:`numpy.ndarray` or :class:`h5py.Dataset`
+    Condensed distance matrix.  In-memory matrices are left unmodified.
+  method : string, optional
+    Linkage method accepted by :func:`scipy.cluster.hierarchy.linkage`.
+  """
+  stored = not isinstance(distances, numpy.ndarray)
+  if stored:
+    distances = read(distances)
+  if fastcluster is not None:
+    return fastcluster.linkage(distances, method=method, preserve_input=not stored)
+  return scipy.cluster.hierarchy.linkage(distances, method=method)
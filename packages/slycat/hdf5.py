@@ -4,6 +4,7 @@ import numpy
 import os
 import slycat.darray
 import slycat.email
+import slycat.lod
 import cherrypy
 
 class DArray(slycat.darray.Prototype):
@@ -70,46 +71,90 @@ class DArray(slycat.darray.Prototype):
       self._attributes = [dict(name=name, type=type) for name, type in zip(self._metadata["attribute-names"], self._metadata["attribute-types"])]
     return self._attributes
 
+  def _cached(self, attribute_index):
+    attribute = self._storage["attribute/%s" % attribute_index]
+    if not ("min" in attribute.attrs and "max" in attribute.attrs and "unique" in attribute.attrs and "unique/%s" % attribute_index in self._storage):
+      return False
+    if attribute.dtype.char not in ["O", "S", "U"] and attribute.attrs["unique"] and not ("histogram/%s" % attribute_index in self._storage and "quantiles/%s" % attribute_index in self._storage):
+      return False
+    return True
+
   def _update_cache(self, attribute_index):
     attribute_key = "attribute/%s" % attribute_index
     unique_key = "unique/%s" % attribute_index
+    histogram_key = "histogram/%s" % attribute_index
+    quantiles_key = "quantiles/%s" % attribute_index
 
     attribute = self._storage[attribute_key]
-    if "min" in attribute.attrs and "max" in attribute.attrs and "unique" in attribute.attrs and unique_key in self._storage:
+    if self._cached(attribute_index):
       return
 
-    attribute_min = None
-    attribute_max = None
+    # Make a single pass over the data in large blocks, keeping a sorted
+    # array of the distinct values seen so far along with their counts.  Min
+    # and max fall out as the first and last distinct values, and the counts
+    # give us histograms and quantiles, so we never visit an element twice.
+    string = attribute.dtype.char in ["O", "S", "U"]
     attribute_unique = None
-
-    chunk_size = 1000
-    for begin in numpy.arange(0, len(attribute), chunk_size):
-      slice = attribute[begin : begin + chunk_size]
-      if attribute.dtype.char in ["O", "S", "U"]:
-        data_min = min(slice)
-        data_max = max(slice)
-        data_unique = numpy.unique(slice)
-        attribute_min = str(data_min) if attribute_min is None else str(min(data_min, attribute_min))
-        attribute_max = str(data_max) if attribute_max is None else str(max(data_max, attribute_max))
-        attribute_unique = data_unique if attribute_unique is None else numpy.unique(numpy.concatenate((data_unique, attribute_unique)))
+    attribute_counts = None
+    for block in _blocks(attribute):
+      block = block.ravel()
+      if not string:
+        block = block[numpy.invert(numpy.isnan(block))]
+      if not len(block):
+        continue
+      block_unique, block_counts = numpy.unique(block, return_counts=True)
+      if attribute_unique is None:
+        attribute_unique, attribute_counts = block_unique, block_counts
       else:
-        slice = slice[numpy.invert(numpy.isnan(slice))]
-        if len(slice):
-          data_min = numpy.asscalar(slice.min())
-          data_max = numpy.asscalar(slice.max())
-          data_unique = numpy.unique(slice)
-          attribute_min = data_min if attribute_min is None else min(data_min, attribute_min)
-          attribute_max = data_max if attribute_max is None else max(data_max, attribute_max)
-          attribute_unique = data_unique if attribute_unique is None else numpy.unique(numpy.concatenate((data_unique, attribute_unique)))
-
-    if attribute_min is not None:
-      attribute.attrs["min"] = attribute_min
-    if attribute_max is not None:
-      attribute.attrs["max"] = attribute_max
+        attribute_unique, attribute_counts = _merge_unique(attribute_unique, block_unique, attribute_counts, block_counts)
+
+    for key in [unique_key, histogram_key, quantiles_key]:
+      if key in self._storage:
+        del self._storage[key]
+    for key in ["min", "max", "unique"]:
+      if key in attribute.attrs:
+        del attribute.attrs[key]
+
     if attribute_unique is not None:
+      if string:
+        attribute.attrs["min"] = str(attribute_unique[0])
+        attribute.attrs["max"] = str(attribute_unique[-1])
+      else:
+        attribute.attrs["min"] = numpy.asscalar(attribute_unique[0])
+        attribute.attrs["max"] = numpy.asscalar(attribute_unique[-1])
+        counts, edges = histogram(attribute_unique, attribute_counts)
+        self._storage.create_dataset(histogram_key, data=counts)
+        self._storage[histogram_key].attrs["edges"] = edges
+        self._storage.create_dataset(quantiles_key, data=quantile_sketch(attribute_unique, attribute_counts))
       attribute.attrs["unique"] = len(attribute_unique)
       self._storage.create_dataset(unique_key, data=attribute_unique, dtype=dtype(self._metadata["attribute-types"][attribute_index]))
 
+  def statistics_cached(self, attribute=None):
+    """Return True if cached statistics, unique values, histograms and quantiles are available.
+
+    Parameters
+    ----------
+    attribute : integer, optional
+      Attribute to check.  If unspecified, checks every attribute in the darray.
+    """
+    attributes = range(len(self.attributes)) if attribute is None else [attribute]
+    for attribute_index in attributes:
+      if not self._cached(attribute_index):
+        return False
+    return True
+
+  def update_statistics(self, attribute=None):
+    """Compute and cache statistics, unique values, histograms and quantiles, so later reads don't have to.
+
+    Parameters
+    ----------
+    attribute : integer, optional
+      Attribute to update.  If unspecified, updates every attribute in the darray.
+    """
+    attributes = range(len(self.attributes)) if attribute is None else [attribute]
+    for attribute_index in attributes:
+      self._update_cache(attribute_index)
+
   def get_statistics(self, attribute):
     self._update_cache(attribute)
 
@@ -127,6 +172,249 @@ class DArray(slycat.darray.Prototype):
       "values": self._storage["unique/%s" % attribute][hyperslice]
       }
 
+  def get_histogram(self, attribute):
+    """Return a fixed-bin histogram of a numeric attribute.
+
+    Returns
+    -------
+    histogram: dict
+      Contains "counts", the number of non-NaN values in each bin, and
+      "edges", the bin boundaries.  Both are None for string attributes or
+      attributes without any non-NaN values.
+    """
+    self._update_cache(attribute)
+
+    key = "histogram/%s" % attribute
+    if key not in self._storage:
+      return {"counts": None, "edges": None}
+    return {
+      "counts": self._storage[key][...],
+      "edges": self._storage[key].attrs["edges"],
+      }
+
+  def get_quantiles(self, attribute):
+    """Return a quantile sketch of a numeric attribute.
+
+    Returns
+    -------
+    sketch: dict
+      Contains "values" and "counts", the centroids of a mergeable quantile
+      sketch (see :func:`quantile_sketch`).  Both are None for string
+      attributes or attributes without any non-NaN values.
+    """
+    self._update_cache(attribute)
+
+    key = "quantiles/%s" % attribute
+    if key not in self._storage:
+      return {"values": None, "counts": None}
+    sketch = self._storage[key][...]
+    return {
+      "values": sketch[:, 0],
+      "counts": sketch[:, 1],
+      }
+
+  def _sort_key(self, sort):
+    """Return the storage key of the persistent index for a sort, and the sort that index is for.
+
+    Indexes are only stored for sorts whose first key is ascending - the
+    index for the opposite sort is the same index read back to front.
+    """
+    if sort[0][1] == "descending":
+      sort = [(attribute, "ascending" if order == "descending" else "descending") for attribute, order in sort]
+    return "index/%s" % ",".join(["%s:%s" % ("row" if attribute is None else attribute, order) for attribute, order in sort]), sort
+
+  def sort_index_cached(self, sort):
+    """Return True if a persistent index is available for a sort.
+
+    Parameters
+    ----------
+    sort : list of (attribute, order) tuples, required.
+      Sort keys, most significant first.  Each attribute is an integer
+      attribute index, or None to sort by row number, and each order is
+      "ascending" or "descending".
+    """
+    if sort[0][0] is None:
+      return True
+    key, sort = self._sort_key(sort)
+    return key in self._storage
+
+  def compute_sort_index(self, sort):
+    """Compute the permutation that sorts the darray, without storing it.
+
+    Ties are broken by row number, and NaNs sort after every other value.
+    See :meth:`sort_index_cached` for the sort parameter.
+
+    Returns
+    -------
+    index : :class:`numpy.ndarray`
+      Row numbers in the order given by the stored index, see :meth:`update_sort_index`.
+    """
+    key, sort = self._sort_key(sort)
+    keys = []
+    for attribute, order in sort:
+      if attribute is None:
+        ranks = numpy.arange(self.shape[0], dtype="int64")
+      else:
+        ranks = _ranks(self.get_data(attribute)[...])
+      keys.append(-ranks if order == "descending" else ranks)
+    return numpy.lexsort(keys[::-1])
+
+  def update_sort_index(self, sort, index=None):
+    """Store a persistent index for a sort, along with its inverse permutation.
+
+    Indexes are removed when any of the attributes they sort by is modified.
+    See :meth:`sort_index_cached` for the sort parameter.
+
+    Parameters
+    ----------
+    index : :class:`numpy.ndarray`, optional.
+      The index returned by :meth:`compute_sort_index`, if it has already been computed.
+    """
+    if sort[0][0] is None:
+      return
+    if index is None:
+      index = self.compute_sort_index(sort)
+    inverse = numpy.empty(len(index), dtype="int64")
+    inverse[index] = numpy.arange(len(index), dtype="int64")
+    key, sort = self._sort_key(sort)
+    if key in self._storage:
+      del self._storage[key]
+    self._storage.create_dataset(key + "/order", data=index.astype("int64"))
+    self._storage.create_dataset(key + "/inverse", data=inverse)
+
+  def get_sort_index(self, sort, rows):
+    """Return the row numbers at a set of positions in sorted order.
+
+    Only the requested positions are read from the persistent index.  If
+    the index hasn't been stored, it is computed in memory instead.  See
+    :meth:`sort_index_cached` for the sort parameter.
+
+    Parameters
+    ----------
+    rows : :class:`numpy.ndarray`, required.
+      Zero-based positions in sorted order.
+    """
+    rows = numpy.asarray(rows, dtype="int64")
+    if sort[0][1] == "descending":
+      rows = self.shape[0] - 1 - rows
+    if sort[0][0] is None:
+      return rows
+    if not self.sort_index_cached(sort):
+      return self.compute_sort_index(sort)[rows]
+    key, sort = self._sort_key(sort)
+    return _take(self._storage[key + "/order"], rows)
+
+  def get_sort_ranks(self, sort, rows):
+    """Return the positions in sorted order of a set of row numbers.
+
+    This is the inverse of :meth:`get_sort_index`, and is also only
+    proportional to the number of rows requested.
+    """
+    rows = numpy.asarray(rows, dtype="int64")
+    if sort[0][0] is None:
+      ranks = rows
+    elif not self.sort_index_cached(sort):
+      ranks = numpy.argsort(self.compute_sort_index(sort), kind="mergesort")[rows]
+    else:
+      key, canonical = self._sort_key(sort)
+      ranks = _take(self._storage[key + "/inverse"], rows)
+    if sort[0][1] == "descending":
+      ranks = self.shape[0] - 1 - ranks
+    return ranks
+
+  def tiles_cached(self, x, y):
+    """Return True if level-of-detail tiles are available for a pair of attributes.
+
+    Parameters
+    ----------
+    x, y : integer, required.
+      Indices of the numeric attributes used as point coordinates.
+    """
+    return "lod/%s,%s" % (x, y) in self._storage
+
+  def compute_tiles(self, x, y):
+    """Bin the points given by a pair of attributes at every level of detail, without storing them.
+
+    Returns
+    -------
+    extent, levels : the extent of the points (xmin, xmax, ymin, ymax), and a
+      (level, ids, counts, rows, x, y) tuple for every level, where the first
+      four elements are returned by :func:`slycat.lod.pyramid` and the last two
+      are the coordinates of the representative points.
+    """
+    xs = numpy.asarray(self.get_data(x)[...], dtype="float64")
+    ys = numpy.asarray(self.get_data(y)[...], dtype="float64")
+    valid = numpy.invert(numpy.isnan(xs) | numpy.isnan(ys))
+    if numpy.any(valid):
+      extent = [float(xs[valid].min()), float(xs[valid].max()), float(ys[valid].min()), float(ys[valid].max())]
+    else:
+      extent = [0.0, 0.0, 0.0, 0.0]
+    return extent, [(level, ids, counts, rows, xs[rows], ys[rows]) for level, ids, counts, rows in slycat.lod.pyramid(xs, ys, extent)]
+
+  def update_tiles(self, x, y, tiles=None):
+    """Store level-of-detail tiles for a pair of attributes.
+
+    For every level we store the sorted ids of the non-empty bins, the number
+    of points in each, and the row number and coordinates of its
+    representative point, plus the offset of each column of bins, so a
+    viewport can be read without touching bins outside it.  Tiles are
+    removed when either attribute is modified.
+
+    Parameters
+    ----------
+    tiles : optional.
+      The result of :meth:`compute_tiles`, if it has already been computed.
+    """
+    extent, levels = self.compute_tiles(x, y) if tiles is None else tiles
+    key = "lod/%s,%s" % (x, y)
+    if key in self._storage:
+      del self._storage[key]
+    group = self._storage.create_group(key)
+    group.attrs["extent"] = extent
+    for level, ids, counts, rows, xs, ys in levels:
+      level_group = group.create_group(str(level))
+      level_group["ids"] = ids
+      level_group["counts"] = counts
+      level_group["rows"] = rows
+      level_group["x"] = xs
+      level_group["y"] = ys
+      level_group["offsets"] = slycat.lod.offsets(ids, level)
+
+  def get_tiles(self, x, y, level, viewport=None):
+    """Return the representative points of the non-empty bins that overlap a viewport.
+
+    Only the columns of bins that overlap the viewport are read.
+
+    Parameters
+    ----------
+    level : integer, required.
+      Level of detail, see :func:`slycat.lod.choose_level`.
+    viewport : sequence of four numbers, optional.
+      xmin, xmax, ymin, ymax of the region to return.  Defaults to everything.
+
+    Returns
+    -------
+    tiles : dict
+      Contains "ids", "counts", "rows", "x" and "y" arrays, one element per bin.
+    """
+    group = self._storage["lod/%s,%s/%s" % (x, y, level)]
+    extent = self._storage["lod/%s,%s" % (x, y)].attrs["extent"]
+    (i_begin, i_end), (j_begin, j_end) = slycat.lod.viewport_bins(extent, extent if viewport is None else viewport, level)
+    begin, end = (group["offsets"][i_begin], group["offsets"][i_end + 1]) if i_begin <= i_end else (0, 0)
+    if end <= begin:
+      return dict([(name, numpy.empty(0, dtype=group[name].dtype)) for name in ["ids", "counts", "rows", "x", "y"]])
+    ids = group["ids"][begin:end]
+    j = ids & ((2 ** level) - 1)
+    keep = numpy.flatnonzero((j >= j_begin) & (j <= j_end))
+    tiles = {"ids": ids[keep]}
+    for name in ["counts", "rows", "x", "y"]:
+      tiles[name] = group[name][begin:end][keep]
+    return tiles
+
+  def get_tile_extent(self, x, y):
+    """Return the extent (xmin, xmax, ymin, ymax) covered by the tiles for a pair of attributes."""
+    return [float(value) for value in self._storage["lod/%s,%s" % (x, y)].attrs["extent"]]
+
   def get_data(self, attribute):
     """Return a reference to the data storage for a darray attribute.
 
@@ -141,16 +429,57 @@ class DArray(slycat.darray.Prototype):
       An object implementing a subset of the :class:`numpy.ndarray` interface
       that contains the attribute data.  Note that the returned object only
       `references` the underlying data - data is not retrieved from the file
-      until you access it using the `[]` operator.
+      until you access it using the `[]` operator, or copy it into an
+      existing array using `read_direct()`.
     """
     class StorageWrapper(object):
-      """Ensures that the dtype of data retrieved from the file matches what was put in."""
+      """Ensures that the dtype of data retrieved from the file matches what was put in.
+
+      Numeric data is returned exactly as h5py reads it when the stored type
+      already matches, and is otherwise converted by HDF5 as it is read, so
+      neither case makes a second copy of the data.
+      """
       def __init__(self, storage, dtype):
         self._storage = storage
-        self._dtype = dtype
+        self._dtype = numpy.dtype(dtype)
+        self._string = self._dtype.kind in "SU" or storage.dtype.kind == "O"
+
+      @property
+      def dtype(self):
+        return self._dtype
+
+      @property
+      def shape(self):
+        return self._storage.shape
+
       def __getitem__(self, *args, **kwargs):
-        result = self._storage.__getitem__(*args, **kwargs)
-        return result.astype(self._dtype)
+        if self._string:
+          return numpy.asarray(self._storage.__getitem__(*args, **kwargs)).astype(self._dtype)
+        if self._storage.dtype == self._dtype:
+          return self._storage.__getitem__(*args, **kwargs)
+        with self._storage.astype(self._dtype):
+          return self._storage.__getitem__(*args, **kwargs)
+
+      def read_direct(self, dest, source_sel=None, dest_sel=None):
+        """Read data straight into an existing numeric array, converting to its dtype as HDF5 reads.
+
+        Parameters
+        ----------
+        dest : :class:`numpy.ndarray`, required.
+          C-contiguous array that will receive the data.
+        source_sel : hyperslice, optional.
+          Region of the attribute to read, as a :func:`numpy.s_` expression.  Defaults to the whole attribute.
+        dest_sel : hyperslice, optional.
+          Region of `dest` to fill.  Defaults to the whole array.
+
+        Returns
+        -------
+        dest : :class:`numpy.ndarray`
+        """
+        if self._string:
+          raise ValueError("read_direct() only supports numeric attributes.")
+        self._storage.read_direct(dest, source_sel, dest_sel)
+        return dest
 
     return StorageWrapper(self._storage["attribute/%s" % attribute], self._metadata["attribute-types"][attribute])
 
@@ -184,17 +513,25 @@ class DArray(slycat.darray.Prototype):
     # Store the data.
     attribute_storage = self._storage["attribute/%s" % attribute]
     attribute_storage[hyperslice] = data
+    _bump_version(self._storage.file)
 
-    # Flush cached sort indices.
-    index_key = "index/%s" % attribute
-    if index_key in self._storage:
-      del self._storage[index_key]
+    # Flush cached sort indices and level-of-detail tiles that depend on this attribute.
+    for group in ["index", "lod"]:
+      if group in self._storage:
+        for key in list(self._storage[group].keys()):
+          if str(attribute) in [spec.split(":")[0] for spec in key.split(",")]:
+            del self._storage["%s/%s" % (group, key)]
 
     # Flush cached unique values.
     unique_key = "unique/%s" % attribute
     if unique_key in self._storage:
       del self._storage[unique_key]
 
+    # Flush cached histograms and quantiles.
+    for key in ["histogram/%s" % attribute, "quantiles/%s" % attribute]:
+      if key in self._storage:
+        del self._storage[key]
+
     # Flush cached statistics.
     if "min" in attribute_storage.attrs:
       del attribute_storage.attrs["min"]
@@ -203,6 +540,126 @@ class DArray(slycat.darray.Prototype):
     if "unique" in attribute_storage.attrs:
       del attribute_storage.attrs["unique"]
 
+def _bump_version(file):
+  """Mark the data in an arrayset as modified, so results computed from it are no longer reused."""
+  file.attrs["version"] = int(file.attrs.get("version", 0)) + 1
+
+def _blocks(dataset, block_elements=4 * 1024 * 1024):
+  """Iterate over a dataset in large blocks along its first dimension, aligned with its chunks."""
+  if dataset.shape == ():
+    yield numpy.atleast_1d(dataset[...])
+    return
+  if not dataset.shape[0]:
+    return
+  row_elements = max(1, int(numpy.prod(dataset.shape[1:])))
+  rows = max(1, block_elements // row_elements)
+  if dataset.chunks is not None and rows > dataset.chunks[0]:
+    rows -= rows % dataset.chunks[0]
+  for begin in range(0, dataset.shape[0], rows):
+    yield dataset[begin : begin + rows]
+
+def _ranks(values):
+  """Return the dense rank of every value in an array, with NaNs tied and ranked last."""
+  order = numpy.argsort(values, kind="mergesort")
+  ordered = values[order]
+  distinct = numpy.empty(len(ordered), dtype="bool")
+  distinct[:1] = True
+  distinct[1:] = ordered[1:] != ordered[:-1]
+  if ordered.dtype.kind == "f":
+    nan = numpy.isnan(ordered)
+    distinct[1:] &= numpy.invert(nan[1:] & nan[:-1])
+  ranks = numpy.empty(len(ordered), dtype="int64")
+  ranks[order] = numpy.cumsum(distinct) - 1
+  return ranks
+
+def _take(dataset, rows):
+  """Read the elements of a 1D dataset at arbitrary positions, touching only the part that's needed."""
+  if not len(rows):
+    return numpy.empty(0, dtype=dataset.dtype)
+  begin = int(rows.min())
+  end = int(rows.max()) + 1
+  if end - begin <= 4 * len(rows):
+    return dataset[begin:end][rows - begin]
+  unique, inverse = numpy.unique(rows, return_inverse=True)
+  return dataset[unique.tolist()][inverse]
+
+def _merge_unique(a, b, a_counts, b_counts):
+  """Merge two sorted arrays of distinct values and their counts into one."""
+  merged = numpy.concatenate((a, b))
+  counts = numpy.concatenate((a_counts, b_counts))
+  order = numpy.argsort(merged, kind="mergesort")
+  merged = merged[order]
+  counts = counts[order]
+  if not len(merged):
+    return merged, counts
+  first = numpy.empty(len(merged), dtype="bool")
+  first[0] = True
+  first[1:] = merged[1:] != merged[:-1]
+  starts = numpy.flatnonzero(first)
+  return merged[starts], numpy.add.reduceat(counts, starts)
+
+def histogram(values, counts=None, bins=64):
+  """Compute a fixed-bin histogram spanning the range of a set of numeric values.
+
+  Parameters
+  ----------
+  values : :class:`numpy.ndarray`, required.
+    Non-NaN values to be binned.
+  counts : :class:`numpy.ndarray`, optional.
+    Number of times each value occurs, when `values` are distinct.
+  bins : integer, optional.
+    Number of equal-width bins.
+
+  Returns
+  -------
+  counts, edges : :class:`numpy.ndarray`
+  """
+  counts, edges = numpy.histogram(values, bins=bins, weights=counts)
+  return counts.astype("int64"), edges
+
+def quantile_sketch(values, counts=None, size=256):
+  """Summarize a set of numeric values as a small, mergeable quantile sketch.
+
+  The sketch is an array of at most `size` (value, count) centroids, sorted
+  by value, where each centroid is the mean of a run of adjacent values.
+  Sketches for separate data can be merged by concatenating them and
+  passing the centroids back through this function.
+
+  Parameters
+  ----------
+  values : :class:`numpy.ndarray`, required.
+    Non-NaN values to be summarized.
+  counts : :class:`numpy.ndarray`, optional.
+    Number of times each value occurs (or the weight of each centroid, when merging sketches).
+  size : integer, optional.
+    Maximum number of centroids.
+
+  Returns
+  -------
+  sketch : :class:`numpy.ndarray` with shape (centroids, 2)
+  """
+  values = numpy.asarray(values, dtype="float64")
+  counts = numpy.ones(len(values)) if counts is None else numpy.asarray(counts, dtype="float64")
+  order = numpy.argsort(values, kind="mergesort")
+  values = values[order]
+  counts = counts[order]
+  if len(values) > size:
+    # Split the values into runs of roughly equal total count.
+    cumulative = numpy.cumsum(counts)
+    bucket = numpy.minimum((size * (cumulative - counts) / cumulative[-1]).astype("int64"), size - 1)
+    starts = numpy.flatnonzero(numpy.concatenate(([True], bucket[1:] != bucket[:-1])))
+    weights = numpy.add.reduceat(counts, starts)
+    values = numpy.add.reduceat(values * counts, starts) / weights
+    counts = weights
+  return numpy.column_stack((values, counts))
+
+def sketch_quantiles(sketch, probabilities):
+  """Estimate quantiles from a sketch returned by :func:`quantile_sketch`."""
+  sketch = numpy.asarray(sketch)
+  cumulative = numpy.cumsum(sketch[:, 1])
+  positions = (cumulative - sketch[:, 1] / 2.0) / cumulative[-1]
+  return numpy.interp(probabilities, positions, sketch[:, 0])
+
 class ArraySet(object):
   """Wraps an instance of :class:`h5py.File` to implement a Slycat arrayset."""
   def __init__(self, file):
@@ -217,6 +674,11 @@ class ArraySet(object):
   def keys(self):
     return [int(key) for key in self._storage["array"].keys()]
 
+  @property
+  def version(self):
+    """Return the arrayset data version, which increases every time array data is created or modified."""
+    return int(self._storage.attrs.get("version", 0))
+
   def array_count(self):
     """Note: this assumes that array indices are contiguous, which we don't explicitly enforce."""
     return len(self._storage["array"].keys())
@@ -250,8 +712,8 @@ class ArraySet(object):
       array_key = "array/%s" % array_index
       if array_key in self._storage:
         del self._storage[array_key]
-      for attribute_index, stored_type in enumerate(stored_types):
-        self._storage.create_dataset("array/%s/attribute/%s" % (array_index, attribute_index), shape, dtype=stored_type)
+      for attribute_index, (attribute, stored_type) in enumerate(zip(stub.attributes, stored_types)):
+        self._storage.create_dataset("array/%s/attribute/%s" % (array_index, attribute_index), shape, dtype=stored_type, **storage_options(attribute["type"], shape))
     except Exception as e:
       pass
 
@@ -265,6 +727,8 @@ class ArraySet(object):
     array_metadata["dimension-begin"] = numpy.array([dimension["begin"] for dimension in stub.dimensions], dtype="int64")
     array_metadata["dimension-end"] = numpy.array([dimension["end"] for dimension in stub.dimensions], dtype="int64")
 
+    _bump_version(self._storage)
+
     cherrypy.log.error("returning Darray for start_array for put_model_array")
     return DArray(self._storage[array_key])
 
@@ -320,6 +784,63 @@ def start_arrayset(file):
   file.create_group("array")
   return ArraySet(file)
 
+def storage_options(type, shape):
+  """Return :meth:`h5py.Group.create_dataset` keyword arguments controlling the on-disk layout of an attribute.
+
+  Attributes are chunked so that partial reads only touch the chunks they
+  need, and compressed using the filters configured for their type in
+  `storage_options.defaults` (see :func:`configure_storage`).
+
+  Parameters
+  ----------
+  type : string, required.
+    Slycat attribute type, e.g. "float64" or "string".
+  shape : sequence of integers, required.
+    Shape of the attribute dataset.
+
+  Returns
+  -------
+  options : dict
+  """
+  shape = [int(extent) for extent in shape]
+  if not shape or 0 in shape:
+    # HDF5 can't chunk empty datasets, and there's nothing to compress anyway.
+    return {}
+
+  filters = storage_options.defaults["filters"]
+  options = dict(filters.get(type, filters["default"]))
+
+  # Halve the largest chunk dimension until the chunk fits the byte budget.
+  itemsize = numpy.dtype(dtype(type)).itemsize
+  chunks = list(shape)
+  while numpy.prod(chunks) * itemsize > storage_options.defaults["chunk-bytes"] and max(chunks) > 1:
+    largest = chunks.index(max(chunks))
+    chunks[largest] = (chunks[largest] + 1) // 2
+  options["chunks"] = tuple(chunks)
+  return options
+storage_options.defaults = {
+  "chunk-bytes": 1024 * 1024,
+  "filters": {
+    # Variable-length strings are stored as heap references, which don't compress usefully.
+    "string": {},
+    "default": {"compression": "gzip", "compression_opts": 4, "shuffle": True},
+  },
+}
+
+def configure_storage(config):
+  """Override the default dataset layout, e.g. from the hdf5-storage server configuration.
+
+  Parameters
+  ----------
+  config : dict, required.
+    May contain "chunk-bytes" (target uncompressed chunk size), and "filters",
+    a map from attribute type (or "default") to create_dataset() filter
+    arguments such as {"compression": "lzf", "shuffle": True}.
+  """
+  if "chunk-bytes" in config:
+    storage_options.defaults["chunk-bytes"] = int(config["chunk-bytes"])
+  storage_options.defaults["filters"].update(config.get("filters", {}))
+
 ################################################################################################################################################
 # Legacy functionality - don't use these in new code.
 
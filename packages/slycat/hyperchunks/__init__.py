@@ -4,14 +4,20 @@
 
 """Functionality for working with hyperchunk specifications (collections of array/attribute/slice information)."""
 
+import collections
 import numbers
 import numpy
 import slycat.hyperchunks.grammar
 import slycat.email
+import threading
 
 def parse(string):
   """Parse a string hyperchunks representation.
 
+  Parsing is expensive, so the most recently used results are cached - the
+  returned parse tree may be shared with other callers, and must not be
+  modified.
+
   Parameters
   ----------
   string: string representation of a hyperchunk.
@@ -20,7 +26,22 @@ def parse(string):
   -------
   hyperchunks: parsed representation of a hyperchunk.
   """
-  return slycat.hyperchunks.grammar.Hyperchunks(slycat.hyperchunks.grammar.hyperchunks_p.parseString(string, parseAll=True).asList())
+  with parse.lock:
+    result = parse.cache.pop(string, None)
+    if result is not None:
+      parse.cache[string] = result
+      return result
+
+  result = slycat.hyperchunks.grammar.Hyperchunks(slycat.hyperchunks.grammar.hyperchunks_p.parseString(string, parseAll=True).asList())
+
+  with parse.lock:
+    parse.cache[string] = result
+    while len(parse.cache) > parse.cache_size:
+      parse.cache.popitem(last=False)
+  return result
+parse.cache = collections.OrderedDict()
+parse.cache_size = 1024
+parse.lock = threading.Lock()
 
 def arrays(hyperchunks, array_count):
   """Iterate over the arrays in a set of hyperchunks."""
@@ -0,0 +1,130 @@
+# Copyright 2013, Sandia Corporation. Under the terms of Contract
+# DE-AC04-94AL85000 with Sandia Corporation, the U.S. Government retains certain
+# rights in this software.
+
+"""Level-of-detail downsampling for scatterplots.
+
+Points are binned on a pyramid of square grids covering the extent of the
+data: level L divides each axis into ``2 ** L`` bins, and bin ``(i, j)`` has
+the id ``(i << L) | j``.  For every non-empty bin we keep the number of points
+it contains, and a representative point - the one with the lowest row
+number.  Because the representative of a bin is also the representative of
+one of its children, points don't jump around as a client zooms in.
+"""
+
+import math
+import numpy
+
+max_level = 11
+
+def quantize(values, begin, end, level):
+  """Return the bin coordinate of each (non-NaN) value along one axis at a level."""
+  count = 2 ** level
+  scale = count / float(end - begin) if end > begin else 0.0
+  return numpy.clip(numpy.floor((values - begin) * scale), 0, count - 1).astype("int64")
+
+def aggregate(ids, rows, counts=None):
+  """Group points by bin.
+
+  Parameters
+  ----------
+  ids : :class:`numpy.ndarray`, required.
+    Bin id of each point.
+  rows : :class:`numpy.ndarray`, required.
+    Row number of each point.
+  counts : :class:`numpy.ndarray`, optional.
+    Number of points each point stands for, when aggregating bins.
+
+  Returns
+  -------
+  ids, counts, rows : :class:`numpy.ndarray`
+    Distinct bin ids in increasing order, the number of points in each
+    bin, and the lowest row number in each bin.
+  """
+  order = numpy.lexsort((rows, ids))
+  ids = ids[order]
+  rows = rows[order]
+  counts = numpy.ones(len(ids), dtype="int64") if counts is None else counts[order]
+  if not len(ids):
+    return ids, counts, rows
+  first = numpy.empty(len(ids), dtype="bool")
+  first[0] = True
+  numpy.not_equal(ids[1:], ids[:-1], out=first[1:])
+  starts = numpy.flatnonzero(first)
+  return ids[starts], numpy.add.reduceat(counts, starts), rows[starts]
+
+def bins(x, y, extent, level, rows=None):
+  """Bin points at a single level, ignoring points with NaN coordinates.
+
+  Parameters
+  ----------
+  x, y : :class:`numpy.ndarray`, required.
+    Point coordinates.
+  extent : sequence of four numbers, required.
+    xmin, xmax, ymin, ymax of the pyramid.
+  level : integer, required.
+  rows : :class:`numpy.ndarray`, optional.
+    Row number of each point, defaults to its position.
+
+  Returns
+  -------
+  ids, counts, rows : see :func:`aggregate`.
+  """
+  rows = numpy.arange(len(x), dtype="int64") if rows is None else numpy.asarray(rows, dtype="int64")
+  valid = numpy.invert(numpy.isnan(x) | numpy.isnan(y))
+  i = quantize(x[valid], extent[0], extent[1], level)
+  j = quantize(y[valid], extent[2], extent[3], level)
+  return aggregate((i << level) | j, rows[valid])
+
+def pyramid(x, y, extent, levels=max_level):
+  """Bin points at every level, finest first.
+
+  Each level is aggregated from the one below it, so the points are only
+  sorted once.
+
+  Returns
+  -------
+  levels : iterator over (level, ids, counts, rows) tuples.
+  """
+  ids, counts, rows = bins(x, y, extent, levels)
+  for level in range(levels, -1, -1):
+    if level < levels:
+      i = ids >> (level + 1)
+      j = ids & ((2 ** (level + 1)) - 1)
+      ids, counts, rows = aggregate(((i >> 1) << level) | (j >> 1), rows, counts)
+    yield level, ids, counts, rows
+
+def choose_level(extent, viewport, width, height, levels=max_level):
+  """Return the coarsest level whose bins are no larger than a pixel of the viewport.
+
+  Parameters
+  ----------
+  extent : sequence of four numbers, required.
+    xmin, xmax, ymin, ymax of the pyramid.
+  viewport : sequence of four numbers, required.
+    xmin, xmax, ymin, ymax of the region being displayed.
+  width, height : integer, required.
+    Size of the viewport in pixels.
+  """
+  level = 0
+  for begin, end, view_begin, view_end, pixels in [(extent[0], extent[1], viewport[0], viewport[1], width), (extent[2], extent[3], viewport[2], viewport[3], height)]:
+    if end <= begin:
+      continue
+    if view_end <= view_begin:
+      return levels
+    level = max(level, int(math.ceil(math.log(max(1.0, (end - begin) * pixels / float(view_end - view_begin)), 2))))
+  return min(level, levels)
+
+def viewport_bins(extent, viewport, level):
+  """Return the ranges of bin coordinates (inclusive) that overlap a viewport."""
+  count = 2 ** level
+  def axis(begin, end, view_begin, view_end):
+    if end <= begin:
+      return 0, count - 1
+    scale = count / float(end - begin)
+    return max(0, int(math.floor((view_begin - begin) * scale))), min(count - 1, int(math.floor((view_end - begin) * scale)))
+  return axis(extent[0], extent[1], viewport[0], viewport[1]), axis(extent[2], extent[3], viewport[2], viewport[3])
+
+def offsets(ids, level):
+  """Return the position of the first bin in each column of bins, plus the total, for sorted bin ids."""
+  return numpy.searchsorted(ids, numpy.arange(2 ** level + 1, dtype="int64") << level)
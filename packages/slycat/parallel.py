@@ -0,0 +1,173 @@
+# Copyright 2013, Sandia Corporation. Under the terms of Contract
+# DE-AC04-94AL85000 with Sandia Corporation, the U.S. Government retains certain
+# rights in this software.
+
+"""Parallel execution backends for agent computations.
+
+Two backends are provided, with the same interface:
+
+* ``multiprocessing`` - a pool of local worker processes, forked from the
+  calling script.  Workers inherit the script's globals (plus an optional
+  namespace) when they start and keep them between tasks, so per-worker caches
+  persist.  Results of :meth:`Pool.map_rows` are written directly into a
+  shared-memory array instead of being sent back to the caller.
+* ``ipython`` - an IPython.parallel cluster that must already be running,
+  for computations that span several nodes.  IPython is only imported when
+  this backend is used.
+
+Tasks must be functions defined at the top level of a module (including the
+calling script), so they can be sent to workers by name.
+"""
+
+import multiprocessing
+import numpy
+import os
+import sys
+import tempfile
+
+backends = ["multiprocessing", "ipython"]
+
+def _push(namespace):
+  main = sys.modules["__main__"]
+  for name, value in namespace.items():
+    setattr(main, name, value)
+
+def _call(task):
+  function, arguments = task
+  return function(*arguments)
+
+def _store(task):
+  function, path, dtype, shape, index, arguments = task
+  output = numpy.memmap(path, dtype=dtype, mode="r+", shape=shape)
+  output[index] = function(*arguments)
+  output.flush()
+
+class Pool(object):
+  """Interface shared by every backend.
+
+  The number of workers is available as the ``size`` attribute.
+  """
+  def map(self, function, *iterables):
+    """Call a function once for each set of arguments, returning a list of results in order."""
+    raise NotImplementedError()
+
+  def map_rows(self, function, shape, dtype, *iterables):
+    """Call a function once for each set of arguments, storing the results in the rows of an array.
+
+    Parameters
+    ----------
+    function: callable, required.
+      Must return a value that can be assigned to a row of the array.
+    shape: tuple, required.
+      Shape of the returned array, whose first dimension must match the number of calls.
+    dtype: numpy dtype, required.
+      Type of the returned array.
+
+    Returns
+    -------
+    array: :class:`numpy.ndarray`
+    """
+    raise NotImplementedError()
+
+  def close(self):
+    """Release the workers."""
+    pass
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exception_type, exception_value, traceback):
+    self.close()
+
+class LocalPool(Pool):
+  """Runs tasks in local worker processes, see :func:`create`."""
+  def __init__(self, processes=None, namespace=None):
+    self.size = processes or multiprocessing.cpu_count()
+    self._pool = multiprocessing.Pool(self.size, _push, (namespace or {},))
+
+  def map(self, function, *iterables):
+    return self._pool.map(_call, [(function, arguments) for arguments in zip(*iterables)])
+
+  def map_rows(self, function, shape, dtype, *iterables):
+    shape = tuple(shape)
+    dtype = numpy.dtype(dtype)
+    if not numpy.prod(shape):
+      return numpy.empty(shape, dtype=dtype)
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    handle, path = tempfile.mkstemp(prefix="slycat-", suffix=".array", dir=directory)
+    try:
+      os.close(handle)
+      output = numpy.memmap(path, dtype=dtype, mode="w+", shape=shape)
+      self._pool.map(_store, [(function, path, dtype, shape, index, arguments) for index, arguments in enumerate(zip(*iterables))])
+      # The mapping outlives the file, and is released along with the array.
+      return output.view(numpy.ndarray)
+    finally:
+      os.remove(path)
+
+  def close(self):
+    self._pool.close()
+    self._pool.join()
+
+class IPythonPool(Pool):
+  """Runs tasks on the engines of a running IPython.parallel cluster, see :func:`create`."""
+  def __init__(self, profile=None, namespace=None, imports=None):
+    import IPython.parallel
+    try:
+      self._client = IPython.parallel.Client(profile=profile)
+    except Exception as e:
+      raise Exception("A running IPython parallel cluster is required for the ipython backend: %s" % e)
+    self._view = self._client[:]
+    self.size = len(self._view)
+    try:
+      self._view.use_dill()
+    except ImportError:
+      pass
+    if imports:
+      self._view.execute("\n".join(["import %s" % name for name in imports]), block=True)
+    if namespace:
+      self._view.push(namespace, block=True)
+
+  def map(self, function, *iterables):
+    results = self._view.map_sync(function, *iterables)
+    # Don't let the client cache every result.
+    self._client.results.clear()
+    self._client.metadata.clear()
+    return results
+
+  def map_rows(self, function, shape, dtype, *iterables):
+    output = numpy.empty(shape, dtype=dtype)
+    for index, row in enumerate(self.map(function, *iterables)):
+      output[index] = row
+    return output
+
+  def close(self):
+    self._client.close()
+
+def create(backend="multiprocessing", processes=None, profile=None, namespace=None, imports=None):
+  """Create a pool of workers.
+
+  Parameters
+  ----------
+  backend: string, optional
+    One of :data:`backends`.
+  processes: integer, optional
+    Number of local worker processes.  Defaults to the number of CPUs.
+    Ignored by the ipython backend.
+  profile: string, optional
+    IPython profile of the cluster used by the ipython backend.
+  namespace: dict, optional
+    Global variables made available to tasks on every worker.
+  imports: list of strings, optional
+    Modules that tasks expect to find imported on every worker.  Local
+    workers inherit the script's imports, so this only matters for the
+    ipython backend.
+
+  Returns
+  -------
+  pool: :class:`Pool`
+  """
+  if backend == "multiprocessing":
+    return LocalPool(processes, namespace)
+  if backend == "ipython":
+    return IPythonPool(profile, namespace, imports)
+  raise ValueError("Unknown parallel backend: %s" % backend)
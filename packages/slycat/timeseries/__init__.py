@@ -0,0 +1,167 @@
+# Copyright 2013, Sandia Corporation. Under the terms of Contract
+# DE-AC04-94AL85000 with Sandia Corporation, the U.S. Government retains certain
+# rights in this software.
+
+"""Distance and exemplar computations for clustering resampled timeseries."""
+
+import multiprocessing
+import numpy
+import scipy.cluster.hierarchy
+import slycat.distance
+
+_waveforms = None
+_norms = None
+
+def _initialize(waveforms):
+  global _waveforms, _norms
+  _waveforms = waveforms
+  _norms = None if waveforms is None else numpy.einsum("ij,ij->i", waveforms, waveforms)
+
+def _distance_block(block):
+  begin, end = block
+  rows = _waveforms[begin:end]
+  columns = _waveforms[begin:]
+  scale = _norms[begin:end, None] + _norms[None, begin:]
+  squared = scale - 2 * numpy.dot(rows, columns.T)
+  # Cancellation makes the expansion inaccurate for nearly identical waveforms, so compare those directly.
+  row_indices, column_indices = numpy.nonzero(squared <= 1e-6 * scale)
+  for i in range(0, len(row_indices), len(rows)):
+    differences = rows[row_indices[i:i + len(rows)]] - columns[column_indices[i:i + len(rows)]]
+    squared[row_indices[i:i + len(rows)], column_indices[i:i + len(rows)]] = numpy.einsum("ij,ij->i", differences, differences)
+  return begin, end, numpy.sqrt(numpy.maximum(squared, 0, out=squared), out=squared)
+
+def distance_blocks(waveforms, block_size=1024, processes=1):
+  """Compute the euclidean distance between every pair of waveforms, a block of rows at a time.
+
+  Each block of rows is only compared against itself and the waveforms that
+  follow it.  Distances are computed with matrix products,
+  :math:`|a-b|^2 = |a|^2 + |b|^2 - 2a \\cdot b`, on waveforms centered about
+  their mean, falling back to direct comparisons for nearly identical
+  waveforms.
+
+  Parameters
+  ----------
+  waveforms : numpy.ndarray
+    :math:`M \\times S` matrix containing :math:`M` waveforms with :math:`S` samples each.
+  block_size : integer, optional
+    Number of rows computed at a time.
+  processes : integer, optional
+    Number of local processes used to compute blocks.
+
+  Returns
+  -------
+  blocks : iterator over (begin, end, distances) tuples, in no particular
+    order, where `distances` is the :math:`(end-begin) \\times (M-begin)` matrix of
+    distances from waveforms `begin` through `end-1` to waveforms `begin`
+    through :math:`M-1`.  Use :func:`slycat.distance.upper` to extract their
+    condensed form.
+  """
+  waveforms = numpy.asarray(waveforms, dtype="float64")
+  if len(waveforms):
+    waveforms = waveforms - waveforms.mean(axis=0)
+  count = waveforms.shape[0]
+  blocks = [(begin, min(begin + block_size, count)) for begin in range(0, count, block_size)]
+
+  if processes > 1 and len(blocks) > 1:
+    pool = multiprocessing.Pool(processes, _initialize, (waveforms,))
+    try:
+      for result in pool.imap_unordered(_distance_block, blocks):
+        yield result
+    finally:
+      pool.terminate()
+  else:
+    _initialize(waveforms)
+    try:
+      for block in blocks:
+        yield _distance_block(block)
+    finally:
+      _initialize(None)
+
+def distance_matrix(waveforms, block_size=1024, processes=1):
+  """Compute the euclidean distance between every pair of waveforms.
+
+  See :func:`distance_blocks` for the parameters.
+
+  Returns
+  -------
+  distances : numpy.ndarray
+    :math:`M \\times M` symmetric matrix of distances.
+  """
+  count = len(waveforms)
+  distances = numpy.zeros((count, count), dtype="float64")
+  for begin, end, block in distance_blocks(waveforms, block_size, processes):
+    distances[begin:end, begin:] = block
+
+  # Mirror the upper triangle, which also clears any rounding noise on the diagonal.
+  lower = numpy.tril_indices(count)
+  distances[lower] = distances.T[lower]
+  return distances
+
+def condensed_distances(waveforms, dataset, block_size=1024, processes=1):
+  """Compute the euclidean distance between every pair of waveforms, storing them in condensed form.
+
+  Only one block of rows is held in memory at a time.  See
+  :func:`distance_blocks` for the parameters.
+
+  Parameters
+  ----------
+  dataset : :class:`h5py.Dataset`
+    Storage created with :func:`slycat.distance.create`.
+  """
+  for begin, end, block in distance_blocks(waveforms, block_size, processes):
+    slycat.distance.write(dataset, begin, slycat.distance.upper(block))
+
+def exemplars(linkage, distances):
+  """Identify the exemplar of every cluster in a hierarchical clustering.
+
+  The exemplar of a cluster is its medoid - the member with the smallest sum of
+  distances to the other members, with ties going to the lowest index.  Each
+  distance is only summed once, when the clusters containing its endpoints are
+  merged.
+
+  Parameters
+  ----------
+  linkage : numpy.ndarray
+    Linkage matrix returned by :func:`scipy.cluster.hierarchy.linkage`.
+  distances : numpy.ndarray
+    :math:`M \\times M` matrix of distances between observations, or the
+    equivalent condensed matrix (see :mod:`slycat.distance`).
+
+  Returns
+  -------
+  exemplars : dict
+    Maps each cluster id (observations are clusters :math:`0` through :math:`M-1`) to
+    the index of its exemplar observation.
+  """
+  count = len(linkage) + 1
+  result = dict([(i, i) for i in range(count)])
+  if count < 2:
+    return result
+
+  # Every cluster is a contiguous range of the dendrogram leaf order.
+  order = scipy.cluster.hierarchy.leaves_list(linkage)
+  sizes = numpy.ones(2 * count - 1, dtype="int64")
+  sizes[count:] = linkage[:, 3]
+  starts = numpy.zeros(2 * count - 1, dtype="int64")
+  for i in range(len(linkage) - 1, -1, -1):
+    left, right = int(linkage[i, 0]), int(linkage[i, 1])
+    starts[left] = starts[count + i]
+    starts[right] = starts[count + i] + sizes[left]
+
+  summed_distances = numpy.zeros(count, dtype="float64")
+  for i in range(len(linkage)):
+    left, right = int(linkage[i, 0]), int(linkage[i, 1])
+    left_members = order[starts[left]:starts[left] + sizes[left]]
+    right_members = order[starts[right]:starts[right] + sizes[right]]
+    if distances.ndim == 1:
+      block = distances[slycat.distance.index(count, left_members[:, None], right_members[None, :])]
+    else:
+      block = distances[numpy.ix_(left_members, right_members)]
+    summed_distances[left_members] += block.sum(axis=1)
+    summed_distances[right_members] += block.sum(axis=0)
+
+    members = order[starts[count + i]:starts[count + i] + sizes[count + i]]
+    member_distances = summed_distances[members]
+    result[count + i] = int(members[member_distances == member_distances.min()].min())
+
+  return result
@@ -350,7 +350,7 @@ class Connection(object):
     """
     return self.request("GET", "/models/%s" % mid, headers={"accept":"application/json"})
 
-  def get_model_arrayset_metadata(self, mid, aid, arrays=None, statistics=None, unique=None):
+  def get_model_arrayset_metadata(self, mid, aid, arrays=None, statistics=None, unique=None, histograms=None, quantiles=None):
     """Retrieve metadata describing an existing model arrayset artifact.
 
     Parameters
@@ -365,6 +365,10 @@ class Connection(object):
       A set of attributes, specified using HQL.
     unique: string, optional
       A set of attributes, specified using HQL.
+    histograms: string, optional
+      A set of attributes, specified using HQL.
+    quantiles: string, optional
+      A set of attributes, specified using HQL.
 
     Returns
     -------
@@ -383,6 +387,10 @@ class Connection(object):
       params["statistics"] = statistics
     if unique is not None:
       params["unique"] = unique
+    if histograms is not None:
+      params["histograms"] = histograms
+    if quantiles is not None:
+      params["quantiles"] = quantiles
     return self.request("GET", "/models/%s/arraysets/%s/metadata" % (mid, aid), params=params, headers={"accept":"application/json"})
 
   def get_model_file(self, mid, aid):
@@ -634,8 +642,16 @@ class Connection(object):
   def post_remotes(self, hostname, username, password, agent=None):
     return self.request("POST", "/remotes", headers={"content-type":"application/json"}, data=json.dumps({"hostname":hostname, "username":username, "password":password, "agent": agent}))["sid"]
 
-  def post_remote_browse(self, sid, path, file_reject=None, file_allow=None, directory_allow=None, directory_reject=None):
+  def post_remote_browse(self, sid, path, file_reject=None, file_allow=None, directory_allow=None, directory_reject=None, sort=None, reverse=False, limit=None, token=None):
     body = {}
+    if sort is not None:
+      body["sort"] = sort
+    if reverse:
+      body["reverse"] = reverse
+    if limit is not None:
+      body["limit"] = limit
+    if token is not None:
+      body["token"] = token
     if file_reject is not None:
       body["file-reject"] = file_reject
     if file_allow is not None:
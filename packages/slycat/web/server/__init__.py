@@ -2,25 +2,59 @@
 # DE-AC04-94AL85000 with Sandia Corporation, the U.S. Government retains certain
 # rights in this software.
 
+import base64
 import os
 import shutil
+import tempfile
+import threading
+import time
 import uuid
 import datetime
 import cherrypy
 import numpy
+import operator
 import paramiko
 import slycat.email
 import slycat.hdf5
 import slycat.hyperchunks
 import slycat.web.server.hdf5
 import slycat.web.server.remote
-from slycat.web.server.cache import Cache
+from slycat.web.server.cache import ResultCache
 from cherrypy._cpcompat import base64_decode
 import urlparse
 import functools
 
 config = {}
-cache_it = Cache(seconds=1000000)  # 277.777778 hours
+
+
+def _arrayset_result_key(function, database, model, aid, *args, **kwargs):
+    """Key arrayset query results by model, artifact, arrayset data version, and query.
+
+    The data version changes whenever the arrayset is modified, so a cached
+    result can never be stale.
+    """
+    artifact = model.get("artifact:%s" % aid)
+    if artifact is None:
+        return None
+    with slycat.web.server.hdf5.reader(artifact):
+        with slycat.web.server.hdf5.open(artifact, "r") as file:
+            version = slycat.hdf5.ArraySet(file).version
+    query = [slycat.hyperchunks.tostring(value) if isinstance(value, slycat.hyperchunks.grammar.Hyperchunks) else value for value in args]
+    query += [(name, slycat.hyperchunks.tostring(value) if isinstance(value, slycat.hyperchunks.grammar.Hyperchunks) else value) for name, value in sorted(kwargs.items())]
+    key = (function.__name__, model["_id"], aid, artifact, version, tuple(query))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+cache_it = ResultCache(_arrayset_result_key)
+
+
+def invalidate_arrayset_results(artifact):
+    """Release cached query results computed from an arrayset artifact that has been modified or deleted."""
+    cache_it.invalidate(lambda key: key[3] == artifact)
 
 
 def mix(a, b, amount):
@@ -28,70 +62,127 @@ def mix(a, b, amount):
     return ((1.0 - amount) * a) + (amount * b)
 
 
-# @cache_it
-def evaluate(hdf5_array, expression, expression_type, expression_level=0):
-    """Evaluate a hyperchunk expression."""
-    cherrypy.log.error("%sEvaluating %s expression: %s" % (
-        "  " * expression_level, expression_type, slycat.hyperchunks.tostring(expression)))
-    if isinstance(expression, int):
-        return expression
-    elif isinstance(expression, float):
-        return expression
-    elif isinstance(expression, basestring):
-        return expression
+def _equal(left, right):
+    """Element-wise equality, where comparing with nan matches nan values."""
+    if numpy.isnan(right):
+        return numpy.isnan(left)
+    return left == right
+
+
+_binary_operators = {
+    "<": operator.lt,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge,
+    "==": _equal,
+    "!=": operator.ne,
+    "and": numpy.logical_and,
+    "or": numpy.logical_or,
+    "in": numpy.in1d,
+    "not in": lambda left, right: numpy.in1d(left, right, invert=True),
+}
+
+
+def _read(data, selection):
+    """Read a selection from an attribute, letting HDF5 do the subsetting wherever it can.
+
+    `selection` is either a hyperslice, or a 1D array of indices along the
+    first dimension (e.g. rows picked out by a sort order).
+    """
+    if selection is Ellipsis:
+        return data[...]
+    if isinstance(selection, numpy.ndarray):
+        if not len(selection):
+            return numpy.empty((0,) + tuple(data.shape[1:]), dtype=data.dtype)
+        if len(selection) > data.shape[0] // 10:
+            # Point selections get slow long before a full read does.
+            return data[...][selection]
+        rows, inverse = numpy.unique(selection, return_inverse=True)
+        return data[rows.tolist()][inverse]
+    for item in selection:
+        if isinstance(item, slice) and item.step is not None and item.step < 0:
+            # HDF5 can't read backwards.
+            return data[...][selection]
+    return data[selection]
+
+
+def _select(values, selection):
+    """Apply a selection (see :func:`_read`) to values that are already in memory."""
+    if selection is Ellipsis:
+        return values
+    return values[selection]
+
+
+def compile_expression(expression):
+    """Compile a hyperchunk expression into a reusable evaluation plan.
+
+    The plan is a function that takes a :class:`slycat.hdf5.DArray` and an
+    optional selection - a hyperslice, or an array of indices along the first
+    dimension - and returns the expression's value for just that selection.
+    Attribute references and element-wise operators push the selection down
+    into the HDF5 read, so only the selected data is ever loaded; operators
+    like rank() that depend on the whole attribute read it all, then select.
+
+    Plans are stored on the (cached) parse tree, so an expression is only
+    compiled once no matter how many requests use it.
+    """
+    plan = getattr(expression, "_plan", None)
+    if plan is not None:
+        return plan
+
+    if isinstance(expression, (int, float, basestring)):
+        return lambda hdf5_array, selection=Ellipsis: expression
     elif isinstance(expression, slycat.hyperchunks.grammar.AttributeIndex):
-        return hdf5_array.get_data(expression.index)[...]
+        index = expression.index
+        plan = lambda hdf5_array, selection=Ellipsis: _read(hdf5_array.get_data(index), selection)
     elif isinstance(expression, slycat.hyperchunks.grammar.BinaryOperator):
-        left = evaluate(hdf5_array, expression.operands[0], expression_type, expression_level + 1)
-        for operand in expression.operands[1:]:
-            right = evaluate(hdf5_array, operand, expression_type, expression_level + 1)
-            # cherrypy.log.error("left::%s \n right::%s" % (left, right))
-            if expression.operator == "<":
-                left = left < right
-            elif expression.operator == ">":
-                left = left > right
-            elif expression.operator == "<=":
-                left = left <= right
-            elif expression.operator == ">=":
-                left = left >= right
-            elif expression.operator == "==":
-                if numpy.isnan(right):
-                    left = numpy.isnan(left)
-                else:
-                    left = left == right
-            elif expression.operator == "!=":
-                left = left != right
-            elif expression.operator == "and":
-                left = numpy.logical_and(left, right)
-            elif expression.operator == "or":
-                left = numpy.logical_or(left, right)
-            elif expression.operator == "in":
-                left = numpy.in1d(left, right)
-            elif expression.operator == "not in":
-                left = numpy.in1d(left, right, invert=True)
-            else:
-                slycat.email.send_error("slycat.web.server.__init__.py evaluate",
-                                        "Unknown operator: %s" % expression.operator)
-                raise ValueError("Unknown operator: %s" % expression.operator)
-        return left
+        if expression.operator not in _binary_operators:
+            slycat.email.send_error("slycat.web.server.__init__.py compile_expression",
+                                    "Unknown operator: %s" % expression.operator)
+            raise ValueError("Unknown operator: %s" % expression.operator)
+        function = _binary_operators[expression.operator]
+        operands = [compile_expression(operand) for operand in expression.operands]
+
+        def plan(hdf5_array, selection=Ellipsis):
+            left = operands[0](hdf5_array, selection)
+            for operand in operands[1:]:
+                left = function(left, operand(hdf5_array, selection))
+            return left
     elif isinstance(expression, slycat.hyperchunks.grammar.FunctionCall):
         if expression.name == "index":
-            return numpy.indices(hdf5_array.shape)[expression.args[0]]
+            dimension = expression.args[0]
+
+            def plan(hdf5_array, selection=Ellipsis):
+                shape = hdf5_array.shape
+                indices = numpy.arange(shape[dimension]).reshape([-1 if axis == dimension else 1 for axis in range(len(shape))])
+                return _select(numpy.broadcast_to(indices, shape), selection).copy()
         elif expression.name == "rank":
-            values = evaluate(hdf5_array, expression.args[0], expression_type, expression_level + 1)
-            order = numpy.argsort(values)
-            if expression.args[1] == "desc":
-                order = order[::-1]
-            return order
+            values = compile_expression(expression.args[0])
+            descending = expression.args[1] == "desc"
+
+            def plan(hdf5_array, selection=Ellipsis):
+                order = numpy.argsort(values(hdf5_array))
+                if descending:
+                    order = order[::-1]
+                return _select(order, selection)
         else:
-            slycat.email.send_error("slycat.web.server.__init__.py evaluate", "Unknown function: %s" % expression.name)
+            slycat.email.send_error("slycat.web.server.__init__.py compile_expression", "Unknown function: %s" % expression.name)
             raise ValueError("Unknown function: %s" % expression.name)
     elif isinstance(expression, slycat.hyperchunks.grammar.List):
-        return expression.values
+        values = expression.values
+        plan = lambda hdf5_array, selection=Ellipsis: values
     else:
-        slycat.email.send_error("slycat.web.server.__init__.py evaluate", "Unknown expression: %s" % expression)
+        slycat.email.send_error("slycat.web.server.__init__.py compile_expression", "Unknown expression: %s" % expression)
         raise ValueError("Unknown expression: %s" % expression)
 
+    expression._plan = plan
+    return plan
+
+
+def evaluate(hdf5_array, expression, expression_type, expression_level=0, selection=Ellipsis):
+    """Evaluate a hyperchunk expression, optionally for just a selection of the array (see :func:`compile_expression`)."""
+    return compile_expression(expression)(hdf5_array, selection)
+
 
 def update_model(database, model, **kwargs):
     """
@@ -104,8 +195,32 @@ def update_model(database, model, **kwargs):
     database.save(model)
 
 
+def update_arrayset_statistics(artifact, hyperchunks):
+    """Fill in missing statistics caches for the arrays referenced by a collection of hyperchunks.
+
+    Statistics are normally computed when data is stored, so this only has to
+    write for arrays that were ingested before that was the case.
+    """
+    with slycat.web.server.hdf5.reader(artifact):
+        with slycat.web.server.hdf5.open(artifact, "r") as file:
+            hdf5_arrayset = slycat.hdf5.ArraySet(file)
+            missing = set()
+            for chunks in hyperchunks:
+                if chunks is None:
+                    continue
+                for array in slycat.hyperchunks.arrays(chunks, hdf5_arrayset.array_count()):
+                    if not hdf5_arrayset[array.index].statistics_cached():
+                        missing.add(array.index)
+    if missing:
+        with slycat.web.server.hdf5.writer(artifact):
+            with slycat.web.server.hdf5.open(artifact, "r+") as file:
+                hdf5_arrayset = slycat.hdf5.ArraySet(file)
+                for array_index in sorted(missing):
+                    hdf5_arrayset[array_index].update_statistics()
+
+
 @cache_it
-def get_model_arrayset_metadata(database, model, aid, arrays=None, statistics=None, unique=None):
+def get_model_arrayset_metadata(database, model, aid, arrays=None, statistics=None, unique=None, histograms=None, quantiles=None):
     """Retrieve metadata describing an arrayset artifact.
   Parameters
   ----------
@@ -122,6 +237,12 @@ def get_model_arrayset_metadata(database, model, aid, arrays=None, statistics=No
   unique: string or hyperchunks parse tree, optional
     Specifies a collection of array attributes, in :ref:`Hyperchunks` format.
     Unique values from each attribute will be returned in the results.
+  histograms: string or hyperchunks parse tree, optional
+    Specifies a collection of array attributes, in :ref:`Hyperchunks` format.
+    A fixed-bin histogram of each numeric attribute will be returned in the results.
+  quantiles: string or hyperchunks parse tree, optional
+    Specifies a collection of array attributes, in :ref:`Hyperchunks` format.
+    A quantile sketch of each numeric attribute will be returned in the results.
   Returns
   -------
   metadata: dict
@@ -135,11 +256,15 @@ def get_model_arrayset_metadata(database, model, aid, arrays=None, statistics=No
         statistics = slycat.hyperchunks.parse(statistics)
     if isinstance(unique, basestring):
         unique = slycat.hyperchunks.parse(unique)
+    if isinstance(histograms, basestring):
+        histograms = slycat.hyperchunks.parse(histograms)
+    if isinstance(quantiles, basestring):
+        quantiles = slycat.hyperchunks.parse(quantiles)
 
     # Handle legacy behavior.
-    if arrays is None and statistics is None and unique is None:
-        with slycat.web.server.hdf5.lock:
-            with slycat.web.server.hdf5.open(model["artifact:%s" % aid], "r+") as file:
+    if arrays is None and statistics is None and unique is None and histograms is None and quantiles is None:
+        with slycat.web.server.hdf5.reader(model["artifact:%s" % aid]):
+            with slycat.web.server.hdf5.open(model["artifact:%s" % aid], "r") as file:
                 hdf5_arrayset = slycat.hdf5.ArraySet(file)
                 results = []
                 for array in sorted(hdf5_arrayset.keys()):
@@ -153,9 +278,11 @@ def get_model_arrayset_metadata(database, model, aid, arrays=None, statistics=No
                     })
                 return results
 
-    with slycat.web.server.hdf5.lock:
-        with slycat.web.server.hdf5.open(model["artifact:%s" % aid],
-                                         "r+") as file:  # We have to open the file with writing enabled in case the statistics cache needs to be updated.
+    if statistics is not None or unique is not None or histograms is not None or quantiles is not None:
+        update_arrayset_statistics(model["artifact:%s" % aid], [statistics, unique, histograms, quantiles])
+
+    with slycat.web.server.hdf5.reader(model["artifact:%s" % aid]):
+        with slycat.web.server.hdf5.open(model["artifact:%s" % aid], "r") as file:
             hdf5_arrayset = slycat.hdf5.ArraySet(file)
             results = {}
             if arrays is not None:
@@ -206,6 +333,40 @@ def get_model_arrayset_metadata(database, model, aid, arrays=None, statistics=No
                             unique["values"] = [a.tolist() for a in unique["values"]]
                         results["unique"].append(unique)
 
+            if histograms is not None:
+                results["histograms"] = []
+                for array in slycat.hyperchunks.arrays(histograms, hdf5_arrayset.array_count()):
+                    hdf5_array = hdf5_arrayset[array.index]
+                    for attribute in array.attributes(len(hdf5_array.attributes)):
+                        histogram = {}
+                        histogram["array"] = array.index
+                        if isinstance(attribute.expression, slycat.hyperchunks.grammar.AttributeIndex):
+                            histogram["attribute"] = attribute.expression.index
+                            histogram.update(hdf5_array.get_histogram(attribute.expression.index))
+                        else:
+                            values = evaluate(hdf5_array, attribute.expression, "histograms").ravel()
+                            values = values[numpy.invert(numpy.isnan(values))]
+                            histogram["counts"], histogram["edges"] = slycat.hdf5.histogram(values) if len(values) else (None, None)
+                        results["histograms"].append(histogram)
+
+            if quantiles is not None:
+                results["quantiles"] = []
+                for array in slycat.hyperchunks.arrays(quantiles, hdf5_arrayset.array_count()):
+                    hdf5_array = hdf5_arrayset[array.index]
+                    for attribute in array.attributes(len(hdf5_array.attributes)):
+                        sketch = {}
+                        sketch["array"] = array.index
+                        if isinstance(attribute.expression, slycat.hyperchunks.grammar.AttributeIndex):
+                            sketch["attribute"] = attribute.expression.index
+                            sketch.update(hdf5_array.get_quantiles(attribute.expression.index))
+                        else:
+                            values = evaluate(hdf5_array, attribute.expression, "quantiles").ravel()
+                            values = values[numpy.invert(numpy.isnan(values))]
+                            centroids = slycat.hdf5.quantile_sketch(values) if len(values) else None
+                            sketch["values"] = centroids[:, 0] if centroids is not None else None
+                            sketch["counts"] = centroids[:, 1] if centroids is not None else None
+                        results["quantiles"].append(sketch)
+
             return results
 
 
@@ -231,20 +392,31 @@ def get_model_arrayset_data(database, model, aid, hyperchunks):
     if isinstance(hyperchunks, basestring):
         hyperchunks = slycat.hyperchunks.parse(hyperchunks)
     return_list = []
-    with slycat.web.server.hdf5.lock:
-        with slycat.web.server.hdf5.open(model["artifact:%s" % aid], "r+") as file:
+    with slycat.web.server.hdf5.reader(model["artifact:%s" % aid]):
+        with slycat.web.server.hdf5.open(model["artifact:%s" % aid], "r") as file:
             hdf5_arrayset = slycat.hdf5.ArraySet(file)
             for array in slycat.hyperchunks.arrays(hyperchunks, hdf5_arrayset.array_count()):
                 hdf5_array = hdf5_arrayset[array.index]
+                order = None
                 if array.order is not None:
                     order = evaluate(hdf5_array, array.order, "order")
                 for attribute in array.attributes(len(hdf5_array.attributes)):
-                    values = evaluate(hdf5_array, attribute.expression, "attribute")
+                    values = None
                     for hyperslice in attribute.hyperslices():
-                        if array.order is not None:
-                            return_list.append(values[order][hyperslice])
+                        if order is None:
+                            # Only read the data in the hyperslice.
+                            return_list.append(evaluate(hdf5_array, attribute.expression, "attribute", selection=hyperslice))
+                        elif hdf5_array.ndim == 1:
+                            # Only read the rows that end up in the hyperslice once they're sorted.
+                            rows = order[hyperslice]
+                            if isinstance(rows, numpy.ndarray) and rows.ndim == 1:
+                                return_list.append(evaluate(hdf5_array, attribute.expression, "attribute", selection=rows))
+                            else:
+                                return_list.append(evaluate(hdf5_array, attribute.expression, "attribute", selection=(int(rows),)))
                         else:
-                            return_list.append(values[hyperslice])
+                            if values is None:
+                                values = evaluate(hdf5_array, attribute.expression, "attribute")
+                            return_list.append(values[order][hyperslice])
     return return_list
 
 
@@ -267,7 +439,7 @@ def put_model_arrayset(database, model, aid, input=False):
   """
     slycat.web.server.update_model(database, model, message="Starting array set %s." % (aid))
     storage = uuid.uuid4().hex
-    with slycat.web.server.hdf5.lock:
+    with slycat.web.server.hdf5.writer(storage):
         with slycat.web.server.hdf5.create(storage) as file:
             arrayset = slycat.hdf5.start_arrayset(file)
             database.save({"_id": storage, "type": "hdf5"})
@@ -292,7 +464,7 @@ def put_model_array(database, model, aid, array_index, attributes, dimensions):
   """
     slycat.web.server.update_model(database, model, message="Starting array set %s array %s." % (aid, array_index))
     storage = model["artifact:%s" % aid]
-    with slycat.web.server.hdf5.lock:
+    with slycat.web.server.hdf5.writer(storage):
         with slycat.web.server.hdf5.open(storage, "r+") as file:
             slycat.hdf5.ArraySet(file).start_array(array_index, dimensions, attributes)
 
@@ -324,9 +496,10 @@ def put_model_arrayset_data(database, model, aid, hyperchunks, data):
 
     slycat.web.server.update_model(database, model, message="Storing data to array set %s." % (aid))
 
-    with slycat.web.server.hdf5.lock:
+    with slycat.web.server.hdf5.writer(model["artifact:%s" % aid]):
         with slycat.web.server.hdf5.open(model["artifact:%s" % aid], "r+") as file:
             hdf5_arrayset = slycat.hdf5.ArraySet(file)
+            modified = set()
             for array in slycat.hyperchunks.arrays(hyperchunks, hdf5_arrayset.array_count()):
                 hdf5_array = hdf5_arrayset[array.index]
                 for attribute in array.attributes(len(hdf5_array.attributes)):
@@ -341,7 +514,13 @@ def put_model_arrayset_data(database, model, aid, hyperchunks, data):
                         if isinstance(data_hyperslice, list):
                             data_hyperslice = numpy.array(data_hyperslice, dtype=stored_type)
                         hdf5_array.set_data(attribute.expression.index, hyperslice, data_hyperslice)
-            file.close()
+                    modified.add((array.index, attribute.expression.index))
+
+            # Compute statistics now, while we hold the write lock, so readers never have to.
+            for array_index, attribute_index in sorted(modified):
+                hdf5_arrayset[array_index].update_statistics(attribute_index)
+
+    invalidate_arrayset_results(model["artifact:%s" % aid])
 
 
 def put_model_file(database, model, aid, value, content_type, input=False):
@@ -379,7 +558,7 @@ def put_model_inputs(database, model, source, deep_copy=False):
             if deep_copy:
                 new_value = uuid.uuid4().hex
                 os.makedirs(os.path.dirname(slycat.web.server.hdf5.path(new_value)))
-                with slycat.web.server.hdf5.lock:
+                with slycat.web.server.hdf5.reader(original_value):
                     shutil.copy(slycat.web.server.hdf5.path(original_value), slycat.web.server.hdf5.path(new_value))
                     model["artifact:%s" % aid] = new_value
                     database.save({"_id": new_value, "type": "hdf5"})
@@ -489,21 +668,30 @@ def post_model_file(mid, input=None, sid=None, path=None, aid=None, parser=None,
         slycat.email.send_error("slycat.web.server.__init__.py put_model_file", "Required input parameter is missing.")
         raise Exception("Required input parameter is missing.")
 
+    if parser is None:
+        Exception("Required parser parameter is missing.")
+    if parser not in slycat.web.server.plugin.manager.parsers:
+        slycat.email.send_error("slycat.web.server.__init__.py post_model_file", "Unknown parser plugin: %s." % parser)
+        raise Exception("Unknown parser plugin: %s." % parser)
+    streaming = slycat.web.server.plugin.manager.parsers[parser].get("streaming", False)
+
     if path is not None and sid is not None:
         with slycat.web.server.remote.get_session(sid) as session:
             filename = "%s@%s:%s" % (session.username, session.hostname, path)
             # TODO verify that the file exists first...
-            file = session.sftp.file(path).read()
+            content = session.iter_file(path)
+            if streaming:
+                # Spool the file to local disk a chunk at a time, so it never has to fit in memory.
+                file = tempfile.TemporaryFile()
+                for chunk in content:
+                    file.write(chunk)
+                file.seek(0)
+            else:
+                file = "".join(content)
     else:
         slycat.email.send_error("slycat.web.server.__init__.py post_model_file", "Must supply path and sid parameters.")
         raise Exception("Must supply path and sid parameters.")
 
-    if parser is None:
-        Exception("Required parser parameter is missing.")
-    if parser not in slycat.web.server.plugin.manager.parsers:
-        slycat.email.send_error("slycat.web.server.__init__.py post_model_file", "Unknown parser plugin: %s." % parser)
-        raise Exception("Unknown parser plugin: %s." % parser)
-
     database = slycat.web.server.database.couchdb.connect()
     model = database.get("model", mid)
 
@@ -512,6 +700,67 @@ def post_model_file(mid, input=None, sid=None, path=None, aid=None, parser=None,
     except Exception as e:
         slycat.email.send_error("slycat.web.server.__init__.py post_model_file", "%s" % e)
         raise Exception("%s" % e)
+    finally:
+        if streaming:
+            file.close()
+
+
+def _certificate_expiration(certificate):
+    """Return the time an OpenSSH RSA certificate stops being valid, in seconds since the epoch."""
+    message = paramiko.Message(base64.b64decode(certificate.split()[1]))
+    message.get_string()  # key type
+    message.get_string()  # nonce
+    message.get_mpint()  # e
+    message.get_mpint()  # n
+    message.get_int64()  # serial
+    message.get_int()  # type
+    message.get_string()  # key id
+    message.get_string()  # valid principals
+    message.get_int64()  # valid after
+    return message.get_int64()
+
+
+def _certificate(login):
+    """Return a private key and signed certificate for a user, reusing them until shortly before the certificate expires.
+
+    Generating the key and having it signed takes seconds, so it is only done
+    once per certificate lifetime instead of once per connection.
+    """
+    with _certificates_lock:
+        if login in _certificates and _certificates[login][0] > time.time():
+            return _certificates[login][1:]
+
+    import requests
+    num_bits = 2056
+    # create the private key
+    pvt_key = paramiko.RSAKey.generate(num_bits)
+    # create the public key
+    pub_key = "ssh-rsa " + pvt_key.get_base64()  # SSO specific format
+    # pub_key = "ssh-rsa " + pvt_key.get_base64()
+    # + " " + principal + "\n"  # General Format, principal is <username>@<hostname>
+    cherrypy.log.error("ssh_connect cert method, POST to sso-auth-server for user: %s" % login)
+    r = requests.post(slycat.web.server.config["slycat-web-server"]["sso-auth-server"]["url"],
+                      cert=(slycat.web.server.config["slycat-web-server"]["ssl-certificate"]["cert-path"],
+                            slycat.web.server.config["slycat-web-server"]["ssl-certificate"]["key-path"]),
+                      data='{"principal": "' + login + '", "pubkey": "' + pub_key + '"}',
+                      headers={"Content-Type": "application/json"},
+                      verify=False)
+    cherrypy.log.error("ssh_connect cert method, POST result: %s" % str(r))
+    certificate = str(r.json()["certificate"])
+
+    # Stop using the certificate a minute early, so connections don't race its expiration.
+    try:
+        expiration = min(_certificate_expiration(certificate), time.time() + 24 * 60 * 60) - 60
+    except Exception as e:
+        cherrypy.log.error("ssh_connect cert method, couldn't read certificate validity, not reusing it: %s" % str(e))
+        expiration = 0
+    with _certificates_lock:
+        _certificates[login] = (expiration, pvt_key, certificate)
+    return pvt_key, certificate
+
+
+_certificates = {}
+_certificates_lock = threading.Lock()
 
 
 def ssh_connect(hostname=None, username=None, password=None):
@@ -521,28 +770,12 @@ def ssh_connect(hostname=None, username=None, password=None):
         ssh.connect(hostname=hostname, username=username, password=password)
         ssh.get_transport().set_keepalive(5)
     else:
-        import requests
         import tempfile
-        num_bits = 2056
-        # create the private key
-        pvt_key = paramiko.RSAKey.generate(num_bits)
-        # create the public key
-        pub_key = "ssh-rsa " + pvt_key.get_base64()  # SSO specific format
-        # pub_key = "ssh-rsa " + pvt_key.get_base64()
-        # + " " + principal + "\n"  # General Format, principal is <username>@<hostname>
-        cherrypy.log.error("ssh_connect cert method, POST to sso-auth-server for user: %s" % cherrypy.request.login)
-        r = requests.post(slycat.web.server.config["slycat-web-server"]["sso-auth-server"]["url"],
-                          cert=(slycat.web.server.config["slycat-web-server"]["ssl-certificate"]["cert-path"],
-                                slycat.web.server.config["slycat-web-server"]["ssl-certificate"]["key-path"]),
-                          data='{"principal": "' + cherrypy.request.login + '", "pubkey": "' + pub_key + '"}',
-                          headers={"Content-Type": "application/json"},
-                          verify=False)
-
-        cherrypy.log.error("ssh_connect cert method, POST result: %s" % str(r))
+        pvt_key, certificate = _certificate(cherrypy.request.login)
         # create a cert file obj
         # cert_file_object = tempfile.TemporaryFile().write(str(r.json()["certificate"])).seek(0) #this line crashes
         cert_file_object = tempfile.TemporaryFile()
-        cert_file_object.write(str(r.json()["certificate"]))
+        cert_file_object.write(certificate)
         cert_file_object.seek(0)
         # create a key file obj
         key_file_object = tempfile.TemporaryFile()
@@ -560,6 +793,8 @@ def ssh_connect(hostname=None, username=None, password=None):
         except paramiko.AuthenticationException as e:
             cherrypy.log.error("ssh_connect cert method, authentication failed for %s@%s: %s" % (cherrypy.request.login, hostname, str(e)))
             cherrypy.log.error("ssh_connect cert method, called ssh.connect traceback: %s" % traceback.print_exc())
+            with _certificates_lock:
+                _certificates.pop(cherrypy.request.login, None)
             raise cherrypy.HTTPError("403 Remote authentication failed.")
         ssh.get_transport().set_keepalive(5)
         cert_file_object.close()
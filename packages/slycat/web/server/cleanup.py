@@ -24,6 +24,7 @@ def _array_cleanup_worker():
         for file in database.view("slycat/hdf5-file-counts", group=True):
           if file.value == 0:
             slycat.web.server.hdf5.delete(file.key)
+            slycat.web.server.invalidate_arrayset_results(file.key)
             database.delete(database[file.key])
         cherrypy.log.error("Array cleanup worker finished.")
         break
@@ -52,23 +53,10 @@ def _login_session_cleanup_worker():
 _login_session_cleanup_worker.thread = threading.Thread(name="session-cleanup", target=_login_session_cleanup_worker)
 _login_session_cleanup_worker.thread.daemon = True
 
-def _cache_cleanup_worker():
-      import cherrypy
-      from slycat.web.server import cache_it
-      cherrypy.log.error("Started server cache cleanup worker.")
-      while True:
-        time.sleep(datetime.timedelta(minutes=15).total_seconds())
-        cherrypy.log.error("[CACHE] running server cache-cleanup thread")
-        cache_it.clean()
-
-_cache_cleanup_worker.thread = threading.Thread(name="cache-cleanup", target=_cache_cleanup_worker)
-_cache_cleanup_worker.thread.daemon = True
-
 def start():
   """Called to start all of the cleanup worker threads."""
   _array_cleanup_worker.thread.start()
   _login_session_cleanup_worker.thread.start()
-  _cache_cleanup_worker.thread.start()
 
 def arrays():
   """Request a cleanup pass for unused arrays."""
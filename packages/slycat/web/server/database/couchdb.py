@@ -11,16 +11,106 @@ database stores links to HDF5 files stored on disk.
 from __future__ import absolute_import
 
 import cherrypy
+import collections
+import copy
 import couchdb.client
 import threading
 import time
 import uuid
 import slycat.email
 
+class DocumentCache(object):
+  """Read-through LRU cache of CouchDB documents, kept coherent by following the database _changes feed.
+
+  Documents are only served from the cache while :meth:`follow` is consuming
+  the feed; if the feed is interrupted the cache is emptied, and bypassed
+  until the feed is back.  Callers always receive their own copy of a
+  document, so they're free to modify and save it.
+  """
+  def __init__(self, size=1000):
+    self._size = size
+    self._documents = collections.OrderedDict()
+    self._lock = threading.Lock()
+    self._following = False
+    # Incremented by every invalidation, so a fetch that raced with a change isn't cached.
+    self._invalidations = 0
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self._documents)
+
+  @property
+  def following(self):
+    return self._following
+
+  def get(self, id, fetch):
+    """Return a document from the cache, or call fetch(id) to retrieve it from the database."""
+    with self._lock:
+      following = self._following
+      invalidations = self._invalidations
+      document = self._documents.pop(id, None) if following else None
+      if document is not None:
+        self._documents[id] = document
+        self.hits += 1
+        return copy.deepcopy(document)
+      self.misses += 1
+
+    document = fetch(id)
+
+    if following:
+      with self._lock:
+        if self._following and self._invalidations == invalidations:
+          self._documents[id] = copy.deepcopy(document)
+          while len(self._documents) > self._size:
+            self._documents.popitem(last=False)
+    return document
+
+  def invalidate(self, id):
+    """Remove a document from the cache."""
+    with self._lock:
+      self._invalidations += 1
+      self._documents.pop(id, None)
+
+  def _start_following(self):
+    with self._lock:
+      self._invalidations += 1
+      self._documents.clear()
+      self._following = True
+
+  def _stop_following(self):
+    with self._lock:
+      self._invalidations += 1
+      self._documents.clear()
+      self._following = False
+
+  def follow(self, database, heartbeat=30000):
+    """Consume the _changes feed of a :class:`couchdb.client.Database`, invalidating documents as they change.
+
+    Runs forever, so call it from a dedicated thread.
+    """
+    while True:
+      try:
+        since = database.changes(limit=0)["last_seq"]
+        self._start_following()
+        for change in database.changes(feed="continuous", since=since, heartbeat=heartbeat):
+          if "id" in change:
+            self.invalidate(change["id"])
+      except Exception as e:
+        cherrypy.log.error("CouchDB document cache lost the changes feed: %s" % e)
+      finally:
+        self._stop_following()
+      time.sleep(2)
+
 class Database:
   """Wraps a :class:`couchdb.client.Database` to convert CouchDB exceptions into CherryPy exceptions."""
-  def __init__(self, database):
+  def __init__(self, database, cache=None):
     self._database = database
+    self._cache = cache
+
+  def _invalidate(self, document):
+    if self._cache is not None and isinstance(document, dict) and "_id" in document:
+      self._cache.invalidate(document["_id"])
 
   def __getitem__(self, *arguments, **keywords):
     return self._database.__getitem__(*arguments, **keywords)
@@ -28,21 +118,29 @@ class Database:
   def changes(self, *arguments, **keywords):
     return self._database.changes(*arguments, **keywords)
 
-  def delete(self, *arguments, **keywords):
-    return self._database.delete(*arguments, **keywords)
+  def delete(self, document, *arguments, **keywords):
+    try:
+      return self._database.delete(document, *arguments, **keywords)
+    finally:
+      self._invalidate(document)
 
   def get_attachment(self, *arguments, **keywords):
     return self._database.get_attachment(*arguments, **keywords)
 
-  def put_attachment(self, *arguments, **keywords):
-    return self._database.put_attachment(*arguments, **keywords)
+  def put_attachment(self, document, *arguments, **keywords):
+    try:
+      return self._database.put_attachment(document, *arguments, **keywords)
+    finally:
+      self._invalidate(document)
 
-  def save(self, *arguments, **keywords):
+  def save(self, document, *arguments, **keywords):
     try:
-      return self._database.save(*arguments, **keywords)
+      return self._database.save(document, *arguments, **keywords)
     except couchdb.http.ServerError as e:
       slycat.email.send_error("slycat.web.server.database.couchdb.py save", "%s %s" % (e.message[0], e.message[1][1]))
       raise cherrypy.HTTPError("%s %s" % (e.message[0], e.message[1][1]))
+    finally:
+      self._invalidate(document)
 
   def view(self, *arguments, **keywords):
     return self._database.view(*arguments, **keywords)
@@ -54,7 +152,10 @@ class Database:
 
   def get(self, type, id):
     try:
-      document = self[id]
+      if self._cache is not None:
+        document = self._cache.get(id, self.__getitem__)
+      else:
+        document = self[id]
     except couchdb.client.http.ResourceNotFound:
       raise cherrypy.HTTPError(404)
     if document["type"] != type:
@@ -77,10 +178,29 @@ class Database:
 def connect():
   """Connect to a CouchDB database.
 
+  Every caller shares one :class:`couchdb.client.Server`, and with it one
+  HTTP connection pool, along with a :class:`DocumentCache` that's kept up
+  to date by a background thread following the database changes feed.
+
   Returns
   -------
   database : :class:`slycat.web.server.database.couchdb.Database`
   """
-  server = couchdb.client.Server(url=cherrypy.tree.apps[""].config["slycat"]["couchdb-host"])
-  database = Database(server[cherrypy.tree.apps[""].config["slycat"]["couchdb-database"]])
-  return database
+  with connect.lock:
+    if connect.database is None:
+      configuration = cherrypy.tree.apps[""].config["slycat"]
+      server = couchdb.client.Server(url=configuration["couchdb-host"])
+      connect.database = server[configuration["couchdb-database"]]
+
+      cache_size = configuration.get("couchdb-document-cache", {}).get("size", 1000)
+      if cache_size:
+        connect.cache = DocumentCache(size=cache_size)
+        # The continuous feed ties up a connection, so it gets a server (and pool) of its own.
+        feed = couchdb.client.Server(url=configuration["couchdb-host"])[configuration["couchdb-database"]]
+        thread = threading.Thread(name="couchdb-changes", target=connect.cache.follow, args=(feed,))
+        thread.daemon = True
+        thread.start()
+  return Database(connect.database, connect.cache)
+connect.lock = threading.Lock()
+connect.database = None
+connect.cache = None
@@ -93,6 +93,7 @@ def start(root_path, config_file):
   dispatcher.connect("get-model-array-attribute-chunk", "/models/:mid/arraysets/:aid/arrays/:array/attributes/:attribute/chunk", slycat.web.server.handlers.get_model_array_attribute_chunk, conditions={"method" : ["GET"]})
   dispatcher.connect("get-model-arrayset-data", "/models/:mid/arraysets/:aid/data", slycat.web.server.handlers.get_model_arrayset_data, conditions={"method" : ["GET"]})
 
+  dispatcher.connect("post-model-arrayset-downsample", "/models/:mid/arraysets/:aid/arrays/:array/downsample", slycat.web.server.handlers.post_model_arrayset_downsample, conditions={"method" : ["POST"]})
   dispatcher.connect("post-model-arrayset-data", "/models/:mid/arraysets/:aid/data", slycat.web.server.handlers.post_model_arrayset_data, conditions={"method" : ["POST"]})
 
   dispatcher.connect("get-model-arrayset-metadata", "/models/:mid/arraysets/:aid/metadata", slycat.web.server.handlers.get_model_arrayset_metadata, conditions={"method" : ["GET"]})
@@ -163,6 +164,7 @@ def start(root_path, config_file):
   dispatcher.connect("set-user-config", "/remotes/:hostname/set-user-config", slycat.web.server.handlers.set_user_config, conditions={ "method": ["POST"] })
 
   dispatcher.connect("post-uploads", "/uploads", slycat.web.server.handlers.post_uploads, conditions={"method" : ["POST"]})
+  dispatcher.connect("get-upload", "/uploads/:uid", slycat.web.server.handlers.get_upload, conditions={"method" : ["GET"]})
   dispatcher.connect("put-upload-file-part", "/uploads/:uid/files/:fid/parts/:pid", slycat.web.server.handlers.put_upload_file_part, conditions={"method" : ["PUT"]})
   dispatcher.connect("post-upload-finshed", "/uploads/:uid/finished", slycat.web.server.handlers.post_upload_finished, conditions={"method" : ["POST"]})
   dispatcher.connect("delete-upload", "/uploads/:uid", slycat.web.server.handlers.delete_upload, conditions={"method" : ["DELETE"]})
@@ -293,6 +295,9 @@ def start(root_path, config_file):
   # wsgi: this just saves this dict in the slycat obj, no cherrypy stuff here
   slycat.web.server.config = configuration
 
+  # Apply any overrides to the layout of newly-created arrays.
+  slycat.hdf5.configure_storage(configuration["slycat-web-server"].get("hdf5-storage", {}))
+
   # Start all of our cleanup workers.
   cherrypy.engine.subscribe("start", slycat.web.server.cleanup.start, priority=80)
 
@@ -16,9 +16,11 @@ import time
 import Queue
 import cPickle
 import re
+import slycat.columnar
 import slycat.email
 import slycat.hdf5
 import slycat.hyperchunks
+import slycat.lod
 import slycat.uri
 import slycat.web.server
 import slycat.web.server.authentication
@@ -32,6 +34,7 @@ import slycat.web.server.streaming
 import slycat.web.server.template
 import slycat.web.server.upload
 import stat
+import StringIO
 import subprocess
 import sys
 import threading
@@ -769,6 +772,9 @@ def post_model_files(mid, input=None, files=None, sids=None, paths=None, aids=No
     project = database.get("project", model["project"])
     slycat.web.server.authentication.require_project_writer(project)
 
+    if slycat.web.server.plugin.manager.parsers[parser].get("streaming", False):
+        files = [StringIO.StringIO(file) for file in files]
+
     try:
         slycat.web.server.plugin.manager.parsers[parser]["parse"](database, model, input, files, aids, **kwargs)
     except Exception as e:
@@ -809,7 +815,7 @@ def put_upload_file_part(uid, fid, pid, file=None, hostname=None, path=None):
     pid = require_integer_parameter(pid, "pid")
 
     if file is not None and hostname is None and path is None:
-        data = file.file.read()
+        data = file.file
     elif file is None and hostname is not None and path is not None:
         sid = get_sid(hostname)
         with slycat.web.server.remote.get_session(sid) as session:
@@ -828,6 +834,18 @@ def put_upload_file_part(uid, fid, pid, file=None, hostname=None, path=None):
         session.put_upload_file_part(fid, pid, data)
 
 
+@cherrypy.tools.json_out(on=True)
+def get_upload(uid):
+    """
+    lists the file parts the server has received, so a client can resume an
+    interrupted upload by sending only the parts that are missing
+    :param uid: upload session ID
+    :return: received parts and whether the upload has finished
+    """
+    with slycat.web.server.upload.get_session(uid) as session:
+        return session.get_upload_status()
+
+
 @cherrypy.tools.json_in(on=True)
 @cherrypy.tools.json_out(on=True)
 def post_upload_finished(uid):
@@ -1055,9 +1073,10 @@ def put_model_arrayset_data(mid, aid, hyperchunks, data, byteorder=None):
         data = json.load(data.file)
         data_iterator = iter(data)
 
-    with slycat.web.server.hdf5.lock:
+    with slycat.web.server.hdf5.writer(model["artifact:%s" % aid]):
         with slycat.web.server.hdf5.open(model["artifact:%s" % aid], "r+") as file:
             hdf5_arrayset = slycat.hdf5.ArraySet(file)
+            modified = set()
             for array in slycat.hyperchunks.arrays(hyperchunks, hdf5_arrayset.array_count()):
                 hdf5_array = hdf5_arrayset[array.index]
                 for attribute in array.attributes(len(hdf5_array.attributes)):
@@ -1103,6 +1122,13 @@ def put_model_arrayset_data(mid, aid, hyperchunks, data, byteorder=None):
                             raise NotImplementedError()
 
                         hdf5_array.set_data(attribute.expression.index, hyperslice, hyperslice_data)
+                    modified.add((array.index, attribute.expression.index))
+
+            # Compute statistics now, while we hold the write lock, so readers never have to.
+            for array_index, attribute_index in sorted(modified):
+                hdf5_arrayset[array_index].update_statistics(attribute_index)
+
+    slycat.web.server.invalidate_arrayset_results(model["artifact:%s" % aid])
 
 
 def delete_model(mid):
@@ -1208,7 +1234,7 @@ def get_model_array_attribute_chunk(mid, aid, array, attribute, **arguments):
     if artifact_type not in ["hdf5"]:
         raise cherrypy.HTTPError("400 %s is not an array artifact." % aid)
 
-    with slycat.web.server.hdf5.lock:
+    with slycat.web.server.hdf5.reader(artifact):
         with slycat.web.server.hdf5.open(artifact) as file:
             hdf5_arrayset = slycat.hdf5.ArraySet(file)
             hdf5_array = hdf5_arrayset[array]
@@ -1273,8 +1299,21 @@ def get_model_arrayset_metadata(mid, aid, **kwargs):
         slycat.email.send_error("slycat.web.server.handlers.py get_model_arrayset_metadata",
                                 "cherrypy.HTTPError 400 not a valid hyperchunks specification.")
         raise cherrypy.HTTPError("400 Not a valid hyperchunks specification.")
+    try:
+        histograms = slycat.hyperchunks.parse(kwargs["histograms"]) if "histograms" in kwargs else None
+    except:
+        slycat.email.send_error("slycat.web.server.handlers.py get_model_arrayset_metadata",
+                                "cherrypy.HTTPError 400 not a valid hyperchunks specification.")
+        raise cherrypy.HTTPError("400 Not a valid hyperchunks specification.")
+
+    try:
+        quantiles = slycat.hyperchunks.parse(kwargs["quantiles"]) if "quantiles" in kwargs else None
+    except:
+        slycat.email.send_error("slycat.web.server.handlers.py get_model_arrayset_metadata",
+                                "cherrypy.HTTPError 400 not a valid hyperchunks specification.")
+        raise cherrypy.HTTPError("400 Not a valid hyperchunks specification.")
     cherrypy.log.error("GET arrayset metadata arrays:%s stats:%s unique:%s" % (arrays, statistics, unique))
-    results = slycat.web.server.get_model_arrayset_metadata(database, model, aid, arrays, statistics, unique)
+    results = slycat.web.server.get_model_arrayset_metadata(database, model, aid, arrays, statistics, unique, histograms, quantiles)
     cherrypy.log.error("looking for unique in results")
     if "unique" in results:
         cherrypy.log.error("found unique in results: " )
@@ -1288,11 +1327,39 @@ def get_model_arrayset_metadata(mid, aid, **kwargs):
             # Other times it's a 'numpy.ndarray'
             else:
               unique["values"] = [array.tolist() for array in unique["values"]]
+    for histogram in results.get("histograms", []):
+        for key in ["counts", "edges"]:
+            if isinstance(histogram[key], numpy.ndarray):
+                histogram[key] = histogram[key].tolist()
+    for sketch in results.get("quantiles", []):
+        for key in ["values", "counts"]:
+            if isinstance(sketch[key], numpy.ndarray):
+                sketch[key] = sketch[key].tolist()
     cherrypy.log.error("returning results")
 
     return results
 
 
+def arrayset_data_columns(database, model, aid, hyperchunks):
+    """Encode the results of an arrayset data query in :mod:`slycat.columnar` format, one column per hyperslice."""
+    artifact = model["artifact:%s" % aid]
+    names = []
+    with slycat.web.server.hdf5.reader(artifact):
+        with slycat.web.server.hdf5.open(artifact, "r") as file:
+            hdf5_arrayset = slycat.hdf5.ArraySet(file)
+            for array in slycat.hyperchunks.arrays(hyperchunks, hdf5_arrayset.array_count()):
+                attributes = hdf5_arrayset[array.index].attributes
+                for attribute in array.attributes(len(attributes)):
+                    if isinstance(attribute.expression, slycat.hyperchunks.grammar.AttributeIndex):
+                        name = attributes[attribute.expression.index]["name"]
+                    else:
+                        name = slycat.hyperchunks.tostring(attribute.expression)
+                    for hyperslice in attribute.hyperslices():
+                        names.append(name)
+    data = slycat.web.server.get_model_arrayset_data(database, model, aid, hyperchunks)
+    return slycat.columnar.encode(zip(names, data), metadata={"hyperchunks": slycat.hyperchunks.tostring(hyperchunks)})
+
+
 def get_model_arrayset_data(mid, aid, hyperchunks, byteorder=None):
     cherrypy.log.error(
         "GET Model Arrayset Data: arrayset %s hyperchunks %s byteorder %s" % (aid, hyperchunks, byteorder))
@@ -1310,7 +1377,7 @@ def get_model_arrayset_data(mid, aid, hyperchunks, byteorder=None):
             raise cherrypy.HTTPError("400 optional byteorder argument must be big or little.")
         accept = cherrypy.lib.cptools.accept(["application/octet-stream"])
     else:
-        accept = cherrypy.lib.cptools.accept(["application/json"])
+        accept = cherrypy.lib.cptools.accept(["application/json", slycat.columnar.content_type])
     cherrypy.response.headers["content-type"] = accept
 
     database = slycat.web.server.database.couchdb.connect()
@@ -1336,7 +1403,10 @@ def get_model_arrayset_data(mid, aid, hyperchunks, byteorder=None):
             return array
 
     def content():
-        if byteorder is None:
+        if accept == slycat.columnar.content_type:
+            for piece in arrayset_data_columns(database, model, aid, hyperchunks):
+                yield piece
+        elif byteorder is None:
             yield json.dumps([mask_nans(hyperslice).tolist() for hyperslice in
                               slycat.web.server.get_model_arrayset_data(database, model, aid, hyperchunks)])
         else:
@@ -1394,7 +1464,7 @@ def post_model_arrayset_data(mid, aid):
             raise cherrypy.HTTPError("400 optional byteorder argument must be big or little.")
         accept = cherrypy.lib.cptools.accept(["application/octet-stream"])
     else:
-        accept = cherrypy.lib.cptools.accept(["application/json"])
+        accept = cherrypy.lib.cptools.accept(["application/json", slycat.columnar.content_type])
     cherrypy.response.headers["content-type"] = accept
 
     database = slycat.web.server.database.couchdb.connect()
@@ -1422,7 +1492,10 @@ def post_model_arrayset_data(mid, aid):
     def content():
         if "include_nans" in cherrypy.request.json:
             include_nans = cherrypy.request.json["include_nans"]
-        if byteorder is None:
+        if accept == slycat.columnar.content_type:
+            for piece in arrayset_data_columns(database, model, aid, hyperchunks):
+                yield piece
+        elif byteorder is None:
             yield json.dumps([mask_nans(hyperslice).tolist() for hyperslice in
                               slycat.web.server.get_model_arrayset_data(database, model, aid, hyperchunks)])
         else:
@@ -1508,11 +1581,6 @@ def validate_table_sort(sort):
                                         "cherrypy.HTTPError 400 sort-order must be 'ascending' or 'descending'")
                 raise cherrypy.HTTPError("400 Sort-order must be 'ascending' or 'descending'.")
 
-        if len(sort) != 1:
-            slycat.email.send_error("slycat.web.server.handlers.py validate_table_sort",
-                                    "cherrypy.HTTPError 400 currently, only one column can be sorted.")
-            raise cherrypy.HTTPError("400 Currently, only one column can be sorted.")
-
     return sort
 
 
@@ -1529,25 +1597,84 @@ def validate_table_byteorder(byteorder):
     return byteorder
 
 
-def get_table_sort_index(file, metadata, array_index, sort, index):
-    sort_index = numpy.arange(metadata["row-count"])
-    if sort is not None:
-        sort_column, sort_order = sort[0]
-        if index is not None and sort_column == metadata["column-count"] - 1:
-            pass  # At this point, the sort index is already set from above
-        else:
-            index_key = "array/%s/index/%s" % (array_index, sort_column)
-            if index_key not in file:
-                # cherrypy.log.error("Caching array index for file %s array %s attribute %s" % (file.filename, array_index, sort_column))
-                sort_index = numpy.argsort(slycat.hdf5.ArraySet(file)[array_index].get_data(sort_column)[...],
-                                           kind="mergesort")
-                file[index_key] = sort_index
-            else:
-                # cherrypy.log.error("Loading cached sort index.")
-                sort_index = file[index_key][...]
-        if sort_order == "descending":
-            sort_index = sort_index[::-1]
-    return sort_index
+def get_table_sort(metadata, sort, index):
+    """Convert a validated table sort into a darray sort, where the optional index column sorts by row number."""
+    if sort is None:
+        return None
+    return [(None if index is not None and column == metadata["column-count"] - 1 else column, order) for column, order
+            in sort]
+
+
+_array_cache_builds = {}
+_array_cache_builds_lock = threading.Lock()
+
+
+def _build_array_cache(artifact, array_index, key, cached, compute, store):
+    """Compute derived data while holding only the reader lock, then store it unless the data changed meanwhile."""
+    try:
+        for attempt in range(3):
+            with slycat.web.server.hdf5.reader(artifact):
+                with slycat.web.server.hdf5.open(artifact, "r") as file:
+                    arrayset = slycat.hdf5.ArraySet(file)
+                    if cached(arrayset[array_index]):
+                        return
+                    version = arrayset.version
+                    result = compute(arrayset[array_index])
+            with slycat.web.server.hdf5.writer(artifact):
+                with slycat.web.server.hdf5.open(artifact, "r+") as file:
+                    arrayset = slycat.hdf5.ArraySet(file)
+                    if arrayset.version == version:
+                        store(arrayset[array_index], result)
+                        return
+    except Exception as e:
+        cherrypy.log.error("Building %s for %s array %s failed: %s" % (key, artifact, array_index, e))
+    finally:
+        with _array_cache_builds_lock:
+            del _array_cache_builds[(artifact, array_index, key)]
+
+
+def require_array_cache(artifact, array_index, key, cached, compute, store):
+    """Wait for data derived from an array and stored with it, building it in the background on first demand.
+
+    Concurrent requests for the same data share a single build, and the
+    array is only locked for writing while the finished result is stored.
+
+    Parameters
+    ----------
+    key: hashable, required.
+      Identifies the derived data within the array.
+    cached: callable, required.
+      Called with a :class:`slycat.hdf5.DArray`, returns True if the data is already stored.
+    compute: callable, required.
+      Called with a :class:`slycat.hdf5.DArray`, returns the derived data.
+    store: callable, required.
+      Called with a :class:`slycat.hdf5.DArray` and the result of `compute`.
+    """
+    with slycat.web.server.hdf5.reader(artifact):
+        with slycat.web.server.hdf5.open(artifact, "r") as file:
+            if cached(slycat.hdf5.ArraySet(file)[array_index]):
+                return
+
+    build_key = (artifact, array_index, key)
+    with _array_cache_builds_lock:
+        build = _array_cache_builds.get(build_key)
+        if build is None:
+            build = threading.Thread(name="Array cache", target=_build_array_cache,
+                                     args=(artifact, array_index, key, cached, compute, store))
+            build.daemon = True
+            _array_cache_builds[build_key] = build
+            build.start()
+    build.join()
+
+
+def require_table_sort_index(artifact, array_index, sort):
+    """Wait for the persistent sort index of a table, building it in the background on first demand."""
+    if sort is None:
+        return
+    require_array_cache(artifact, array_index, ("sort", tuple(sort)),
+                        lambda array: array.sort_index_cached(sort),
+                        lambda array: array.compute_sort_index(sort),
+                        lambda array, index: array.update_sort_index(sort, index))
 
 
 def get_table_metadata(file, array_index, index):
@@ -1601,18 +1728,19 @@ def get_model_table_metadata(mid, aid, array, index=None):
                                 "cherrypy.HTTPError 400 %s is not an array artifact." % aid)
         raise cherrypy.HTTPError("400 %s is not an array artifact." % aid)
 
-    with slycat.web.server.hdf5.lock:
-        with slycat.web.server.hdf5.open(artifact,
-                                         "r+") as file:  # We have to open the file with writing enabled because the statistics cache may need to be updated.
+    slycat.web.server.update_arrayset_statistics(artifact, [slycat.hyperchunks.parse(str(array))])
+    with slycat.web.server.hdf5.reader(artifact):
+        with slycat.web.server.hdf5.open(artifact, "r") as file:
             metadata = get_table_metadata(file, array, index)
         return metadata
 
 
-@cherrypy.tools.json_out(on=True)
 def get_model_table_chunk(mid, aid, array, rows=None, columns=None, index=None, sort=None):
     rows = validate_table_rows(rows)
     columns = validate_table_columns(columns)
     sort = validate_table_sort(sort)
+    accept = cherrypy.lib.cptools.accept(["application/json", slycat.columnar.content_type])
+    cherrypy.response.headers["content-type"] = accept
 
     database = slycat.web.server.database.couchdb.connect()
     model = database.get("model", mid)
@@ -1630,49 +1758,65 @@ def get_model_table_chunk(mid, aid, array, rows=None, columns=None, index=None,
                                 "cherrypy.HTTPError 400 %s is not an array artifact." % aid)
         raise cherrypy.HTTPError("400 %s is not an array artifact." % aid)
 
-    with slycat.web.server.hdf5.lock:
-        with slycat.web.server.hdf5.open(artifact, mode="r+") as file:
+    slycat.web.server.update_arrayset_statistics(artifact, [slycat.hyperchunks.parse(str(array))])
+    with slycat.web.server.hdf5.reader(artifact):
+        with slycat.web.server.hdf5.open(artifact, "r") as file:
             metadata = get_table_metadata(file, array, index)
 
-            # Constrain end <= count along both dimensions
-            rows = rows[rows < metadata["row-count"]]
-            if numpy.any(columns >= metadata["column-count"]):
+    # Constrain end <= count along both dimensions
+    rows = rows[rows < metadata["row-count"]]
+    if numpy.any(columns >= metadata["column-count"]):
+        slycat.email.send_error("slycat.web.server.handlers.py get_model_table_chunk",
+                                "cherrypy.HTTPError 400 column out-of-range.")
+        raise cherrypy.HTTPError("400 Column out-of-range.")
+    if sort is not None:
+        for column, order in sort:
+            if column >= metadata["column-count"]:
                 slycat.email.send_error("slycat.web.server.handlers.py get_model_table_chunk",
-                                        "cherrypy.HTTPError 400 column out-of-range.")
-                raise cherrypy.HTTPError("400 Column out-of-range.")
-            if sort is not None:
-                for column, order in sort:
-                    if column >= metadata["column-count"]:
-                        slycat.email.send_error("slycat.web.server.handlers.py get_model_table_chunk",
-                                                "400 sort column out-of-range.")
-                        raise cherrypy.HTTPError("400 Sort column out-of-range.")
+                                        "400 sort column out-of-range.")
+                raise cherrypy.HTTPError("400 Sort column out-of-range.")
+
+    table_sort = get_table_sort(metadata, sort, index)
+    require_table_sort_index(artifact, array, table_sort)
+
+    with slycat.web.server.hdf5.reader(artifact):
+        with slycat.web.server.hdf5.open(artifact, "r") as file:
+            hdf5_array = slycat.hdf5.ArraySet(file)[array]
 
             # Retrieve the data
             data = []
-            sort_index = get_table_sort_index(file, metadata, array, sort, index)
-            slice = sort_index[rows]
+            slice = rows if table_sort is None else hdf5_array.get_sort_index(table_sort, rows)
             slice_index = numpy.argsort(slice, kind="mergesort")
             slice_reverse_index = numpy.argsort(slice_index, kind="mergesort")
             for column in columns:
-                type = metadata["column-types"][column]
                 if index is not None and column == metadata["column-count"] - 1:
-                    values = slice.tolist()
+                    values = slice
                 else:
-                    values = slycat.hdf5.ArraySet(file)[array].get_data(column)[slice[slice_index].tolist()][
-                        slice_reverse_index].tolist()
-                    if type in ["float32", "float64"]:
-                        values = [None if numpy.isnan(value) else value for value in values]
+                    values = hdf5_array.get_data(column)[slice[slice_index].tolist()][slice_reverse_index]
                 data.append(values)
 
-            result = {
-                "rows": rows.tolist(),
-                "columns": columns.tolist(),
-                "column-names": [metadata["column-names"][column] for column in columns],
-                "data": data,
-                "sort": sort
-            }
-
-    return result
+    column_names = [metadata["column-names"][column] for column in columns]
+    if accept == slycat.columnar.content_type:
+        return slycat.columnar.encode(zip(column_names, data), metadata={
+            "rows": rows.tolist(),
+            "columns": columns.tolist(),
+            "sort": sort
+        })
+
+    for i, column in enumerate(columns):
+        values = data[i].tolist()
+        if metadata["column-types"][column] in ["float32", "float64"]:
+            values = [None if numpy.isnan(value) else value for value in values]
+        data[i] = values
+
+    result = {
+        "rows": rows.tolist(),
+        "columns": columns.tolist(),
+        "column-names": column_names,
+        "data": data,
+        "sort": sort
+    }
+    return json.dumps(result)
 
 
 def get_model_table_sorted_indices(mid, aid, array, rows=None, index=None, sort=None, byteorder=None):
@@ -1696,22 +1840,29 @@ def get_model_table_sorted_indices(mid, aid, array, rows=None, index=None, sort=
                                 "cherrypy.HTTPError 400 %s is not an array artifact." % aid)
         raise cherrypy.HTTPError("400 %s is not an array artifact." % aid)
 
-    with slycat.web.server.hdf5.lock:
-        with slycat.web.server.hdf5.open(artifact, mode="r+") as file:
+    slycat.web.server.update_arrayset_statistics(artifact, [slycat.hyperchunks.parse(str(array))])
+    with slycat.web.server.hdf5.reader(artifact):
+        with slycat.web.server.hdf5.open(artifact, "r") as file:
             metadata = get_table_metadata(file, array, index)
 
-            # Constrain end <= count along both dimensions
-            rows = rows[rows < metadata["row-count"]]
-            if sort is not None:
-                for column, order in sort:
-                    if column >= metadata["column-count"]:
-                        slycat.email.send_error("slycat.web.server.handlers.py get_model_table_sorted_indices",
-                                                "cherrypy.HTTPError 400 sort column out-of-range.")
-                        raise cherrypy.HTTPError("400 Sort column out-of-range.")
+    # Constrain end <= count along both dimensions
+    rows = rows[rows < metadata["row-count"]]
+    if sort is not None:
+        for column, order in sort:
+            if column >= metadata["column-count"]:
+                slycat.email.send_error("slycat.web.server.handlers.py get_model_table_sorted_indices",
+                                        "cherrypy.HTTPError 400 sort column out-of-range.")
+                raise cherrypy.HTTPError("400 Sort column out-of-range.")
 
+    table_sort = get_table_sort(metadata, sort, index)
+    require_table_sort_index(artifact, array, table_sort)
+
+    with slycat.web.server.hdf5.reader(artifact):
+        with slycat.web.server.hdf5.open(artifact, "r") as file:
             # Retrieve the data ...
-            sort_index = get_table_sort_index(file, metadata, array, sort, index)
-            slice = numpy.argsort(sort_index, kind="mergesort")[rows].astype("int32")
+            hdf5_array = slycat.hdf5.ArraySet(file)[array]
+            slice = rows if table_sort is None else hdf5_array.get_sort_ranks(table_sort, rows)
+            slice = slice.astype("int32")
 
         if byteorder is None:
             return json.dumps(slice.tolist())
@@ -1743,22 +1894,29 @@ def get_model_table_unsorted_indices(mid, aid, array, rows=None, index=None, sor
                                 "cherrypy.HTTPError 400 %s is not an array artifact." % aid)
         raise cherrypy.HTTPError("400 %s is not an array artifact." % aid)
 
-    with slycat.web.server.hdf5.lock:
-        with slycat.web.server.hdf5.open(artifact, mode="r+") as file:
+    slycat.web.server.update_arrayset_statistics(artifact, [slycat.hyperchunks.parse(str(array))])
+    with slycat.web.server.hdf5.reader(artifact):
+        with slycat.web.server.hdf5.open(artifact, "r") as file:
             metadata = get_table_metadata(file, array, index)
 
-            # Constrain end <= count along both dimensions
-            rows = rows[rows < metadata["row-count"]]
-            if sort is not None:
-                for column, order in sort:
-                    if column >= metadata["column-count"]:
-                        slycat.email.send_error("slycat.web.server.handlers.py get_model_table_unsorted_indices",
-                                                "cherrypy.HTTPError 400 sort column out-of-range.")
-                        raise cherrypy.HTTPError("400 Sort column out-of-range.")
+    # Constrain end <= count along both dimensions
+    rows = rows[rows < metadata["row-count"]]
+    if sort is not None:
+        for column, order in sort:
+            if column >= metadata["column-count"]:
+                slycat.email.send_error("slycat.web.server.handlers.py get_model_table_unsorted_indices",
+                                        "cherrypy.HTTPError 400 sort column out-of-range.")
+                raise cherrypy.HTTPError("400 Sort column out-of-range.")
 
+    table_sort = get_table_sort(metadata, sort, index)
+    require_table_sort_index(artifact, array, table_sort)
+
+    with slycat.web.server.hdf5.reader(artifact):
+        with slycat.web.server.hdf5.open(artifact, "r") as file:
             # Generate a database query
-            sort_index = get_table_sort_index(file, metadata, array, sort, index)
-            slice = sort_index[rows].astype("int32")
+            hdf5_array = slycat.hdf5.ArraySet(file)[array]
+            slice = rows if table_sort is None else hdf5_array.get_sort_index(table_sort, rows)
+            slice = slice.astype("int32")
 
         if byteorder is None:
             return json.dumps(slice.tolist())
@@ -1769,6 +1927,191 @@ def get_model_table_unsorted_indices(mid, aid, array, rows=None, index=None, sor
                 return slice.tostring(order="C")
 
 
+def _read_rows(hdf5_array, attribute, rows):
+    """Read the values of an attribute for arbitrary row numbers."""
+    if not len(rows):
+        return numpy.empty(0, dtype=hdf5_array.get_data(attribute).dtype)
+    order = numpy.argsort(rows, kind="mergesort")
+    values = hdf5_array.get_data(attribute)[rows[order].tolist()]
+    result = numpy.empty_like(values)
+    result[order] = values
+    return result
+
+
+def downsample_table(hdf5_array, x, y, width, height, viewport=None, filters=None, selection=None):
+    """Return one representative point for every non-empty bin of a scatterplot viewport.
+
+    Unfiltered requests are answered from the precomputed level-of-detail
+    tiles, which must already be stored; otherwise the points that pass the
+    filters are binned on the fly.  Bins containing selected rows are
+    represented by their lowest selected row, so selections stay visible.
+    """
+    extent = hdf5_array.get_tile_extent(x, y)
+    if viewport is None:
+        viewport = extent
+    level = slycat.lod.choose_level(extent, viewport, width, height)
+
+    if not filters:
+        mask = None
+        tiles = hdf5_array.get_tiles(x, y, level, viewport)
+        ids, counts, rows, xs, ys = tiles["ids"], tiles["counts"], tiles["rows"], tiles["x"], tiles["y"]
+    else:
+        mask = numpy.ones(hdf5_array.shape[0], dtype="bool")
+        for condition in filters:
+            values = hdf5_array.get_data(condition["attribute"])[...]
+            if "values" in condition:
+                mask &= numpy.in1d(values, condition["values"])
+            else:
+                if condition.get("min") is not None:
+                    mask &= values >= condition["min"]
+                if condition.get("max") is not None:
+                    mask &= values <= condition["max"]
+        all_xs = hdf5_array.get_data(x)[...]
+        all_ys = hdf5_array.get_data(y)[...]
+        mask &= (all_xs >= viewport[0]) & (all_xs <= viewport[1]) & (all_ys >= viewport[2]) & (all_ys <= viewport[3])
+        candidates = numpy.flatnonzero(mask)
+        ids, counts, rows = slycat.lod.bins(all_xs[candidates], all_ys[candidates], extent, level, candidates)
+        xs, ys = all_xs[rows], all_ys[rows]
+
+    selected = numpy.zeros(len(rows), dtype="bool")
+    if selection is not None and len(selection):
+        selection = numpy.unique(numpy.asarray(selection, dtype="int64"))
+        selection = selection[(selection >= 0) & (selection < hdf5_array.shape[0])]
+        if mask is not None:
+            selection = selection[mask[selection]]
+        selection_xs = _read_rows(hdf5_array, x, selection)
+        selection_ys = _read_rows(hdf5_array, y, selection)
+        ok = (selection_xs >= viewport[0]) & (selection_xs <= viewport[1]) & (selection_ys >= viewport[2]) & (selection_ys <= viewport[3])
+        selection, selection_xs, selection_ys = selection[ok], selection_xs[ok], selection_ys[ok]
+        selection_ids, selection_counts, selection_rows = slycat.lod.aggregate(
+            (slycat.lod.quantize(selection_xs, extent[0], extent[1], level) << level) | slycat.lod.quantize(selection_ys, extent[2], extent[3], level),
+            selection)
+        positions = numpy.searchsorted(ids, selection_ids)
+        found = positions < len(ids)
+        found[found] = ids[positions[found]] == selection_ids[found]
+        positions, selection_rows = positions[found], selection_rows[found]
+        lookup = numpy.searchsorted(selection, selection_rows)
+        rows = rows.copy()
+        xs = xs.copy()
+        ys = ys.copy()
+        rows[positions] = selection_rows
+        xs[positions] = selection_xs[lookup]
+        ys[positions] = selection_ys[lookup]
+        selected[positions] = True
+
+    return {"level": level, "extent": extent, "viewport": list(viewport), "rows": rows, "x": xs, "y": ys,
+            "counts": counts, "selected": selected}
+
+
+@cherrypy.tools.json_in(on=True)
+def post_model_arrayset_downsample(mid, aid, array):
+    """
+  return a density-preserving sample of a scatterplot, one point per occupied bin of the viewport
+
+  :param mid: model id
+  :param aid: artifact id
+  :param array: array index
+  :return: json or slycat.columnar encoded points
+  """
+    try:
+        array = int(array)
+        x = int(require_json_parameter("x"))
+        y = int(require_json_parameter("y"))
+        width = int(require_json_parameter("width"))
+        height = int(require_json_parameter("height"))
+        viewport = cherrypy.request.json.get("viewport", None)
+        if viewport is not None:
+            viewport = [float(value) for value in viewport]
+            if len(viewport) != 4:
+                raise ValueError("viewport must contain xmin, xmax, ymin, ymax.")
+        filters = cherrypy.request.json.get("filters", None) or []
+        for condition in filters:
+            condition["attribute"] = int(condition["attribute"])
+        selection = cherrypy.request.json.get("selection", None)
+        columns = [int(column) for column in cherrypy.request.json.get("columns", [])]
+    except cherrypy.HTTPError:
+        raise
+    except Exception as e:
+        slycat.email.send_error("slycat.web.server.handlers.py post_model_arrayset_downsample",
+                                "cherrypy.HTTPError 400 malformed downsample request: %s" % e)
+        raise cherrypy.HTTPError("400 Malformed downsample request: %s" % e)
+    if width < 1 or height < 1:
+        slycat.email.send_error("slycat.web.server.handlers.py post_model_arrayset_downsample",
+                                "cherrypy.HTTPError 400 width and height must be positive.")
+        raise cherrypy.HTTPError("400 Width and height must be positive.")
+    accept = cherrypy.lib.cptools.accept(["application/json", slycat.columnar.content_type])
+    cherrypy.response.headers["content-type"] = accept
+
+    database = slycat.web.server.database.couchdb.connect()
+    model = database.get("model", mid)
+    project = database.get("project", model["project"])
+    slycat.web.server.authentication.require_project_reader(project)
+
+    artifact = model.get("artifact:%s" % aid, None)
+    if artifact is None:
+        slycat.email.send_error("slycat.web.server.handlers.py post_model_arrayset_downsample",
+                                "cherrypy.HTTPError 404 artifact is None for aid: %s" % aid)
+        raise cherrypy.HTTPError(404)
+    artifact_type = model["artifact-types"][aid]
+    if artifact_type not in ["hdf5"]:
+        slycat.email.send_error("slycat.web.server.handlers.py post_model_arrayset_downsample",
+                                "cherrypy.HTTPError 400 %s is not an array artifact." % aid)
+        raise cherrypy.HTTPError("400 %s is not an array artifact." % aid)
+
+    with slycat.web.server.hdf5.reader(artifact):
+        with slycat.web.server.hdf5.open(artifact, "r") as file:
+            hdf5_array = slycat.hdf5.ArraySet(file)[array]
+            ndim = hdf5_array.ndim
+            attributes = hdf5_array.attributes
+    if ndim != 1:
+        slycat.email.send_error("slycat.web.server.handlers.py post_model_arrayset_downsample",
+                                "cherrypy.HTTPError 400 not a table (1D array) artifact.")
+        raise cherrypy.HTTPError("400 Not a table (1D array) artifact.")
+    for attribute in [x, y] + [condition["attribute"] for condition in filters] + columns:
+        if attribute < 0 or attribute >= len(attributes):
+            slycat.email.send_error("slycat.web.server.handlers.py post_model_arrayset_downsample",
+                                    "cherrypy.HTTPError 400 attribute out-of-range.")
+            raise cherrypy.HTTPError("400 Attribute out-of-range.")
+    for attribute in [x, y]:
+        if attributes[attribute]["type"] == "string":
+            slycat.email.send_error("slycat.web.server.handlers.py post_model_arrayset_downsample",
+                                    "cherrypy.HTTPError 400 x and y must be numeric attributes.")
+            raise cherrypy.HTTPError("400 x and y must be numeric attributes.")
+
+    require_array_cache(artifact, array, ("lod", x, y),
+                        lambda array: array.tiles_cached(x, y),
+                        lambda array: array.compute_tiles(x, y),
+                        lambda array, tiles: array.update_tiles(x, y, tiles))
+
+    with slycat.web.server.hdf5.reader(artifact):
+        with slycat.web.server.hdf5.open(artifact, "r") as file:
+            hdf5_array = slycat.hdf5.ArraySet(file)[array]
+            sample = downsample_table(hdf5_array, x, y, width, height, viewport, filters, selection)
+            data = [_read_rows(hdf5_array, column, sample["rows"]) for column in columns]
+
+    column_names = [attributes[column]["name"] for column in columns]
+    if accept == slycat.columnar.content_type:
+        return slycat.columnar.encode(
+            [(name, sample[name]) for name in ["rows", "x", "y", "counts", "selected"]] + zip(column_names, data),
+            metadata={"level": sample["level"], "extent": sample["extent"], "viewport": sample["viewport"],
+                      "columns": columns})
+
+    def tolist(values):
+        values = values.tolist()
+        return [None if isinstance(value, float) and numpy.isnan(value) else value for value in values]
+
+    result = dict([(name, tolist(sample[name])) for name in ["rows", "x", "y", "counts", "selected"]])
+    result.update({
+        "level": sample["level"],
+        "extent": sample["extent"],
+        "viewport": sample["viewport"],
+        "columns": columns,
+        "column-names": column_names,
+        "data": [tolist(values) for values in data]
+    })
+    return json.dumps(result)
+
+
 def get_model_file(mid, aid):
     database = slycat.web.server.database.couchdb.connect()
     model = database.get("model", mid)
@@ -2131,8 +2474,14 @@ def post_remote_browse(hostname, path):
     directory_allow = re.compile(
         cherrypy.request.json.get("directory-allow")) if "directory-allow" in cherrypy.request.json else None
 
+    sort = cherrypy.request.json.get("sort", None)
+    reverse = cherrypy.request.json.get("reverse", False)
+    limit = cherrypy.request.json.get("limit", None)
+    token = cherrypy.request.json.get("token", None)
+
     with slycat.web.server.remote.get_session(sid) as session:
-        return session.browse(path, file_reject, file_allow, directory_reject, directory_allow)
+        return session.browse(path, file_reject, file_allow, directory_reject, directory_allow, sort=sort,
+                              reverse=reverse, limit=limit, token=token)
 
 
 def get_remote_file(hostname, path, **kwargs):
@@ -2146,7 +2495,10 @@ def get_remote_file(hostname, path, **kwargs):
     """
     sid = get_sid(hostname)
     with slycat.web.server.remote.get_session(sid) as session:
-        return session.get_file(path, **kwargs)
+        return session.serve_file(path, **kwargs)
+
+
+get_remote_file._cp_config = {"response.stream": True}
 
 
 def get_remote_image(hostname, path, **kwargs):
@@ -2237,6 +2589,9 @@ def get_remote_video(hostname, vsid):
         return session.get_video(vsid)
 
 
+get_remote_video._cp_config = {"response.stream": True}
+
+
 def post_events(event):
     # We don't actually have to do anything here, since the request is already logged.
     cherrypy.response.status = "204 Event logged."
@@ -3,11 +3,15 @@
 # rights in this software.
 
 import cherrypy
+import collections
+import contextlib
 import h5py
 import os
 import slycat.hdf5
 import threading
+import time
 import types
+import weakref
 
 def path(array):
   """Convert an array identifier to a data store filesystem path."""
@@ -24,17 +28,148 @@ def create(array):
   return h5py.File(array_path, mode="w")
 
 def open(array, mode="r"):
-  """Open an array from the data store for reading."""
-  array_path = path(array)
-  cherrypy.log.error("Opening file {}".format(array_path))
-  return h5py.File(array_path, mode=mode)
+  """Open an array from the data store.
+
+  The file comes from a shared pool of open handles, so the result must be
+  used as a context manager - the handle is returned to the pool, not closed,
+  when the block exits.  Callers must hold :func:`reader` or :func:`writer`
+  for the array, as appropriate for `mode`.
+  """
+  return pool().acquire(array, mode)
 
 def delete(array):
   """Remove an array from the data store."""
   array_path = path(array)
-  if os.path.exists(array_path):
-    cherrypy.log.error("Deleting file {}".format(array_path))
-    os.remove(array_path)
+  with writer(array):
+    pool().invalidate(array)
+    if os.path.exists(array_path):
+      cherrypy.log.error("Deleting file {}".format(array_path))
+      os.remove(array_path)
+
+class HandlePool(object):
+  """Bounded pool of open array files, shared by every request for the same array.
+
+  Handles are opened read-only, and only reopened for writing when a writer
+  asks for one.  Least-recently-used handles are closed once the pool is full,
+  and handles that haven't been used for `idle_timeout` seconds are closed the
+  next time the pool is touched.  A handle that is in use is never closed out
+  from under its users; it is dropped from the pool and closed on release.
+  """
+  class Entry(object):
+    def __init__(self, array, file, writable):
+      self.array = array
+      self.file = file
+      self.writable = writable
+      self.users = 0
+      self.last_used = time.time()
+      self.evicted = False
+
+  class Handle(object):
+    def __init__(self, pool, entry):
+      self._pool = pool
+      self._entry = entry
+    def __enter__(self):
+      return self._entry.file
+    def __exit__(self, exc_type, exc_value, traceback):
+      self._pool.release(self._entry)
+
+  def __init__(self, size=64, idle_timeout=300):
+    self._lock = threading.Lock()
+    self._entries = collections.OrderedDict()
+    self._size = size
+    self._idle_timeout = idle_timeout
+
+  def acquire(self, array, mode="r"):
+    writable = mode != "r"
+    with self._lock:
+      self._evict_idle()
+      entry = self._entries.get(array, None)
+      if entry is not None and entry.writable < writable:
+        # A writer arrived - the per-array writer lock guarantees nobody else is using the read-only handle.
+        self._discard(entry)
+        entry = None
+      if entry is not None:
+        del self._entries[array]
+        self._entries[array] = entry
+        entry.users += 1
+        return HandlePool.Handle(self, entry)
+
+    # Open the file outside the pool lock so a slow open doesn't stall every other array.
+    array_path = path(array)
+    cherrypy.log.error("Opening file {}".format(array_path))
+    file = h5py.File(array_path, mode="r+" if writable else "r")
+
+    with self._lock:
+      entry = self._entries.get(array, None)
+      if entry is not None and entry.writable >= writable:
+        # Another reader opened the same file while we were busy.
+        file.close()
+      else:
+        if entry is not None:
+          self._discard(entry)
+        entry = HandlePool.Entry(array, file, writable)
+        self._entries[array] = entry
+        self._evict_lru()
+      entry.users += 1
+      return HandlePool.Handle(self, entry)
+
+  def release(self, entry):
+    with self._lock:
+      entry.users -= 1
+      entry.last_used = time.time()
+      if entry.users == 0:
+        if entry.evicted:
+          self._close(entry)
+        elif entry.writable:
+          entry.file.flush()
+
+  def invalidate(self, array):
+    """Drop any pooled handle for an array, e.g. because the underlying file is being removed."""
+    with self._lock:
+      entry = self._entries.get(array, None)
+      if entry is not None:
+        self._discard(entry)
+
+  def clear(self):
+    """Close every handle that isn't in use."""
+    with self._lock:
+      for entry in self._entries.values():
+        self._discard(entry)
+
+  def _discard(self, entry):
+    del self._entries[entry.array]
+    entry.evicted = True
+    if entry.users == 0:
+      self._close(entry)
+
+  def _close(self, entry):
+    try:
+      entry.file.close()
+    except Exception as e:
+      cherrypy.log.error("Error closing file for array %s: %s" % (entry.array, e))
+
+  def _evict_lru(self):
+    for entry in list(self._entries.values()):
+      if len(self._entries) <= self._size:
+        break
+      if entry.users == 0:
+        self._discard(entry)
+
+  def _evict_idle(self):
+    cutoff = time.time() - self._idle_timeout
+    for entry in list(self._entries.values()):
+      if entry.users == 0 and entry.last_used < cutoff:
+        self._discard(entry)
+
+def pool():
+  """Return the process-wide :class:`HandlePool`, configured from the server's hdf5-handle-pool setting."""
+  with pool.lock:
+    if pool.instance is None:
+      config = cherrypy.tree.apps[""].config["slycat-web-server"].get("hdf5-handle-pool", {})
+      pool.instance = HandlePool(size=config.get("size", 64), idle_timeout=config.get("idle-timeout", 300))
+    return pool.instance
+pool.lock = threading.Lock()
+pool.instance = None
 
 class null_lock(object):
   """Do-nothing replacement for a thread lock, useful for debugging threading problems with h5py."""
@@ -43,5 +178,120 @@ class null_lock(object):
   def __exit__(self, exc_type, exc_value, traceback):
     pass
 
-#lock = null_lock()
-lock = threading.RLock()
+class ReadWriteLock(object):
+  """Lock that admits many concurrent readers, or a single exclusive writer.
+
+  Writers are given preference over new readers so a steady stream of reads
+  can't starve an ingest.  Both sides are reentrant for the owning thread,
+  and a thread holding the write lock may also take the read lock.  Upgrading
+  a read lock to a write lock isn't supported, since two upgrading readers
+  would deadlock.
+  """
+  def __init__(self):
+    self._condition = threading.Condition(threading.Lock())
+    self._readers = {}
+    self._writer = None
+    self._writer_depth = 0
+    self._waiting_writers = 0
+
+  def acquire_read(self):
+    me = threading.current_thread().ident
+    with self._condition:
+      if self._writer == me or me in self._readers:
+        self._readers[me] = self._readers.get(me, 0) + 1
+        return
+      while self._writer is not None or self._waiting_writers:
+        self._condition.wait()
+      self._readers[me] = 1
+
+  def release_read(self):
+    me = threading.current_thread().ident
+    with self._condition:
+      count = self._readers.get(me, 0)
+      if count == 0:
+        raise RuntimeError("Cannot release a read lock that isn't held.")
+      if count == 1:
+        del self._readers[me]
+        if not self._readers:
+          self._condition.notify_all()
+      else:
+        self._readers[me] = count - 1
+
+  def acquire_write(self):
+    me = threading.current_thread().ident
+    with self._condition:
+      if self._writer == me:
+        self._writer_depth += 1
+        return
+      if me in self._readers:
+        raise RuntimeError("Cannot upgrade a read lock to a write lock.")
+      self._waiting_writers += 1
+      try:
+        while self._writer is not None or self._readers:
+          self._condition.wait()
+      finally:
+        self._waiting_writers -= 1
+      self._writer = me
+      self._writer_depth = 1
+
+  def release_write(self):
+    me = threading.current_thread().ident
+    with self._condition:
+      if self._writer != me:
+        raise RuntimeError("Cannot release a write lock that isn't held.")
+      self._writer_depth -= 1
+      if self._writer_depth == 0:
+        self._writer = None
+        self._condition.notify_all()
+
+  @contextlib.contextmanager
+  def reader(self):
+    self.acquire_read()
+    try:
+      yield self
+    finally:
+      self.release_read()
+
+  @contextlib.contextmanager
+  def writer(self):
+    self.acquire_write()
+    try:
+      yield self
+    finally:
+      self.release_write()
+
+class LockManager(object):
+  """Hands out one :class:`ReadWriteLock` per array file.
+
+  Locks are created on demand and only live as long as somebody holds them,
+  so the manager doesn't accumulate an entry for every array ever touched.
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._locks = weakref.WeakValueDictionary()
+
+  def get(self, array):
+    with self._lock:
+      result = self._locks.get(array)
+      if result is None:
+        result = ReadWriteLock()
+        self._locks[array] = result
+      return result
+
+  def reader(self, array):
+    """Return a context manager holding a shared lock on an array file."""
+    return self.get(array).reader()
+
+  def writer(self, array):
+    """Return a context manager holding an exclusive lock on an array file."""
+    return self.get(array).writer()
+
+locks = LockManager()
+
+def reader(array):
+  """Lock an array for reading - any number of readers may hold the lock at once."""
+  return locks.reader(array)
+
+def writer(array):
+  """Lock an array for writing - excludes every other reader and writer of the same array."""
+  return locks.writer(array)
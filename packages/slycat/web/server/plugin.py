@@ -260,7 +260,7 @@ class Manager(object):
     self.pages[type] = {"html": html}
     cherrypy.log.error("Registered page '%s'." % type)
 
-  def register_parser(self, type, label, categories, parse):
+  def register_parser(self, type, label, categories, parse, streaming=False):
     """Register a new parser type.
 
     Parameters
@@ -276,11 +276,15 @@ class Manager(object):
       artifact names, and optional keyword arguments.  Must parse the file and
       insert its data into the model as artifacts, returning True if
       successful, otherwise False.
+    streaming: boolean, optional
+      If True, the parser is passed open, binary file-like objects instead of
+      strings containing the file contents, so large files needn't be read
+      into memory all at once.
     """
     if type in self.parsers:
       slycat.email.send_error("slycat.web.server.plugin.py register_parser", "Parser type '%s' has already been regiitered.")
       raise Exception("Parser type '%s' has already been registered." % type)
-    self.parsers[type] = {"label": label, "categories": categories, "parse": parse}
+    self.parsers[type] = {"label": label, "categories": categories, "parse": parse, "streaming": streaming}
     cherrypy.log.error("Registered parser '%s'." % type)
 
   def register_password_check(self, type, check):
@@ -16,7 +16,8 @@ functionality is used in a variety of ways:
 * Web clients can retrieve video compressed from still images on a remote host.
 
 When a remote session is created, a connection to the remote host over ssh is
-created, an agent is started (only if the required configuration is present),
+created (or an existing connection for the same user and host is reused, see
+:func:`create_session`), an agent is started (only if the required configuration is present),
 and a unique session identifier is returned.  Callers use the session id to
 retrieve the cached session and communicate with the remote host / agent.  A
 "last access" time for each session is maintained and updated whenever the
@@ -29,19 +30,26 @@ the same client IP address is allowed to access the session.
 """
 
 import datetime
+import hashlib
+import itertools
 import json
 import os
+import StringIO
 import stat
 import sys
 import threading
 import time
 import uuid
+import zlib
 import cherrypy
+import cherrypy.lib.cptools
+import cherrypy.lib.httputil
 import paramiko
 
 import slycat.email
 import slycat.mime_type
 import slycat.web.server.authentication
+from slycat.web.server.cache import ResultCache
 import slycat.web.server.database
 import slycat.web.server.streaming
 import slycat.web.server
@@ -70,6 +78,177 @@ def cache_object(pid, key, content_type, content):
     database.put_attachment(cache_object, filename="content", content_type=content_type, content=content)
 
 
+class _SessionFile(object):
+    """Seekable, read-only view of remote content, read a piece at a time.
+
+    Each read holds the session only while that piece is transferred, so a
+    streamed response never interleaves with other commands sent over the same
+    session, and never holds the session for the whole transfer.
+    """
+
+    def __init__(self, session, read):
+        self._session = session
+        self._read = read
+        self._offset = 0
+
+    def seek(self, offset):
+        self._offset = offset
+
+    def read(self, size):
+        with self._session:
+            data = self._read(self._offset, size)
+        self._offset += len(data)
+        return data
+
+
+class _AgentChannel(object):
+    """Sends commands to an agent one at a time, waiting for each response before sending the next.
+
+    Used with agents that don't support multiplexing.
+    """
+
+    concurrent = False
+
+    def __init__(self, stdin, stdout, stderr):
+        self._stdin = stdin
+        self._stdout = stdout
+        self._stderr = stderr
+        self._lock = threading.Lock()
+
+    def request(self, command, content=False):
+        """Send a command, returning the agent's response.
+
+        If `content` is true, also returns the content that followed the response.
+        """
+        with self._lock:
+            self._stdin.write("%s\n" % json.dumps(command))
+            self._stdin.flush()
+            response = json.loads(self._stdout.readline())
+            data = self._stdout.read(response["size"]) if response.get("ok") and "size" in response else ""
+        return (response, data) if content else response
+
+    def close(self):
+        with self._lock:
+            self._stdin.write("%s\n" % json.dumps({"action": "exit"}))
+            self._stdin.flush()
+            # The ssh connection outlives the session, so release the agent's channel explicitly.
+            channel = getattr(self._stdin, "channel", None)
+            if channel is not None:
+                channel.close()
+
+
+class _MultiplexedAgentChannel(_AgentChannel):
+    """Sends commands to an agent without waiting for earlier commands to finish.
+
+    Each command is tagged with an id, and the agent frames each response
+    with a line containing the id and size of the response, so responses can
+    arrive in any order.  A background thread reads them, and wakes whichever
+    thread sent the matching command.
+    """
+
+    concurrent = True
+
+    def __init__(self, stdin, stdout, stderr):
+        super(_MultiplexedAgentChannel, self).__init__(stdin, stdout, stderr)
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pending = {}
+        self._error = None
+        self._receiver = threading.Thread(name="Agent Receiver", target=self._receive)
+        self._receiver.daemon = True
+        self._receiver.start()
+
+    def _receive(self):
+        try:
+            while True:
+                header = self._stdout.readline()
+                if not header:
+                    raise EOFError("Agent closed the connection.")
+                header = json.loads(header)
+                payload = self._stdout.read(header["size"])
+                with self._pending_lock:
+                    response = self._pending.pop(header["id"], None)
+                if response is not None:
+                    response["payload"] = payload
+                    response["ready"].set()
+        except Exception as e:
+            with self._pending_lock:
+                self._error = str(e) or type(e).__name__
+                pending, self._pending = self._pending, {}
+            for response in pending.values():
+                response["ready"].set()
+
+    def request(self, command, content=False):
+        response = {"ready": threading.Event(), "payload": None}
+        with self._pending_lock:
+            if self._error is not None:
+                raise IOError("Agent connection failed: %s" % self._error)
+            rid = next(self._ids)
+            self._pending[rid] = response
+        with self._lock:
+            self._stdin.write("%s\n" % json.dumps(dict(command, id=rid)))
+            self._stdin.flush()
+
+        response["ready"].wait()
+        if response["payload"] is None:
+            raise IOError("Agent connection failed: %s" % self._error)
+        metadata, separator, data = response["payload"].partition("\n")
+        metadata = json.loads(metadata)
+        return (metadata, data) if content else metadata
+
+
+def _decode_chunks(offset, data):
+    """Return the content of a chunked agent response, verifying each chunk against its checksum.
+
+    `data` contains a sequence of chunks, each preceded by a line describing
+    its offset, size, encoding, and the CRC-32 checksum of its decoded content.
+    """
+    chunks = []
+    position = 0
+    while position < len(data):
+        end = data.index("\n", position)
+        header = json.loads(data[position:end])
+        chunk = data[end + 1:end + 1 + header["size"]]
+        position = end + 1 + header["size"]
+        if len(chunk) != header["size"] or header["offset"] != offset:
+            raise IOError("Agent sent an incomplete chunk at offset %s." % offset)
+        if header["encoding"] == "zlib":
+            chunk = zlib.decompress(chunk)
+        elif header["encoding"] != "identity":
+            raise IOError("Agent sent a chunk with unknown encoding: %s." % header["encoding"])
+        if zlib.crc32(chunk) & 0xffffffff != header["crc32"]:
+            raise IOError("Agent sent a corrupted chunk at offset %s." % offset)
+        chunks.append(chunk)
+        offset += len(chunk)
+    return "".join(chunks)
+
+
+def _agent_channel(stdin, stdout, stderr):
+    """Return a channel for a newly-started agent, multiplexing commands if the agent supports it."""
+    stdin.write("%s\n" % json.dumps({"action": "multiplex"}))
+    stdin.flush()
+    # Agents that predate multiplexing report an unknown command.
+    response = json.loads(stdout.readline())
+    if response.get("ok") and response.get("protocol") == 2:
+        return _MultiplexedAgentChannel(stdin, stdout, stderr)
+    return _AgentChannel(stdin, stdout, stderr)
+
+
+#: Size of the checksummed chunks that agents send file contents in.
+agent_chunk_size = 256 * 1024
+#: Compression applied by agents to each chunk, or None.
+agent_compression = "zlib"
+#: Largest byte range requested from an agent in a single chunked command.
+agent_range_length = 16 * 1024 * 1024
+
+#: Images recently retrieved through agents, revalidated with the agent before each use.
+thumbnail_cache = ResultCache(None, max_bytes=64 * 1024 * 1024)
+
+#: Recent directory listings, revalidated against the directory's modification time before each use.
+listing_cache = ResultCache(None, max_bytes=64 * 1024 * 1024)
+#: Seconds that a cached directory listing may be used.
+listing_cache_lifetime = 30
+
 session_cache = {}
 session_cache_lock = threading.Lock()
 
@@ -87,6 +266,10 @@ class Session(object):
   >>> with slycat.web.server.remote.get_session(sid) as session:
   ...   print session.username
 
+  When the remote agent multiplexes commands, agent requests from several
+  threads proceed concurrently, and a thread only takes exclusive access to the
+  session once it uses :attr:`sftp`, until it leaves its `with statement`.
+
   """
 
     def __init__(self, client, username, hostname, ssh, sftp, agent=None):
@@ -99,14 +282,27 @@ class Session(object):
         self._agent = agent
         self._created = now
         self._accessed = now
-        self._lock = threading.Lock()
+        # Reentrant, so content streamed by a handler can also be read while the handler holds the session.
+        self._lock = threading.RLock()
+        self._local = threading.local()
 
     def __enter__(self):
-        self._lock.__enter__()
+        self._local.depth = getattr(self._local, "depth", 0) + 1
+        if self._agent is None or not self._agent.concurrent:
+            self._acquire()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        return self._lock.__exit__(exc_type, exc_value, traceback)
+        self._local.depth -= 1
+        if self._local.depth == 0 and getattr(self._local, "locked", False):
+            self._local.locked = False
+            self._lock.release()
+
+    def _acquire(self):
+        """Take exclusive access to the session until the calling thread leaves its outermost `with statement`."""
+        if getattr(self._local, "depth", 0) and not getattr(self._local, "locked", False):
+            self._lock.acquire()
+            self._local.locked = True
 
     @property
     def client(self):
@@ -125,6 +321,8 @@ class Session(object):
 
     @property
     def sftp(self):
+        # SFTP requests can't be interleaved, even when agent requests can.
+        self._acquire()
         return self._sftp
 
     @property
@@ -136,13 +334,10 @@ class Session(object):
         if self._agent is not None:
             cherrypy.log.error(
                 "Instructing remote agent for %s@%s from %s to shutdown." % (self.username, self.hostname, self.client))
-            stdin, stdout, stderr = self._agent
-            command = {"action": "exit"}
-            stdin.write("%s\n" % json.dumps(command))
-            stdin.flush()
+            self._agent.close()
 
         self._sftp.close()
-        self._ssh.close()
+        _release_connection(self._ssh)
 
     def submit_batch(self, filename):
         """
@@ -159,13 +354,8 @@ class Session(object):
           A dictionary with the following keys: filename, jid, errors
         """
         if self._agent is not None:
-            stdin, stdout, stderr = self._agent
             payload = {"action": "submit-batch", "command": filename}
-
-            stdin.write("%s\n" % json.dumps(payload))
-            stdin.flush()
-
-            response = json.loads(stdout.readline())
+            response = self._agent.request(payload)
             if not response["ok"]:
                 cherrypy.response.headers["x-slycat-message"] = response["message"]
                 slycat.email.send_error("slycat.web.server.remote.py submit_batch",
@@ -197,13 +387,8 @@ class Session(object):
           A dictionary with the following keys: jid, status, errors
         """
         if self._agent is not None:
-            stdin, stdout, stderr = self._agent
             payload = {"action": "checkjob", "command": jid}
-
-            stdin.write("%s\n" % json.dumps(payload))
-            stdin.flush()
-
-            response = json.loads(stdout.readline())
+            response = self._agent.request(payload)
             if not response["ok"]:
                 cherrypy.response.headers["x-slycat-message"] = response["message"]
                 slycat.email.send_error("slycat.web.server.remote.py checkjob",
@@ -248,13 +433,8 @@ class Session(object):
           A dictionary with the following keys: jid, output, errors
         """
         if self._agent is not None:
-            stdin, stdout, stderr = self._agent
             payload = {"action": "cancel-job", "command": jid}
-
-            stdin.write("%s\n" % json.dumps(payload))
-            stdin.flush()
-
-            response = json.loads(stdout.readline())
+            response = self._agent.request(payload)
             if not response["ok"]:
                 cherrypy.response.headers["x-slycat-message"] = response["message"]
                 slycat.email.send_error("slycat.web.server.remote.py cancel_job",
@@ -285,13 +465,8 @@ class Session(object):
           A dictionary with the following keys: jid, output, errors
         """
         if self._agent is not None:
-            stdin, stdout, stderr = self._agent
             payload = {"action": "get-job-output", "command": {"jid": jid, "path": path}}
-
-            stdin.write("%s\n" % json.dumps(payload))
-            stdin.flush()
-
-            response = json.loads(stdout.readline())
+            response = self._agent.request(payload)
             if not response["ok"]:
                 cherrypy.response.headers["x-slycat-message"] = response["message"]
                 slycat.email.send_error("slycat.web.server.remote.py get_job_output",
@@ -314,13 +489,8 @@ class Session(object):
           A dictionary with the configuration values
         """
         if self._agent is not None:
-            stdin, stdout, stderr = self._agent
             payload = {"action": "get-user-config"}
-
-            stdin.write("%s\n" % json.dumps(payload))
-            stdin.flush()
-
-            response = json.loads(stdout.readline())
+            response = self._agent.request(payload)
             if not response["ok"]:
                 cherrypy.response.headers["x-slycat-message"] = response["message"]
                 slycat.email.send_error("slycat.web.server.remote.py get_user_config",
@@ -342,13 +512,8 @@ class Session(object):
         response : dict
         """
         if self._agent is not None:
-            stdin, stdout, stderr = self._agent
             payload = {"action": "set-user-config", "command": {"config": config}}
-
-            stdin.write("%s\n" % json.dumps(payload))
-            stdin.flush()
-
-            response = json.loads(stdout.readline())
+            response = self._agent.request(payload)
             if not response["ok"]:
                 cherrypy.response.headers["x-slycat-message"] = response["message"]
                 slycat.email.send_error("slycat.web.server.remote.py set_user_config",
@@ -440,10 +605,10 @@ class Session(object):
                 arr.append(
                     "python $SLYCAT_HOME/agent/slycat-agent-create-image-distance-matrix.py"
                     " --distance-measure %s --distance-column \"%s\" \"%s\" "
-                    "~/slycat_%s_%s_%s_distance_matrix.csv  --profile ${profile}" % (
+                    "~/slycat_%s_%s_%s_distance_matrix.hdf5 --profile=${profile} --parallel-backend ${parallel_backend}" % (
                         function_id, image_columns_name, params["input"], image_columns_name, uid, function_id))
                 # uncomment this line for local development
-                # arr.append("python slycat-agent-create-image-distance-matrix.py --distance-measure %s --distance-column \"%s\" \"%s\" ~/slycat_%s_%s_%s_distance_matrix.csv --profile ${profile}" % (f, c, params["input"], c, uid, f))
+                # arr.append("python slycat-agent-create-image-distance-matrix.py --distance-measure %s --distance-column \"%s\" \"%s\" ~/slycat_%s_%s_%s_distance_matrix.hdf5 --profile=${profile} --parallel-backend ${parallel_backend}" % (f, c, params["input"], c, uid, f))
 
             return arr
 
@@ -480,22 +645,22 @@ class Session(object):
                 arr.append(
                     "python $SLYCAT_HOME/agent/slycat-agent-compute-timeseries.py "
                     "\"%s\" --timeseries-name=\"%s\" --cluster-sample-count %s --cluster-sample-type %s"
-                    " --cluster-type %s --cluster-metric %s --workdir \"%s\" --hash %s --profile ${profile}" % (
+                    " --cluster-type %s --cluster-metric %s --workdir \"%s\" --hash %s --profile=${profile} --parallel-backend ${parallel_backend}" % (
                         hdf5_dir, params["timeseries_name"], params["cluster_sample_count"],
                         params["cluster_sample_type"],
                         params["cluster_type"], params["cluster_metric"], pickle_dir, uid))
                 # uncomment this line for local development
-                # arr.append("python slycat-agent-compute-timeseries.py \"%s\" --timeseries-name=\"%s\" --cluster-sample-count %s --cluster-sample-type %s --cluster-type %s --cluster-metric %s --workdir \"%s\" --hash %s --profile ${profile}" % (params["output_directory"], params["timeseries_name"], params["cluster_sample_count"], params["cluster_sample_type"], params["cluster_type"], params["cluster_metric"], params["workdir"], uid))
+                # arr.append("python slycat-agent-compute-timeseries.py \"%s\" --timeseries-name=\"%s\" --cluster-sample-count %s --cluster-sample-type %s --cluster-type %s --cluster-metric %s --workdir \"%s\" --hash %s --profile=${profile} --parallel-backend ${parallel_backend}" % (params["output_directory"], params["timeseries_name"], params["cluster_sample_count"], params["cluster_sample_type"], params["cluster_type"], params["cluster_metric"], params["workdir"], uid))
             else:
                 # uncomment this line for production
                 arr.append(
                     "python $SLYCAT_HOME/agent/slycat-agent-compute-timeseries.py "
                     "\"%s\" --cluster-sample-count %s --cluster-sample-type %s --cluster-type %s"
-                    " --cluster-metric %s --workdir \"%s\" --hash %s --profile ${profile}" % (
+                    " --cluster-metric %s --workdir \"%s\" --hash %s --profile=${profile} --parallel-backend ${parallel_backend}" % (
                         hdf5_dir, params["cluster_sample_count"], params["cluster_sample_type"], params["cluster_type"],
                         params["cluster_metric"], pickle_dir, uid))
                 # uncomment this line for local development
-                # arr.append("python slycat-agent-compute-timeseries.py \"%s\" --cluster-sample-count %s --cluster-sample-type %s --cluster-type %s --cluster-metric %s --workdir \"%s\" --hash %s --profile ${profile}" % (params["output_directory"], params["cluster_sample_count"], params["cluster_sample_type"], params["cluster_type"], params["cluster_metric"], params["workdir"], uid))
+                # arr.append("python slycat-agent-compute-timeseries.py \"%s\" --cluster-sample-count %s --cluster-sample-type %s --cluster-type %s --cluster-metric %s --workdir \"%s\" --hash %s --profile=${profile} --parallel-backend ${parallel_backend}" % (params["output_directory"], params["cluster_sample_count"], params["cluster_sample_type"], params["cluster_type"], params["cluster_metric"], params["workdir"], uid))
 
             return arr
 
@@ -508,7 +673,6 @@ class Session(object):
             else:
                 return create_distance_matrix(fn_id, params)
 
-        stdin, stdout, stderr = self._agent
         payload = {
             "action": "run-function",
             "command": {
@@ -525,10 +689,7 @@ class Session(object):
             }
         }
         cherrypy.log.error("writing msg: %s" % json.dumps(payload))
-        stdin.write("%s\n" % json.dumps(payload))
-        stdin.flush()
-
-        response = json.loads(stdout.readline())
+        response = self._agent.request(payload)
         cherrypy.log.error("response msg: %s" % response)
         if not response["ok"]:
             cherrypy.response.headers["x-slycat-message"] = response["message"]
@@ -561,14 +722,8 @@ class Session(object):
           A dictionary with the following keys: command, output, errors
         """
         if self._agent is not None:
-            stdin, stdout, stderr = self._agent
-
             payload = {"action": "launch", "command": command}
-
-            stdin.write("%s\n" % json.dumps(payload))
-            stdin.flush()
-
-            response = json.loads(stdout.readline())
+            response = self._agent.request(payload)
             if not response["ok"]:
                 cherrypy.response.headers["x-slycat-message"] = response["message"]
                 slycat.email.send_error("slycat.web.server.remote.py launch",
@@ -590,30 +745,121 @@ class Session(object):
             slycat.email.send_error("slycat.web.server.remote.py launch", "cherrypy.HTTPError 400 %s" % str(e))
             raise cherrypy.HTTPError(400)
 
-    def browse(self, path, file_reject, file_allow, directory_reject, directory_allow):
-        # Use the agent to browse.
+    def browse(self, path, file_reject, file_allow, directory_reject, directory_allow, sort=None, reverse=False,
+               limit=None, token=None):
+        """Return the contents of a remote directory, optionally sorted, and a page at a time.
+
+        Listings are cached for a short time, and revalidated against the
+        directory's modification time, so fetching further pages doesn't list
+        the directory again.
+
+        Parameters
+        ----------
+        path : string
+          Absolute path of the directory (or file) to browse.
+        file_reject, file_allow, directory_reject, directory_allow : compiled regular expressions or None
+          Filters applied to the listing.
+        sort : string, optional
+          One of "name" (the default), "size", "mtime", or "type" (directories first).
+        reverse : bool, optional
+          Reverse the sort order.
+        limit : int, optional
+          Maximum number of entries to return.  If specified, the response
+          includes the "total" number of entries, and a "token" for retrieving
+          the next page, which is None on the last page.
+        token : string, optional
+          Continuation token returned with the previous page.
+
+        Returns
+        -------
+        listing : dict
+        """
+        if sort not in [None, "name", "size", "mtime", "type"]:
+            cherrypy.response.headers["x-slycat-message"] = "Unknown sort order: %s" % sort
+            raise cherrypy.HTTPError(400)
+        try:
+            offset = int(token) if token is not None else 0
+            if offset < 0 or (limit is not None and int(limit) < 1):
+                raise ValueError()
+        except ValueError:
+            cherrypy.response.headers["x-slycat-message"] = "Invalid page."
+            raise cherrypy.HTTPError(400)
+
+        filters = [file_reject, file_allow, directory_reject, directory_allow]
+        key = (self.hostname, self.username, path) + tuple(None if x is None else x.pattern for x in filters)
+        cached = listing_cache.get(key)
+        if cached is not None and time.time() - cached[1] >= listing_cache_lifetime:
+            cached = None
+
+        mtime, listing = self._list(path, None if cached is None else cached[0], *filters)
+        if listing is None:
+            listing = cached[2]
+        elif mtime is not None:
+            listing_cache.put(key, (mtime, time.time(), listing))
+
+        if limit is None and token is None and sort in [None, "name"] and not reverse:
+            return listing
+
+        fields = ["names", "sizes", "types", "mtimes", "mime-types"]
+        order = range(len(listing["names"]))
+        # Listings are sorted by name, and sorting is stable, so ties stay sorted by name.
+        if sort == "size":
+            order.sort(key=lambda i: listing["sizes"][i])
+        elif sort == "mtime":
+            order.sort(key=lambda i: listing["mtimes"][i])
+        elif sort == "type":
+            order.sort(key=lambda i: listing["types"][i] != "d")
+        if reverse:
+            order.reverse()
+
+        end = len(order) if limit is None else offset + int(limit)
+        page = {field: [listing[field][i] for i in order[offset:end]] for field in fields}
+        page["path"] = listing["path"]
+        if limit is not None or token is not None:
+            page["total"] = len(order)
+            page["token"] = str(end) if end < len(order) else None
+        return page
+
+    def _list(self, path, mtime, file_reject, file_allow, directory_reject, directory_allow):
+        """Return the modification time and complete contents of a remote directory, sorted by name.
+
+        If the directory's modification time is still `mtime`, the contents
+        are None, and the directory isn't listed again.  The modification time
+        is None if it isn't available.
+        """
+        # Use the agent to browse, revalidating without holding the session for sftp.
         if self._agent is not None:
-            stdin, stdout, stderr = self._agent
             command = {"action": "browse", "path": path}
+            if mtime is not None:
+                command["mtime"] = mtime
             if file_reject is not None:
-                command["file-reject"] = file_reject
+                command["file-reject"] = file_reject.pattern
             if file_allow is not None:
-                command["file-allow"] = file_allow
+                command["file-allow"] = file_allow.pattern
             if directory_reject is not None:
-                command["directory-reject"] = directory_reject
+                command["directory-reject"] = directory_reject.pattern
             if directory_allow is not None:
-                command["directory-allow"] = directory_allow
+                command["directory-allow"] = directory_allow.pattern
 
-            stdin.write("%s\n" % json.dumps(command))
-            stdin.flush()
-            response = json.loads(stdout.readline())
+            response = self._agent.request(command)
             if not response["ok"]:
                 cherrypy.response.headers["x-slycat-message"] = response["message"]
                 raise cherrypy.HTTPError(400)
-            return {"path": response["path"], "names": response["names"], "sizes": response["sizes"],
-                    "types": response["types"], "mtimes": response["mtimes"], "mime-types": response["mime-types"]}
+            # Agents that predate revalidation don't report the modification time.
+            if response.get("message") == "Directory not modified.":
+                return response["mtime"], None
+            return response.get("mtime"), {"path": response["path"], "names": response["names"],
+                                           "sizes": response["sizes"], "types": response["types"],
+                                           "mtimes": response["mtimes"], "mime-types": response["mime-types"]}
 
         # Use sftp to browse.
+        try:
+            current = self.sftp.stat(path).st_mtime
+        except Exception:
+            current = None
+        if current is not None and current == mtime:
+            return current, None
+
         try:
             names = []
             sizes = []
@@ -648,13 +894,57 @@ class Session(object):
 
             response = {"path": path, "names": names, "sizes": sizes, "types": types, "mtimes": mtimes,
                         "mime-types": mime_types}
-            return response
+            return current, response
         except Exception as e:
             cherrypy.response.headers["x-slycat-message"] = str(e)
             slycat.email.send_error("slycat.web.server.remote.py browse", "cherrypy.HTTPError 400 %s" % str(e))
             raise cherrypy.HTTPError(400)
 
-    def get_file(self, path, **kwargs):
+    def _agent_file(self, command, metadata, content):
+        """Return a file-like object and size for content retrieved by an agent command.
+
+        `metadata` and `content` are the agent's response to the command with a
+        zero length.  Agents that support ranges report the full size of the
+        content as "file-size", and send just the requested range for each later
+        command; older agents ignore the range and send everything at once.
+        Agents that support chunked transfers (reported as "chunks") send each
+        range as checksummed, optionally-compressed chunks, if the command
+        specifies a "chunk-size".
+        """
+        if "file-size" not in metadata:
+            return StringIO.StringIO(content), metadata["size"]
+
+        chunked = "chunks" in metadata
+
+        def request(offset, length):
+            chunk, data = self._agent.request(dict(command, offset=offset, length=length), content=True)
+            if not chunk.get("ok", True):
+                slycat.email.send_error("slycat.web.server.remote.py _agent_file",
+                                        "remote read failed: %s" % chunk["message"])
+                raise IOError(chunk["message"])
+            if chunked:
+                data = _decode_chunks(offset, data)
+            return data
+
+        def read(offset, length):
+            if not chunked:
+                return request(offset, length)
+            # Agents buffer each response, so large reads are split into bounded requests,
+            # continuing from wherever the agent's last response ended.
+            pieces = []
+            end = offset + length
+            while offset < end:
+                data = request(offset, min(end - offset, agent_range_length))
+                if not data:
+                    break
+                pieces.append(data)
+                offset += len(data)
+            return "".join(pieces)
+
+        return _SessionFile(self, read), metadata["file-size"]
+
+    def _open_file(self, path, **kwargs):
+        """Return a file-like object, size, and content type for a remote file."""
         cache = kwargs.get("cache", None)
         project = kwargs.get("project", None)
         key = kwargs.get("key", None)
@@ -676,10 +966,9 @@ class Session(object):
 
         # Use the agent to retrieve a file.
         if self._agent is not None:
-            stdin, stdout, stderr = self._agent
-            stdin.write("%s\n" % json.dumps({"action": "get-file", "path": path}))
-            stdin.flush()
-            metadata = json.loads(stdout.readline())
+            command = {"action": "get-file", "path": path, "chunk-size": agent_chunk_size,
+                       "compression": agent_compression}
+            metadata, content = self._agent.request(dict(command, offset=0, length=0), content=True)
 
             if metadata["message"] == "Path must be absolute.":
                 cherrypy.response.headers["x-slycat-message"] = "Remote path %s:%s is not absolute." % (
@@ -733,13 +1022,14 @@ class Session(object):
                 raise cherrypy.HTTPError("400 Access denied.")
 
             content_type = metadata["content-type"]
-            content = stdout.read(metadata["size"])
+            stream, size = self._agent_file(command, metadata, content)
 
             if cache == "project":
+                content = stream.read(size)
                 cache_object(project, key, content_type, content)
+                stream = StringIO.StringIO(content)
 
-            cherrypy.response.headers["content-type"] = content_type
-            return content
+            return stream, size, content_type
 
         # Use sftp to retrieve a file.
         try:
@@ -753,13 +1043,22 @@ class Session(object):
             content_type, encoding = slycat.mime_type.guess_type(path)
             if content_type is None:
                 content_type = "application/octet-stream"
-            content = self._sftp.file(path).read()
+            remote_file = self._sftp.file(path, "rb")
+            size = remote_file.stat().st_size
 
             if cache == "project":
+                content = remote_file.read()
                 cache_object(project, key, content_type, content)
+                return StringIO.StringIO(content), len(content), content_type
 
-            cherrypy.response.headers["content-type"] = content_type
-            return content
+            def read(offset, length):
+                length = min(length, size - offset)
+                if length <= 0:
+                    return ""
+                # Unlike read(), readv() pipelines the SFTP requests for a range.
+                return "".join(remote_file.readv([(offset, length)]))
+
+            return _SessionFile(self, read), size, content_type
 
         except Exception as e:
             cherrypy.log.error("Exception reading remote file %s: %s %s" % (path, type(e), str(e)))
@@ -803,6 +1102,35 @@ class Session(object):
                                     "cherrypy.HTTPError 400 remote access failed: %s" % str(e))
             raise cherrypy.HTTPError("400 Remote access failed.")
 
+    def get_file(self, path, **kwargs):
+        """Return the contents of a remote file.
+
+        Use :meth:`iter_file` for files that may not fit in memory.
+        """
+        stream, size, content_type = self._open_file(path, **kwargs)
+        cherrypy.response.headers["content-type"] = content_type
+        return stream.read(size)
+
+    def iter_file(self, path, chunk_size=1024 * 1024, **kwargs):
+        """Return an iterator over the contents of a remote file, read `chunk_size` bytes at a time."""
+        stream, size, content_type = self._open_file(path, **kwargs)
+
+        def content():
+            remaining = size
+            while remaining > 0:
+                chunk = stream.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+        return content()
+
+    def serve_file(self, path, **kwargs):
+        """Stream a remote file in response to the current request, honoring HTTP Range requests."""
+        stream, size, content_type = self._open_file(path, **kwargs)
+        return slycat.web.server.streaming.serve(stream, size, content_type)
+
     def get_image(self, path, **kwargs):
         content_type = kwargs.get("content-type", None)
         max_size = kwargs.get("max-size", None)
@@ -837,8 +1165,6 @@ class Session(object):
             raise cherrypy.HTTPError("400 Agent required.")
 
         # Use the agent to retrieve an image.
-        stdin, stdout, stderr = self._agent
-
         command = {"action": "get-image", "path": path}
         if content_type is not None:
             command["content-type"] = content_type
@@ -849,9 +1175,13 @@ class Session(object):
         if max_height is not None:
             command["max-height"] = max_height
 
-        stdin.write("%s\n" % json.dumps(command))
-        stdin.flush()
-        metadata = json.loads(stdout.readline())
+        # If we've retrieved this image before, the agent only resends it if it has changed.
+        cache_key = (self.hostname, self.username, json.dumps(command, sort_keys=True))
+        cached = thumbnail_cache.get(cache_key)
+        if cached is not None:
+            command["etag"] = cached[0]
+
+        metadata, content = self._agent.request(command, content=True)
 
         if metadata["message"] == "Path must be absolute.":
             cherrypy.response.headers["x-slycat-message"] = "Remote path %s:%s is not absolute." % (self.hostname, path)
@@ -887,13 +1217,26 @@ class Session(object):
                                         self.hostname, path, self.hostname, path, path))
             raise cherrypy.HTTPError("400 Access denied.")
 
+        if metadata["message"] == "Image not modified.":
+            content = cached[1]
+        elif "etag" in metadata:
+            thumbnail_cache.put(cache_key, (metadata["etag"], content))
+
         content_type = metadata["content-type"]
-        content = stdout.read(metadata["size"])
 
         if cache == "project":
             cache_object(project, key, content_type, content)
 
         cherrypy.response.headers["content-type"] = content_type
+
+        # Let browsers revalidate their copies instead of retrieving the image again.
+        if "etag" in metadata:
+            cherrypy.response.headers["etag"] = '"%s"' % metadata["etag"]
+            cherrypy.response.headers["last-modified"] = cherrypy.lib.httputil.HTTPDate(metadata["mtime"])
+            cherrypy.response.headers["cache-control"] = "private, no-cache"
+            cherrypy.lib.cptools.validate_etags()
+            cherrypy.lib.cptools.validate_since()
+
         return content
 
     def get_video_status(self, vsid):
@@ -906,11 +1249,7 @@ class Session(object):
             raise cherrypy.HTTPError("400 Agent required.")
 
         # Get the video status from the agent.
-        stdin, stdout, stderr = self._agent
-
-        stdin.write("%s\n" % json.dumps({"action": "video-status", "sid": vsid}))
-        stdin.flush()
-        metadata = json.loads(stdout.readline())
+        metadata = self._agent.request({"action": "video-status", "sid": vsid})
 
         cherrypy.response.headers["x-slycat-message"] = metadata["message"]
 
@@ -929,19 +1268,146 @@ class Session(object):
             raise cherrypy.HTTPError("400 Agent required.")
 
         # Get the video from the agent.
-        stdin, stdout, stderr = self._agent
-
-        stdin.write("%s\n" % json.dumps({"action": "get-video", "sid": vsid}))
-        stdin.flush()
-        metadata = json.loads(stdout.readline())
+        command = {"action": "get-video", "sid": vsid}
+        metadata, content = self._agent.request(dict(command, offset=0, length=0), content=True)
         sys.stderr.write("\n%s\n" % metadata)
-        return slycat.web.server.streaming.serve(stdout, metadata["size"], metadata["content-type"])
+        stream, size = self._agent_file(command, metadata, content)
+        return slycat.web.server.streaming.serve(stream, size, metadata["content-type"])
+
+
+class _Connection(object):
+    """An authenticated ssh connection, shared by the sessions of one user on one host.
+
+    Each session opens its own SFTP and agent channels over the connection.
+    """
+
+    def __init__(self, key, ssh):
+        self.key = key
+        self.ssh = ssh
+        self.sessions = 0
+        self.released = time.time()
+
+    @property
+    def active(self):
+        transport = self.ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+
+#: Upper bound on the sessions sharing one connection, since sshd limits the channels per connection (MaxSessions).
+max_sessions_per_connection = 4
+#: Seconds that a connection without sessions is kept open for reuse.
+connection_idle_timeout = 10 * 60
+#: Seconds between checks of pooled connections, so idle connections are closed close to the timeout.
+connection_check_interval = 60
+#: Seconds between checks for expired remote sessions.
+session_check_interval = 15 * 60
+
+connection_pool = {}
+connection_pool_lock = threading.Lock()
+_connection_salt = os.urandom(16)
+
+
+def _connection_key(hostname, username, password):
+    """Return the pool key for a connection.
+
+    Connections are only reused for callers that supply the same credentials.
+    """
+    if slycat.web.server.config["slycat-web-server"]["remote-authentication"]["method"] == "certificate":
+        return hostname, cherrypy.request.login, None
+    if isinstance(password, unicode):
+        password = password.encode("utf-8")
+    return hostname, username, hashlib.sha256(_connection_salt + (password or "")).hexdigest()
+
+
+def _acquire_connection(hostname, username, password):
+    """Return an ssh connection for a new session, reusing a pooled connection if possible."""
+    key = _connection_key(hostname, username, password)
+    with connection_pool_lock:
+        for connection in connection_pool.get(key, []):
+            if connection.sessions < max_sessions_per_connection and connection.active:
+                connection.sessions += 1
+                return connection.ssh
+
+    # Connecting takes seconds, so don't hold the lock while we wait.
+    ssh = slycat.web.server.ssh_connect(hostname=hostname, username=username, password=password)
+    try:
+        # Detect problematic startup scripts.
+        stdin, stdout, stderr = ssh.exec_command("/bin/true")
+        if stdout.read():
+            slycat.email.send_error("slycat.web.server.remote.py create_session",
+                                    "cherrypy.HTTPError 500 Slycat can't connect because you "
+                                    "have a startup script (~/.ssh/rc, ~/.bashrc, ~/.cshrc or similar)"
+                                    " that writes data to stdout. Startup scripts should only write to "
+                                    "stderr, never stdout - see sshd(8).")
+            raise cherrypy.HTTPError(
+                "500 Slycat can't connect because you have a startup script "
+                "(~/.ssh/rc, ~/.bashrc, ~/.cshrc or similar) that writes data to stdout. "
+                "Startup scripts should only write to stderr, never stdout - see sshd(8).")
+    except:
+        ssh.close()
+        raise
+
+    connection = _Connection(key, ssh)
+    connection.sessions = 1
+    with connection_pool_lock:
+        connection_pool.setdefault(key, []).append(connection)
+    return ssh
+
+
+def _release_connection(ssh):
+    """Return a session's ssh connection to the pool, closing it if it has failed."""
+    with connection_pool_lock:
+        for connections in connection_pool.values():
+            for connection in connections:
+                if connection.ssh is ssh:
+                    connection.sessions -= 1
+                    connection.released = time.time()
+                    if not connection.active:
+                        _discard_connection(connection)
+                    return
+    ssh.close()
+
+
+def _discard_connection(connection):
+    """Remove a connection from the pool and close it.  Assumes that the caller holds connection_pool_lock."""
+    connections = connection_pool[connection.key]
+    connections.remove(connection)
+    if not connections:
+        del connection_pool[connection.key]
+    connection.ssh.close()
+
+
+def _check_connections():
+    """Close pooled connections that have failed, or that have had no sessions for too long."""
+    with connection_pool_lock:
+        for connections in list(connection_pool.values()):
+            for connection in list(connections):
+                if connection.sessions == 0:
+                    if time.time() - connection.released > connection_idle_timeout:
+                        cherrypy.log.error("Closing idle ssh connection to %s." % connection.key[0])
+                        _discard_connection(connection)
+                        continue
+                    # Make sure idle connections are still usable, so new sessions don't inherit a dead one.
+                    try:
+                        connection.ssh.get_transport().send_ignore()
+                    except Exception as e:
+                        cherrypy.log.error("Closing ssh connection to %s after failed keepalive: %s" % (
+                            connection.key[0], e))
+                        _discard_connection(connection)
+                        continue
+                if not connection.active:
+                    cherrypy.log.error("Closing failed ssh connection to %s." % connection.key[0])
+                    _discard_connection(connection)
 
 
 def create_session(hostname, username, password, agent):
     """
     Create a cached remote session for the given host.
 
+    Sessions for the same user on the same host share a pooled ssh connection
+    when they supply the same credentials, each using its own SFTP and agent
+    channels, so only the first session pays for authentication.
+
     Parameters
     ----------
     hostname : string
@@ -962,71 +1428,68 @@ def create_session(hostname, username, password, agent):
     client = cherrypy.request.headers.get("x-forwarded-for")
     sid = uuid.uuid4().hex
     try:
-        ssh = slycat.web.server.ssh_connect(hostname=hostname, username=username, password=password)
-        # Detect problematic startup scripts.
-        stdin, stdout, stderr = ssh.exec_command("/bin/true")
-        if stdout.read():
-            slycat.email.send_error("slycat.web.server.remote.py create_session",
-                                    "cherrypy.HTTPError 500 Slycat can't connect because you "
-                                    "have a startup script (~/.ssh/rc, ~/.bashrc, ~/.cshrc or similar)"
-                                    " that writes data to stdout. Startup scripts should only write to "
-                                    "stderr, never stdout - see sshd(8).")
-            raise cherrypy.HTTPError(
-                "500 Slycat can't connect because you have a startup script "
-                "(~/.ssh/rc, ~/.bashrc, ~/.cshrc or similar) that writes data to stdout. "
-                "Startup scripts should only write to stderr, never stdout - see sshd(8).")
-
-        cherrypy.log.error("Created remote session for %s@%s from %s" % (username, hostname, client))
-        # Start sftp.
-        sftp = ssh.open_sftp()
-
-        # Optionally start an agent.
-        remote_hosts = cherrypy.request.app.config["slycat-web-server"]["remote-hosts"]
-        if agent is None:
-            agent = hostname in remote_hosts and "agent" in remote_hosts[hostname]
-
-        if agent:
-            if hostname not in remote_hosts:
-                slycat.email.send_error("slycat.web.server.remote.py create_session",
-                                        "cherrypy.HTTPError 400 host %s not in allowed remote hosts." % hostname)
-                raise cherrypy.HTTPError("400 Missing agent configuration.")
-            if "agent" not in remote_hosts[hostname]:
-                slycat.email.send_error("slycat.web.server.remote.py create_session",
-                                        "cherrypy.HTTPError 400 missing agent configuration for host %s." % hostname)
-                raise cherrypy.HTTPError("400 Missing agent configuration.")
-            if "command" not in remote_hosts[hostname]["agent"]:
-                slycat.email.send_error("slycat.web.server.remote.py create_session",
-                                        "cherrypy.HTTPError 500 missing agent configuration"
-                                        " for host %s: missing command keyword." % hostname)
-                raise cherrypy.HTTPError("500 Missing agent configuration.")
-
-            cherrypy.log.error("Starting agent executable for %s@%s with command: %s" % (
-                username, hostname, remote_hosts[hostname]["agent"]["command"]))
-            stdin, stdout, stderr = ssh.exec_command(remote_hosts[hostname]["agent"]["command"])
-            cherrypy.log.error("Started agent")
-            # Handle catastrophic startup failures (the agent process failed to start).
-            try:
-                startup = json.loads(stdout.readline())
-            except Exception as e:
-                cherrypy.log.error("500 agent startup failed for host %s: %s." % (hostname, str(e)))
-                slycat.email.send_error("slycat.web.server.remote.py create_session",
-                                        "cherrypy.HTTPError 500 agent startup failed for host %s: %s." % (
-                                            hostname, str(e)))
-                raise cherrypy.HTTPError("500 Agent startup failed: %s" % str(e))
-            # Handle clean startup failures (the agent process started, but reported an error).
-            if not startup["ok"]:
-                cherrypy.log.error("500 agent startup failed for host %s: %s." % (hostname, startup["message"]))
-                slycat.email.send_error("slycat.web.server.remote.py create_session",
-                                        "cherrypy.HTTPError 500 agent startup failed for host %s: %s." % (
-                                            hostname, startup["message"]))
-                raise cherrypy.HTTPError("500 Agent startup failed: %s" % startup["message"])
-            agent = (stdin, stdout, stderr)
-            with session_cache_lock:
-                session_cache[sid] = Session(client, username, hostname, ssh, sftp, agent)
-        else:
-            with session_cache_lock:
-                session_cache[sid] = Session(client, username, hostname, ssh, sftp)
-        return sid
+        ssh = _acquire_connection(hostname, username, password)
+        sftp, stdout = None, None
+        try:
+            cherrypy.log.error("Created remote session for %s@%s from %s" % (username, hostname, client))
+            # Start sftp.
+            sftp = ssh.open_sftp()
+
+            # Optionally start an agent.
+            remote_hosts = cherrypy.request.app.config["slycat-web-server"]["remote-hosts"]
+            if agent is None:
+                agent = hostname in remote_hosts and "agent" in remote_hosts[hostname]
+
+            if agent:
+                if hostname not in remote_hosts:
+                    slycat.email.send_error("slycat.web.server.remote.py create_session",
+                                            "cherrypy.HTTPError 400 host %s not in allowed remote hosts." % hostname)
+                    raise cherrypy.HTTPError("400 Missing agent configuration.")
+                if "agent" not in remote_hosts[hostname]:
+                    slycat.email.send_error("slycat.web.server.remote.py create_session",
+                                            "cherrypy.HTTPError 400 missing agent configuration for host %s." % hostname)
+                    raise cherrypy.HTTPError("400 Missing agent configuration.")
+                if "command" not in remote_hosts[hostname]["agent"]:
+                    slycat.email.send_error("slycat.web.server.remote.py create_session",
+                                            "cherrypy.HTTPError 500 missing agent configuration"
+                                            " for host %s: missing command keyword." % hostname)
+                    raise cherrypy.HTTPError("500 Missing agent configuration.")
+
+                cherrypy.log.error("Starting agent executable for %s@%s with command: %s" % (
+                    username, hostname, remote_hosts[hostname]["agent"]["command"]))
+                stdin, stdout, stderr = ssh.exec_command(remote_hosts[hostname]["agent"]["command"])
+                cherrypy.log.error("Started agent")
+                # Handle catastrophic startup failures (the agent process failed to start).
+                try:
+                    startup = json.loads(stdout.readline())
+                except Exception as e:
+                    cherrypy.log.error("500 agent startup failed for host %s: %s." % (hostname, str(e)))
+                    slycat.email.send_error("slycat.web.server.remote.py create_session",
+                                            "cherrypy.HTTPError 500 agent startup failed for host %s: %s." % (
+                                                hostname, str(e)))
+                    raise cherrypy.HTTPError("500 Agent startup failed: %s" % str(e))
+                # Handle clean startup failures (the agent process started, but reported an error).
+                if not startup["ok"]:
+                    cherrypy.log.error("500 agent startup failed for host %s: %s." % (hostname, startup["message"]))
+                    slycat.email.send_error("slycat.web.server.remote.py create_session",
+                                            "cherrypy.HTTPError 500 agent startup failed for host %s: %s." % (
+                                                hostname, startup["message"]))
+                    raise cherrypy.HTTPError("500 Agent startup failed: %s" % startup["message"])
+                agent = _agent_channel(stdin, stdout, stderr)
+                with session_cache_lock:
+                    session_cache[sid] = Session(client, username, hostname, ssh, sftp, agent)
+            else:
+                with session_cache_lock:
+                    session_cache[sid] = Session(client, username, hostname, ssh, sftp)
+            return sid
+        except:
+            # Other sessions may share the connection, so only close the channels we opened.
+            if sftp is not None:
+                sftp.close()
+            if stdout is not None:
+                stdout.channel.close()
+            _release_connection(ssh)
+            raise
     except cherrypy.HTTPError as e:
         cherrypy.log.error("Agent startup failed for %s@%s: %s" % (username, hostname, e.status))
         slycat.email.send_error("slycat.web.server.remote.py create_session",
@@ -1157,14 +1620,19 @@ def _expire_session(sid):
 
 
 def _session_monitor():
+    checked = None
     while True:
-        cherrypy.log.error("Remote session cleanup worker running.")
-        with session_cache_lock:
-            for sid in list(
-                    session_cache.keys()):  # We make an explicit copy of the keys because we may be modifying the dict contents
-                _expire_session(sid)
-        cherrypy.log.error("Remote session cleanup worker finished.")
-        time.sleep(datetime.timedelta(minutes=15).total_seconds())
+        if checked is None or time.time() - checked >= session_check_interval:
+            cherrypy.log.error("Remote session cleanup worker running.")
+            with session_cache_lock:
+                for sid in list(
+                        session_cache.keys()):  # We make an explicit copy of the keys because we may be modifying the dict contents
+                    _expire_session(sid)
+            checked = time.time()
+            cherrypy.log.error("Remote session cleanup worker finished.")
+        # Pooled connections are checked more often than they time out.
+        _check_connections()
+        time.sleep(connection_check_interval)
 
 
 def _start_session_cleanup_worker():
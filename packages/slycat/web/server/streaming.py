@@ -3,14 +3,69 @@
 # rights in this software.
 
 import cherrypy
+import cherrypy.lib.httputil
 
-def serve(stream, size, content_type):
+def byte_range(size):
+  """Return the (start, stop) byte range requested by the client, or None for the whole content.
+
+  Only single ranges are honored - for multiple ranges the whole content is
+  served, which HTTP allows.  Raises a 416 error for unsatisfiable ranges.
+  """
+  if "range" not in cherrypy.request.headers:
+    return None
+  ranges = cherrypy.lib.httputil.get_ranges(cherrypy.request.headers["range"], size)
+  if ranges == []:
+    cherrypy.response.headers["content-range"] = "bytes */%s" % size
+    raise cherrypy.HTTPError("416 Requested range not satisfiable.")
+  if ranges is None or len(ranges) != 1:
+    return None
+  return ranges[0]
+
+def serve(stream, size, content_type, chunk_size=1024 * 1024):
+  """Serve the contents of a file-like object, honoring HTTP Range requests.
+
+  The content is read and yielded in bounded chunks, so the calling handler
+  must enable response.stream.  Only the requested range is read: `stream`
+  must support seek() if the client can request ranges that don't begin at
+  the start of the content.
+
+  Parameters
+  ----------
+  stream: file-like object, required.
+    Source of the content to be served.
+  size: int, required.
+    Total size of the content in bytes.
+  content_type: string, required.
+    Content type of the content.
+  chunk_size: int, optional.
+    Maximum number of bytes to read at a time.
+
+  Returns
+  -------
+  content: generator that yields the response body.
+  """
   cherrypy.response.headers["accept-ranges"] = "bytes"
   cherrypy.response.headers["content-type"] = content_type
-  if "range" in cherrypy.request.headers:
-    cherrypy.response.headers["content-range"] = "bytes 0-%s/%s" % (size-1, size)
-    cherrypy.response.status = "206"
-  else:
+
+  requested = byte_range(size)
+  if requested is None:
+    start, stop = 0, size
     cherrypy.response.status = "200"
-  content = stream.read(size)
-  return content
+  else:
+    start, stop = requested
+    cherrypy.response.headers["content-range"] = "bytes %s-%s/%s" % (start, stop - 1, size)
+    cherrypy.response.status = "206"
+  cherrypy.response.headers["content-length"] = str(stop - start)
+
+  def content():
+    if start:
+      stream.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+      chunk = stream.read(min(chunk_size, remaining))
+      if not chunk:
+        break
+      remaining -= len(chunk)
+      yield chunk
+
+  return content()
@@ -10,12 +10,14 @@ upload session is created, a new id is generated and a storage location is
 created on the filesystem.  The client uses the session id to upload one-to-many
 files, each of which may be split in one-to-many parts - splitting files into
 parts allows clients to incrementally upload files that might otherwise exceed
-request body limits.  Once the client has completed uploading file data, it
-notifies the server, and includes a list of part-counts for each file it
-uploaded.  This gives the server a chance to validate that it received every
-part of every file that the client sent.  Assuming all went well, the file
-parts are consolidated into whole files that are passed to a parser plugin
-for parsing and storage in a model.  Once parsing is complete, the client
+request body limits.  As parts arrive they are appended, in order, to a single
+file on disk, so whole files never have to be held in memory; clients can ask
+which parts have been received, and resume an interrupted upload by sending
+just the parts that are missing.  Once the client has completed uploading file
+data, it notifies the server, and includes a list of part-counts for each file
+it uploaded.  This gives the server a chance to validate that it received every
+part of every file that the client sent.  Assuming all went well, the files
+are passed to a parser plugin for parsing and storage in a model.  Once parsing is complete, the client
 deletes the session, which releases all temporary storage used by the session.
 The client may also opt to delete the session before uploading is complete,
 cancelling the entire operation.
@@ -61,6 +63,10 @@ def path(uid, fid=None, pid=None):
     result = os.path.join(result, "part-%s" % pid)
   return result
 
+def assembled_path(uid, fid):
+  """Return the path of the file assembled from the parts of an uploaded file."""
+  return os.path.join(path(uid, fid), "assembled")
+
 class Session(object):
   """Encapsulates an upload session.
 
@@ -87,6 +93,9 @@ class Session(object):
     self._created = now
     self._accessed = now
     self._received = set()
+    # Index of the next part to be appended to each assembled file.
+    self._assembled = {}
+    self._file_count = None
     self._parsing_thread = None
     self._lock = threading.Lock()
 
@@ -113,17 +122,56 @@ class Session(object):
     return self._accessed
 
   def put_upload_file_part(self, fid, pid, data):
+    """
+    stores part of an uploaded file. Parts are appended to the assembled
+    file as soon as every part before them has arrived; parts that arrive
+    early wait on disk until then. Re-sending a part that has already been
+    appended is harmless, so clients can safely retry.
+    :param fid: zero-based file index
+    :param pid: zero-based part index
+    :param data: part contents, as a string or file-like object
+    :return: not used
+    """
     if self._parsing_thread is not None:
       raise cherrypy.HTTPError("409 Upload already finished.")
 
+    if pid < self._assembled.get(fid, 0):
+      return
+
     storage = path(self._uid, fid, pid)
     if not os.path.exists(os.path.dirname(storage)):
       os.makedirs(os.path.dirname(storage))
     # cherrypy.log.error("Storing upload file part %s" % storage)
-    with open(storage, "wb") as file:
-      file.write(data)
+    with open(storage + ".partial", "wb") as file:
+      if isinstance(data, basestring):
+        file.write(data)
+      else:
+        shutil.copyfileobj(data, file, 1024 * 1024)
+    os.rename(storage + ".partial", storage)
     self._received.add((fid, pid))
 
+    self._append_parts(fid)
+
+  def _append_parts(self, fid):
+    """Append every part that's next in line to the assembled file."""
+    next_pid = self._assembled.get(fid, 0)
+    if not os.path.exists(path(self._uid, fid, next_pid)):
+      return
+    with open(assembled_path(self._uid, fid), "ab") as assembled:
+      while os.path.exists(path(self._uid, fid, next_pid)):
+        with open(path(self._uid, fid, next_pid), "rb") as part:
+          shutil.copyfileobj(part, assembled, 1024 * 1024)
+        os.remove(path(self._uid, fid, next_pid))
+        next_pid += 1
+    self._assembled[fid] = next_pid
+
+  def get_upload_status(self):
+    """
+    describes the parts that have been received, so clients can resume an interrupted upload
+    :return: {"received": [[fid, pid], ...], "finished": boolean}
+    """
+    return {"received": sorted([list(part) for part in self._received]), "finished": self._parsing_thread is not None}
+
   def post_upload_finished(self, uploaded):
     """
     checks for missing and excess files, if neither are found moves on to
@@ -142,6 +190,7 @@ class Session(object):
     if self._parsing_thread is not None:
       raise cherrypy.HTTPError("409 Upload already finished.")
 
+    file_count = len(uploaded)
     uploaded = {(fid, pid) for fid in range(len(uploaded)) for pid in range(uploaded[fid])}
     missing = [part for part in uploaded if part not in self._received]
     excess = [part for part in self._received if part not in uploaded]
@@ -154,6 +203,7 @@ class Session(object):
       cherrypy.response.status = "400 Client confused."
       return {"excess": excess}
 
+    self._file_count = file_count
     self._parsing_thread = threading.Thread(name="Upload parsing", target=Session._parse_uploads, args=[self])
     self._parsing_thread.start()
 
@@ -174,27 +224,32 @@ class Session(object):
       database = slycat.web.server.database.couchdb.connect()
       model = database.get("model", self._mid)
 
-      def numeric_order(x):
-        """Files and file parts must be loaded in numeric, not lexicographical, order."""
-        return int(x.split("-")[-1])
-
       files = []
-      storage = path(self._uid)
-      for file_dir in sorted(glob.glob(os.path.join(storage, "file-*")), key=numeric_order):
-        cherrypy.log.error("Assembling %s" % file_dir)
-        file = ""
-        for file_part in sorted(glob.glob(os.path.join(file_dir, "part-*")), key=numeric_order):
-          cherrypy.log.error(" Loading %s" % file_part)
-          with open(file_part, "r") as f:
-            file += f.read()
-        files.append(file)
-
+      for fid in range(self._file_count):
+        storage = assembled_path(self._uid, fid)
+        if not os.path.exists(storage):
+          # A file uploaded with zero parts.
+          if not os.path.exists(os.path.dirname(storage)):
+            os.makedirs(os.path.dirname(storage))
+          open(storage, "wb").close()
+        files.append(storage)
+
+      parser = slycat.web.server.plugin.manager.parsers[self._parser]
       try:
-        slycat.web.server.plugin.manager.parsers[self._parser]["parse"](database, model, self._input, files, self._aids, **self._kwargs)
+        if parser.get("streaming", False):
+          # Streaming parsers read the assembled files directly.
+          files = [open(storage, "rb") for storage in files]
+        else:
+          files = [open(storage, "rb").read() for storage in files]
+        parser["parse"](database, model, self._input, files, self._aids, **self._kwargs)
       except Exception as e:
         cherrypy.log.error("Exception parsing posted files: %s" % e)
         import traceback
         cherrypy.log.error(traceback.format_exc())
+      finally:
+        for file in files:
+          if hasattr(file, "close"):
+            file.close()
 
       cherrypy.log.error("Upload parsing finished.")
 
@@ -1,2 +1,52 @@
+import numpy
 import pytest
+import scipy.stats
 import slycat.cca
+
+@pytest.fixture
+def data():
+  random = numpy.random.RandomState(1234)
+  X = random.normal(size=(50, 6))
+  Y = numpy.column_stack((X[:, 0] + X[:, 1], X[:, 2] - X[:, 3])) + random.normal(scale=0.5, size=(50, 2))
+  Y = numpy.column_stack((Y, random.normal(size=(50, 2))))
+  return X, Y
+
+def test_structure_correlations(data):
+  X, Y = data
+  x, y, x_loadings, y_loadings, r, wilks = slycat.cca.cca(X.copy(), Y.copy())
+  X = (X - X.mean(axis=0)) / X.std(axis=0)
+  Y = (Y - Y.mean(axis=0)) / Y.std(axis=0)
+  numpy.testing.assert_allclose(x_loadings, [[scipy.stats.pearsonr(i, j)[0] for i in x.T] for j in X.T])
+  numpy.testing.assert_allclose(y_loadings, [[scipy.stats.pearsonr(i, j)[0] for i in y.T] for j in Y.T])
+  assert numpy.all(r[:-1] >= r[1:])
+  assert numpy.all(wilks[:-1] <= wilks[1:])
+
+def test_force_positive(data):
+  X, Y = data
+  x, y, x_loadings, y_loadings, r, wilks = slycat.cca.cca(X.copy(), Y.copy())
+  forced = slycat.cca.cca(X.copy(), Y.copy(), force_positive=1)
+  signs = numpy.where(y_loadings[1] < 0, -1, 1)
+  assert numpy.all(forced[3][1] >= 0)
+  numpy.testing.assert_allclose(forced[0], x * signs)
+  numpy.testing.assert_allclose(forced[2], x_loadings * signs)
+  numpy.testing.assert_allclose(forced[4], r)
+
+def test_constant_column(data):
+  X, Y = data
+  Y[:, 2] = 3
+  with pytest.raises(ValueError):
+    slycat.cca.cca(X, Y)
+
+def test_batch(data):
+  X, Y = data
+  Ys = [Y[:, :3], Y[numpy.random.RandomState(0).permutation(len(Y))], Y]
+  results = slycat.cca.cca_batch(X.copy(), [Y.copy() for Y in Ys], force_positive=0)
+  assert len(results) == len(Ys)
+  for Y, result in zip(Ys, results):
+    for actual, expected in zip(result, slycat.cca.cca(X.copy(), Y.copy(), force_positive=0)):
+      numpy.testing.assert_allclose(actual, expected)
+
+def test_batch_validates_every_output(data):
+  X, Y = data
+  with pytest.raises(ValueError):
+    slycat.cca.cca_batch(X, [Y, Y[:10]])
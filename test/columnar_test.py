@@ -0,0 +1,23 @@
+import numpy
+import slycat.columnar
+
+def test_round_trip():
+  numbers = numpy.arange(6, dtype=">i4").reshape(2, 3)
+  floats = numpy.array([1.0, numpy.nan, 3.0])
+  strings = numpy.array([u"a", u"b\u00e9", u""], dtype="object")
+  message = "".join(slycat.columnar.encode([("numbers", numbers), ("floats", floats), ("strings", strings)], metadata={"rows": [0, 1, 2]}))
+  assert len(message) % 8 == 0
+
+  metadata, columns = slycat.columnar.decode(message)
+  assert metadata == {"rows": [0, 1, 2]}
+  assert [name for name, values in columns] == ["numbers", "floats", "strings"]
+  numpy.testing.assert_array_equal(columns[0][1], numbers)
+  assert columns[0][1].dtype == numpy.dtype("<i4")
+  assert columns[1][1].mask.tolist() == [False, True, False]
+  assert columns[1][1][0] == 1.0
+  assert columns[2][1].tolist() == [u"a", u"b\u00e9", u""]
+
+def test_empty():
+  metadata, columns = slycat.columnar.decode("".join(slycat.columnar.encode([("empty", numpy.zeros((0,), dtype="float64"))])))
+  assert metadata is None
+  assert columns[0][1].shape == (0,)
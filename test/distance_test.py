@@ -0,0 +1,47 @@
+import h5py
+import numpy
+import pytest
+import scipy.cluster.hierarchy
+import scipy.spatial.distance
+import slycat.distance
+import slycat.timeseries
+
+@pytest.fixture
+def waveforms():
+  return numpy.random.RandomState(1234).normal(size=(37, 10)).cumsum(axis=1)
+
+def test_index():
+  count = 6
+  condensed = numpy.arange(slycat.distance.size(count))
+  square = scipy.spatial.distance.squareform(condensed)
+  i, j = numpy.triu_indices(count, k=1)
+  assert numpy.array_equal(slycat.distance.index(count, i, j), square[i, j])
+  assert numpy.array_equal(slycat.distance.index(count, j, i), square[i, j])
+  assert slycat.distance.count(slycat.distance.size(count)) == count
+  with pytest.raises(ValueError):
+    slycat.distance.count(4)
+
+def test_row_blocks():
+  blocks = slycat.distance.row_blocks(100, 500)
+  assert blocks[0][0] == 0
+  assert blocks[-1][1] == 99
+  assert all(end == begin for (_, end), (begin, _) in zip(blocks[:-1], blocks[1:]))
+  assert all(slycat.distance.offset(100, end) - slycat.distance.offset(100, begin) <= 500 or end == begin + 1 for begin, end in blocks)
+
+def test_stored_distances(tmpdir, waveforms):
+  expected = scipy.spatial.distance.pdist(waveforms)
+  with h5py.File(str(tmpdir.join("distances.hdf5")), "w") as file:
+    distances = slycat.distance.create(file, len(waveforms), chunk_size=64)
+    slycat.timeseries.condensed_distances(waveforms, distances, block_size=5)
+  with h5py.File(str(tmpdir.join("distances.hdf5")), "r") as file:
+    distances = slycat.distance.open(file)
+    numpy.testing.assert_allclose(slycat.distance.read(distances, block_size=100), expected)
+    numpy.testing.assert_allclose(slycat.distance.read(distances, 10, 50), expected[10:50])
+    numpy.testing.assert_allclose(slycat.distance.leading(distances, 12), scipy.spatial.distance.pdist(waveforms[:12]))
+    numpy.testing.assert_allclose(slycat.distance.linkage(distances), scipy.cluster.hierarchy.linkage(expected, method="average"))
+
+def test_linkage_preserves_input(waveforms):
+  distances = scipy.spatial.distance.pdist(waveforms)
+  original = distances.copy()
+  slycat.distance.linkage(distances, method="complete")
+  assert numpy.array_equal(distances, original)
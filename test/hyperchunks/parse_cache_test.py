@@ -0,0 +1,17 @@
+import pytest
+import slycat.hyperchunks
+
+def test_parse_reuses_cached_result():
+  first = slycat.hyperchunks.parse("0/a1 > 3 and a2 in [1, 2, 3]/...")
+  assert slycat.hyperchunks.parse("0/a1 > 3 and a2 in [1, 2, 3]/...") is first
+
+def test_parse_cache_is_bounded():
+  size = slycat.hyperchunks.parse.cache_size
+  try:
+    slycat.hyperchunks.parse.cache_size = 2
+    for index in range(5):
+      slycat.hyperchunks.parse("%s/0" % index)
+    assert len(slycat.hyperchunks.parse.cache) == 2
+    assert list(slycat.hyperchunks.parse.cache.keys()) == ["3/0", "4/0"]
+  finally:
+    slycat.hyperchunks.parse.cache_size = size
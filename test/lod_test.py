@@ -0,0 +1,45 @@
+import numpy
+import pytest
+import slycat.lod
+
+def test_quantize():
+  assert slycat.lod.quantize(numpy.array([0.0, 0.49, 0.5, 1.0]), 0, 1, 1).tolist() == [0, 0, 1, 1]
+  assert slycat.lod.quantize(numpy.array([3.0, 3.0]), 3, 3, 4).tolist() == [0, 0]
+
+def test_bins():
+  x = numpy.array([0.0, 1.0, 0.1, numpy.nan, 0.9, 0.2])
+  y = numpy.array([0.0, 1.0, 0.1, 0.5, 0.9, 0.9])
+  ids, counts, rows = slycat.lod.bins(x, y, [0, 1, 0, 1], 1)
+  assert ids.tolist() == [0, 1, 3]
+  assert counts.tolist() == [2, 1, 2]
+  assert rows.tolist() == [0, 5, 1]
+
+def test_pyramid_matches_bins():
+  generator = numpy.random.RandomState(1234)
+  x = generator.normal(size=1000)
+  y = generator.uniform(size=1000)
+  extent = [x.min(), x.max(), y.min(), y.max()]
+  levels = list(slycat.lod.pyramid(x, y, extent, 6))
+  assert [level for level, ids, counts, rows in levels] == [6, 5, 4, 3, 2, 1, 0]
+  for level, ids, counts, rows in levels:
+    expected = slycat.lod.bins(x, y, extent, level)
+    assert ids.tolist() == expected[0].tolist()
+    assert counts.tolist() == expected[1].tolist()
+    assert rows.tolist() == expected[2].tolist()
+    assert counts.sum() == 1000
+  assert levels[-1][3].tolist() == [0]
+
+def test_choose_level():
+  extent = [0, 100, 0, 100]
+  assert slycat.lod.choose_level(extent, extent, 1, 1) == 0
+  assert slycat.lod.choose_level(extent, extent, 500, 300) == 9
+  assert slycat.lod.choose_level(extent, [0, 10, 0, 100], 500, 300) == slycat.lod.max_level
+  assert slycat.lod.choose_level(extent, [0, 50, 0, 100], 256, 256) == 9
+
+def test_viewport_bins():
+  assert slycat.lod.viewport_bins([0, 1, 0, 1], [0, 1, 0, 1], 2) == ((0, 3), (0, 3))
+  assert slycat.lod.viewport_bins([0, 1, 0, 1], [0.3, 0.6, -5, 0.1], 2) == ((1, 2), (0, 0))
+
+def test_offsets():
+  ids = numpy.array([(0 << 2) | 1, (0 << 2) | 3, (2 << 2) | 0], dtype="int64")
+  assert slycat.lod.offsets(ids, 2).tolist() == [0, 2, 2, 3, 3]
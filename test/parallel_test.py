@@ -0,0 +1,46 @@
+import numpy
+import os
+import pytest
+import slycat.parallel
+import sys
+
+def add(a, b):
+  return a + b
+
+def row(index, count):
+  return numpy.arange(count) + index
+
+def remember(key):
+  cache = sys.modules["__main__"].cache
+  cache[key] = os.getpid()
+  return len(cache)
+
+@pytest.fixture
+def pool():
+  pool = slycat.parallel.create("multiprocessing", processes=2)
+  yield pool
+  pool.close()
+
+def test_map(pool):
+  assert pool.size == 2
+  assert pool.map(add, range(10), range(10, 20)) == [a + b for a, b in zip(range(10), range(10, 20))]
+  assert pool.map(add, [], []) == []
+
+def test_map_rows(pool):
+  result = pool.map_rows(row, (5, 3), "float64", range(5), [3] * 5)
+  assert type(result) is numpy.ndarray
+  assert result.dtype == numpy.float64
+  assert numpy.array_equal(result, numpy.arange(3)[None, :] + numpy.arange(5)[:, None])
+  assert not [name for name in os.listdir("/dev/shm" if os.path.isdir("/dev/shm") else "/tmp") if name.startswith("slycat-")]
+
+def test_map_rows_empty(pool):
+  assert pool.map_rows(row, (0, 3), "float64", [], []).shape == (0, 3)
+
+def test_namespace_persists():
+  with slycat.parallel.create("multiprocessing", processes=1, namespace={"cache": {}}) as pool:
+    assert pool.map(remember, ["a", "b", "c"]) == [1, 2, 3]
+    assert pool.map(remember, ["a"]) == [3]
+
+def test_unknown_backend():
+  with pytest.raises(ValueError):
+    slycat.parallel.create("mpi")
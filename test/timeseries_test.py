@@ -0,0 +1,54 @@
+import numpy
+import pytest
+import scipy.cluster.hierarchy
+import scipy.spatial.distance
+import slycat.timeseries
+
+def reference_exemplars(linkage, distances):
+  count = len(linkage) + 1
+  summed_distances = numpy.zeros(count)
+  membership = [set([i]) for i in range(count)]
+  exemplars = dict([(i, i) for i in range(count)])
+  for i, (left, right, height, size) in enumerate(linkage):
+    left, right = int(left), int(right)
+    membership.append(membership[left].union(membership[right]))
+    for a in membership[left]:
+      for b in membership[right]:
+        summed_distances[a] += distances[a, b]
+        summed_distances[b] += distances[b, a]
+    exemplars[count + i] = min(membership[count + i], key=lambda member: (summed_distances[member], member))
+  return exemplars
+
+@pytest.fixture
+def waveforms():
+  return numpy.random.RandomState(1234).normal(size=(50, 20)).cumsum(axis=1)
+
+@pytest.mark.parametrize("block_size,processes", [(1024, 1), (7, 1), (7, 3)])
+def test_distance_matrix(waveforms, block_size, processes):
+  distances = slycat.timeseries.distance_matrix(waveforms, block_size=block_size, processes=processes)
+  expected = scipy.spatial.distance.squareform(scipy.spatial.distance.pdist(waveforms))
+  numpy.testing.assert_allclose(distances, expected, atol=1e-12)
+  assert numpy.array_equal(distances, distances.T)
+  assert numpy.all(numpy.diag(distances) == 0)
+
+@pytest.mark.parametrize("method", ["single", "complete", "average", "weighted"])
+def test_exemplars(waveforms, method):
+  distances = slycat.timeseries.distance_matrix(waveforms)
+  linkage = scipy.cluster.hierarchy.linkage(scipy.spatial.distance.squareform(distances, checks=False), method=method)
+  assert slycat.timeseries.exemplars(linkage, distances) == reference_exemplars(linkage, distances)
+
+def test_exemplars_single_observation():
+  assert slycat.timeseries.exemplars(numpy.zeros((0, 4)), numpy.zeros((1, 1))) == {0: 0}
+
+def test_distance_matrix_duplicates():
+  waveforms = numpy.random.RandomState(1234).normal(size=(5, 100)).cumsum(axis=1) + 1e6
+  waveforms = numpy.vstack((waveforms, waveforms[2], waveforms[2] + 1e-9))
+  distances = slycat.timeseries.distance_matrix(waveforms, block_size=3)
+  assert distances[2, 5] == 0
+  numpy.testing.assert_allclose(distances, scipy.spatial.distance.squareform(scipy.spatial.distance.pdist(waveforms)), rtol=1e-9)
+
+def test_condensed_exemplars(waveforms):
+  distances = slycat.timeseries.distance_matrix(waveforms)
+  condensed = scipy.spatial.distance.squareform(distances, checks=False)
+  linkage = scipy.cluster.hierarchy.linkage(condensed, method="average")
+  assert slycat.timeseries.exemplars(linkage, condensed) == slycat.timeseries.exemplars(linkage, distances)
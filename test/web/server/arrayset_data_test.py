@@ -0,0 +1,36 @@
+import h5py
+import numpy
+import os
+import pytest
+import slycat.hdf5
+import slycat.web.server
+import slycat.web.server.hdf5
+
+@pytest.fixture
+def model(tmpdir, monkeypatch):
+  monkeypatch.setitem(slycat.web.server.config, "slycat-web-server", {})
+  monkeypatch.setattr(slycat.web.server.hdf5.path, "root", str(tmpdir))
+  monkeypatch.setattr(slycat.web.server.hdf5.pool, "instance", slycat.web.server.hdf5.HandlePool(size=4, idle_timeout=300))
+  array = "0123456789abcdef"
+  os.makedirs(os.path.dirname(slycat.web.server.hdf5.path(array)))
+  with h5py.File(slycat.web.server.hdf5.path(array), "w") as file:
+    arrayset = slycat.hdf5.start_arrayset(file)
+    darray = arrayset.start_array(0, [{"name": "row", "type": "int64", "begin": 0, "end": 5}], [{"name": "a", "type": "float64"}, {"name": "b", "type": "string"}])
+    darray.set_data(0, slice(None), numpy.array([4.0, 1.0, 2.0, 0.0, 3.0]))
+    darray.set_data(1, slice(None), numpy.array(["a", "b", "c", "d", "e"]))
+  yield {"_id": "model", "artifact:data": array}
+  slycat.web.server.hdf5.pool().clear()
+
+def values(model, hyperchunks):
+  return [numpy.asarray(value).tolist() for value in slycat.web.server.get_model_arrayset_data(None, model, "data", hyperchunks)]
+
+def test_slices(model):
+  assert values(model, "0/0|1/1:3") == [[1.0, 2.0], ["b", "c"]]
+
+def test_scalar_index(model):
+  assert values(model, "0/1/2") == ["c"]
+  assert values(model, "0/0|1/2") == [2.0, "c"]
+
+def test_scalar_index_sorted(model):
+  assert values(model, '0/1|0/order:rank(a0,"desc")/2') == ["c", 2.0]
+  assert values(model, '0/1/order:rank(a0,"asc")/0:2') == [["d", "b"]]
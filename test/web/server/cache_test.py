@@ -1,2 +1,39 @@
 import pytest
 import slycat.web.server.cache
+import numpy
+
+def test_result_cache_lru():
+  cache = slycat.web.server.cache.ResultCache(lambda f, *args: args, max_bytes=3 * 1024 * 1024)
+  cache.put("a", numpy.zeros(1024 * 1024, dtype="uint8"))
+  cache.put("b", numpy.zeros(1024 * 1024, dtype="uint8"))
+  assert cache.get("a") is not None
+  cache.put("c", numpy.zeros(1024 * 1024, dtype="uint8"))
+  assert "a" in cache
+  assert "b" not in cache
+  assert "c" in cache
+  assert cache.size <= cache.max_bytes
+
+def test_result_cache_too_large():
+  cache = slycat.web.server.cache.ResultCache(lambda f, *args: args, max_bytes=1024)
+  cache.put("a", numpy.zeros(2048, dtype="uint8"))
+  assert "a" not in cache
+  assert cache.size == 0
+
+def test_result_cache_decorator():
+  cache = slycat.web.server.cache.ResultCache(lambda f, version, query: (f.__name__, version, query), max_bytes=1024 * 1024)
+  calls = []
+
+  @cache
+  def query(version, query):
+    calls.append((version, query))
+    return numpy.arange(10)
+
+  query(0, "0/0/...")
+  query(0, "0/0/...")
+  assert len(calls) == 1
+  query(1, "0/0/...")
+  assert len(calls) == 2
+
+  cache.invalidate(lambda key: key[1] == 0)
+  assert ("query", 0, "0/0/...") not in cache
+  assert ("query", 1, "0/0/...") in cache
@@ -0,0 +1,88 @@
+import pytest
+import Queue
+import threading
+import time
+import couchdb.client
+import slycat.web.server.database.couchdb as database
+
+class StandIn(object):
+  """In-process stand-in for a couchdb.client.Database, with a changes feed fed by writes."""
+  def __init__(self):
+    self.documents = {}
+    self.fetches = 0
+    self.feed = Queue.Queue()
+    self.sequence = 0
+
+  def __getitem__(self, id):
+    self.fetches += 1
+    if id not in self.documents:
+      raise couchdb.client.http.ResourceNotFound()
+    return dict(self.documents[id])
+
+  def save(self, document):
+    self.sequence += 1
+    document["_rev"] = str(self.sequence)
+    self.documents[document["_id"]] = dict(document)
+    self.feed.put({"seq": self.sequence, "id": document["_id"]})
+    return document["_id"], document["_rev"]
+
+  def changes(self, **keywords):
+    if keywords.get("feed") != "continuous":
+      return {"last_seq": self.sequence, "results": []}
+    def feed():
+      while True:
+        yield self.feed.get()
+    return feed()
+
+def follow(standin, size=10):
+  cache = database.DocumentCache(size=size)
+  thread = threading.Thread(target=cache.follow, args=(standin,))
+  thread.daemon = True
+  thread.start()
+  while not cache.following:
+    time.sleep(0.01)
+  return cache
+
+def test_get_is_cached():
+  standin = StandIn()
+  standin.documents["m"] = {"_id": "m", "type": "model", "name": "a"}
+  db = database.Database(standin, follow(standin))
+  assert db.get("model", "m")["name"] == "a"
+  assert db.get("model", "m")["name"] == "a"
+  assert standin.fetches == 1
+
+def test_copies_are_returned():
+  standin = StandIn()
+  standin.documents["m"] = {"_id": "m", "type": "model", "name": "a"}
+  db = database.Database(standin, follow(standin))
+  db.get("model", "m")["name"] = "b"
+  assert db.get("model", "m")["name"] == "a"
+
+def test_changes_invalidate():
+  standin = StandIn()
+  standin.documents["m"] = {"_id": "m", "type": "model", "name": "a"}
+  cache = follow(standin)
+  db = database.Database(standin, cache)
+  db.get("model", "m")
+  # Simulate a write from another process.
+  standin.save({"_id": "m", "type": "model", "name": "b"})
+  while "m" in cache._documents:
+    time.sleep(0.01)
+  assert db.get("model", "m")["name"] == "b"
+
+def test_save_invalidates():
+  standin = StandIn()
+  standin.documents["m"] = {"_id": "m", "type": "model", "name": "a"}
+  db = database.Database(standin, follow(standin))
+  model = db.get("model", "m")
+  model["name"] = "b"
+  db.save(model)
+  assert db.get("model", "m")["name"] == "b"
+
+def test_not_cached_without_feed():
+  standin = StandIn()
+  standin.documents["m"] = {"_id": "m", "type": "model", "name": "a"}
+  db = database.Database(standin, database.DocumentCache())
+  db.get("model", "m")
+  db.get("model", "m")
+  assert standin.fetches == 2
@@ -0,0 +1,127 @@
+import imp
+import os
+import pytest
+import StringIO
+import numpy
+import slycat.web.server
+
+parser = imp.load_source("slycat_csv_parser", os.path.join(os.path.dirname(__file__), "..", "..", "..", "web-server", "plugins", "slycat-csv-parser.py"))
+
+class Database(object):
+  def __init__(self):
+    self.saved = []
+
+  def save(self, model):
+    self.saved.append(dict(model))
+
+class Storage(object):
+  """Stands in for the arrayset storage, recording what the parser writes."""
+  def __init__(self):
+    self.attempts = 0
+    self.attributes = None
+    self.dimensions = None
+    self.hyperchunks = None
+    self.data = None
+
+  def put_model_arrayset(self, database, model, aid, input=False):
+    pass
+
+  def put_model_array(self, database, model, aid, array_index, attributes, dimensions):
+    self.attempts += 1
+    self.attributes = [dict(attribute) for attribute in attributes]
+    self.dimensions = dimensions
+
+  def put_model_arrayset_data(self, database, model, aid, hyperchunks, data):
+    self.hyperchunks = hyperchunks
+    self.data = [column.tolist() for column in data]
+
+@pytest.fixture
+def storage(monkeypatch):
+  storage = Storage()
+  monkeypatch.setattr(slycat.web.server, "put_model_arrayset", storage.put_model_arrayset)
+  monkeypatch.setattr(slycat.web.server, "put_model_array", storage.put_model_array)
+  monkeypatch.setattr(slycat.web.server, "put_model_arrayset_data", storage.put_model_arrayset_data)
+  return storage
+
+def parse(text):
+  parser.parse(Database(), {}, True, [StringIO.StringIO(text)], ["data-table"])
+
+def assert_columns(actual, expected):
+  assert len(actual) == len(expected)
+  for a, b in zip(actual, expected):
+    numpy.testing.assert_array_equal(numpy.array(a, dtype=numpy.array(b).dtype), b)
+
+def test_type_inference(storage):
+  parse("a,b,c\n1,x,2.5\n2,y,-3e2\n")
+  assert storage.attributes == [{"name": "a", "type": "float64"}, {"name": "b", "type": "string"}, {"name": "c", "type": "float64"}]
+  assert storage.dimensions == [{"name": "row", "type": "int64", "begin": 0, "end": 2}]
+  assert_columns(storage.data, [[1.0, 2.0], ["x", "y"], [2.5, -300.0]])
+
+def test_blank_cells_are_nan(storage):
+  parse("a,b\n1,x\n,y\n3,\n")
+  assert [attribute["type"] for attribute in storage.attributes] == ["float64", "string"]
+  assert_columns(storage.data, [[1.0, numpy.nan, 3.0], ["x", "y", ""]])
+
+def test_blocks(storage, monkeypatch):
+  monkeypatch.setattr(parser, "block_cells", 4)
+  parse("a,b\n1,x\n2,y\n3,z\n4,w\n5,v\n")
+  assert storage.hyperchunks == "0/.../0:2;0/.../2:4;0/.../4:5"
+  assert_columns(storage.data, [[1.0, 2.0], ["x", "y"], [3.0, 4.0], ["z", "w"], [5.0], ["v"]])
+
+def test_type_inferred_from_later_block(storage, monkeypatch):
+  monkeypatch.setattr(parser, "block_cells", 6)
+  parse("a,b,c\n1,,\n2,,\n3,4,x\n")
+  assert [attribute["type"] for attribute in storage.attributes] == ["float64", "float64", "string"]
+  assert storage.attempts == 1
+  assert_columns(storage.data, [[1.0, 2.0], [numpy.nan, numpy.nan], ["", ""], [3.0], [4.0], ["x"]])
+
+def test_empty_column_is_string(storage):
+  parse("a,b\n1,\n2,\n")
+  assert [attribute["type"] for attribute in storage.attributes] == ["float64", "string"]
+
+def test_promotion_restarts(storage, monkeypatch):
+  monkeypatch.setattr(parser, "block_cells", 4)
+  parse("a,b\n1,x\n2,y\nthree,z\n")
+  assert storage.attempts == 2
+  assert [attribute["type"] for attribute in storage.attributes] == ["string", "string"]
+  assert_columns(storage.data, [["1", "2"], ["x", "y"], ["three"], ["z"]])
+
+def test_promotion_raised_by_parse_blocks():
+  attributes = [{"name": "a", "type": "float64"}]
+  dimensions = [{"name": "row", "type": "int64", "begin": 0, "end": 2}]
+  blocks = parser.parse_blocks(Database(), {}, StringIO.StringIO("a\n1\nx\n"), attributes, dimensions, 1)
+  assert next(blocks).tolist() == [1.0]
+  with pytest.raises(parser._Promotion):
+    next(blocks)
+  assert attributes == [{"name": "a", "type": "string"}]
+
+def test_ragged_rows(storage):
+  parse("a,b,c\n1,2\n3,4,5,6\n\n7,8,9\n")
+  assert storage.dimensions[0]["end"] == 3
+  assert_columns(storage.data, [[1.0, 3.0, 7.0], [2.0, 4.0, 8.0], [numpy.nan, 5.0, 9.0]])
+
+def test_line_endings(storage):
+  parse("a,b\r1,x\r2,y\r")
+  assert_columns(storage.data, [[1.0, 2.0], ["x", "y"]])
+  parse("a,b\r\n1,x\r\n2,y")
+  assert_columns(storage.data, [[1.0, 2.0], ["x", "y"]])
+
+def test_lines_split_across_blocks():
+  assert list(parser._lines(StringIO.StringIO("a,b\r\n1,x\r2,y\n"), block_size=4)) == ["a,b", "1,x", "2,y"]
+  assert list(parser._lines(StringIO.StringIO("a\r\r\nb"), block_size=2)) == ["a", "", "b"]
+
+def test_progress(storage):
+  database = Database()
+  model = {}
+  parser.parse(database, model, True, ["a\n1\n2\n"], ["data-table"])
+  assert database.saved[0]["progress"] == 1.0
+  assert database.saved[0]["message"] == "Parsed 2 of 2 rows."
+  assert "db_creation_time" in model
+
+def test_no_data_rows(storage):
+  with pytest.raises(Exception) as e:
+    parse("a,b\n")
+  assert "at least two rows" in str(e.value)
+  with pytest.raises(Exception) as e:
+    parse("")
+  assert "at least one column" in str(e.value)
@@ -1,2 +1,336 @@
+import cherrypy
+import cherrypy._cprequest
+import json
+import os
+import paramiko
 import pytest
+import StringIO
+import threading
+import zlib
 import slycat.web.server.remote
+
+def start_agent(agent):
+  """Run a fake agent on a thread, returning the caller's ends of its stdin and stdout."""
+  agent_stdin, caller_stdin = os.pipe()
+  caller_stdout, agent_stdout = os.pipe()
+  thread = threading.Thread(target=agent, args=(os.fdopen(agent_stdin, "r"), os.fdopen(agent_stdout, "w")))
+  thread.daemon = True
+  thread.start()
+  return os.fdopen(caller_stdin, "w"), os.fdopen(caller_stdout, "r"), None
+
+def legacy_agent(stdin, stdout):
+  for line in iter(stdin.readline, ""):
+    command = json.loads(line)
+    if command["action"] == "get-file":
+      stdout.write("%s\n%s" % (json.dumps({"ok": True, "size": 5}), "hello"))
+    elif command["action"] == "browse":
+      stdout.write("%s\n" % json.dumps({"ok": True, "path": command["path"]}))
+    else:
+      stdout.write("%s\n" % json.dumps({"ok": False, "message": "Unknown command."}))
+    stdout.flush()
+
+def multiplexed_agent(stdin, stdout):
+  assert json.loads(stdin.readline()) == {"action": "multiplex"}
+  stdout.write("%s\n" % json.dumps({"ok": True, "message": "Multiplexing.", "protocol": 2, "workers": 2}))
+  stdout.flush()
+  # Respond to each pair of commands in reverse order.
+  while True:
+    commands = [json.loads(stdin.readline()), json.loads(stdin.readline())]
+    for command in reversed(commands):
+      if command["action"] == "exit":
+        return
+      content = "%s\n%s" % (json.dumps({"ok": True, "path": command["path"], "size": len(command["path"])}), command["path"])
+      stdout.write("%s\n%s" % (json.dumps({"id": command["id"], "size": len(content)}), content))
+      stdout.flush()
+
+def failing_agent(stdin, stdout):
+  stdin.readline()
+  stdout.write("%s\n" % json.dumps({"ok": True, "message": "Multiplexing.", "protocol": 2, "workers": 2}))
+  stdout.flush()
+  stdin.readline()
+  stdout.close()
+
+def test_legacy_agent():
+  channel = slycat.web.server.remote._agent_channel(*start_agent(legacy_agent))
+  assert not channel.concurrent
+  assert channel.request({"action": "browse", "path": "/home"}) == {"ok": True, "path": "/home"}
+  assert channel.request({"action": "get-file", "path": "/home/a"}, content=True) == ({"ok": True, "size": 5}, "hello")
+  assert channel.request({"action": "browse", "path": "/tmp"}) == {"ok": True, "path": "/tmp"}
+
+def test_multiplexed_agent():
+  channel = slycat.web.server.remote._agent_channel(*start_agent(multiplexed_agent))
+  assert channel.concurrent
+
+  results = {}
+  def request(path):
+    results[path] = channel.request({"action": "get-file", "path": path}, content=True)
+  threads = [threading.Thread(target=request, args=(path,)) for path in ["/a", "/bb"]]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join(10)
+
+  assert results == {"/a": ({"ok": True, "path": "/a", "size": 2}, "/a"), "/bb": ({"ok": True, "path": "/bb", "size": 3}, "/bb")}
+
+def test_multiplexed_agent_failure():
+  channel = slycat.web.server.remote._agent_channel(*start_agent(failing_agent))
+  with pytest.raises(IOError):
+    channel.request({"action": "browse", "path": "/home"})
+  with pytest.raises(IOError):
+    channel.request({"action": "browse", "path": "/home"})
+
+def encode_chunk(offset, data, encoding="identity", checksum=None):
+  encoded = zlib.compress(data) if encoding == "zlib" else data
+  checksum = zlib.crc32(data) & 0xffffffff if checksum is None else checksum
+  return "%s\n%s" % (json.dumps({"offset": offset, "size": len(encoded), "encoding": encoding, "crc32": checksum}), encoded)
+
+def test_decode_chunks():
+  data = encode_chunk(10, "hello ") + encode_chunk(16, "world\n" * 10, "zlib")
+  assert slycat.web.server.remote._decode_chunks(10, data) == "hello " + "world\n" * 10
+  assert slycat.web.server.remote._decode_chunks(0, "") == ""
+
+def test_decode_corrupted_chunks():
+  with pytest.raises(IOError):
+    slycat.web.server.remote._decode_chunks(0, encode_chunk(0, "hello", checksum=0))
+  with pytest.raises(IOError):
+    slycat.web.server.remote._decode_chunks(0, encode_chunk(5, "hello"))
+  with pytest.raises(IOError):
+    slycat.web.server.remote._decode_chunks(0, encode_chunk(0, "hello")[:-1])
+
+class FileAgent(object):
+  """Serves a file in chunks, sending at most `limit` bytes per command like a real agent."""
+  concurrent = False
+
+  def __init__(self, content, limit):
+    self.content = content
+    self.limit = limit
+    self.commands = []
+
+  def request(self, command, content=False):
+    self.commands.append(command)
+    begin = command["offset"]
+    end = begin + min(command["length"], self.limit)
+    data = "".join(encode_chunk(offset, self.content[offset:min(offset + command["chunk-size"], end)]) for offset in range(begin, min(end, len(self.content)), command["chunk-size"]))
+    return {"ok": True, "message": "File retrieved.", "content-type": "text/plain", "file-size": len(self.content), "chunks": 0, "size": len(data)}, data
+
+def test_get_file_pages_through_agent(monkeypatch):
+  monkeypatch.setattr(slycat.web.server.remote, "agent_chunk_size", 4)
+  monkeypatch.setattr(slycat.web.server.remote, "agent_range_length", 10)
+  agent = FileAgent("".join(str(i % 10) for i in range(45)), limit=8)
+  session = slycat.web.server.remote.Session("127.0.0.1", "user", "host", None, None, agent)
+  cherrypy.serving.response = cherrypy._cprequest.Response()
+
+  assert session.get_file("/a.csv") == agent.content
+  assert all(command["length"] <= 10 for command in agent.commands)
+  assert [command["offset"] for command in agent.commands] == [0, 0, 8, 16, 24, 32, 40]
+
+class ImageAgent(object):
+  concurrent = False
+
+  def __init__(self):
+    self.commands = []
+
+  def request(self, command, content=False):
+    self.commands.append(command)
+    metadata = {"ok": True, "path": command["path"], "content-type": "image/png", "etag": "abc", "mtime": 0}
+    if command.get("etag") == "abc":
+      return dict(metadata, message="Image not modified.", size=0), ""
+    return dict(metadata, message="Image retrieved.", size=5), "image"
+
+def test_get_image_revalidates_cached_images():
+  slycat.web.server.remote.thumbnail_cache.clear()
+  agent = ImageAgent()
+  session = slycat.web.server.remote.Session("127.0.0.1", "user", "host", None, None, agent)
+  cherrypy.serving.response = cherrypy._cprequest.Response()
+
+  assert session.get_image("/a.png", **{"max-size": 100}) == "image"
+  assert session.get_image("/a.png", **{"max-size": 100}) == "image"
+  assert "etag" not in agent.commands[0]
+  assert agent.commands[1]["etag"] == "abc"
+  assert cherrypy.response.headers["etag"] == '"abc"'
+
+  # Browsers with a current copy get a 304.
+  cherrypy.serving.response = cherrypy._cprequest.Response()
+  cherrypy.request.headers["if-none-match"] = '"abc"'
+  try:
+    with pytest.raises(cherrypy.HTTPRedirect):
+      session.get_image("/a.png", **{"max-size": 100})
+  finally:
+    del cherrypy.request.headers["if-none-match"]
+
+class FakeTransport(object):
+  def __init__(self):
+    self.active = True
+
+  def is_active(self):
+    return self.active
+
+  def send_ignore(self):
+    pass
+
+class FakeSSH(object):
+  def __init__(self):
+    self.transport = FakeTransport()
+
+  def get_transport(self):
+    return self.transport
+
+  def exec_command(self, command):
+    return None, StringIO.StringIO(""), None
+
+  def close(self):
+    self.transport.active = False
+
+@pytest.fixture
+def connections(monkeypatch):
+  created = []
+  def ssh_connect(hostname=None, username=None, password=None):
+    created.append(FakeSSH())
+    return created[-1]
+  monkeypatch.setattr(slycat.web.server, "ssh_connect", ssh_connect)
+  monkeypatch.setitem(slycat.web.server.config, "slycat-web-server", {"remote-authentication": {"method": "password"}})
+  monkeypatch.setattr(slycat.web.server.remote, "connection_pool", {})
+  return created
+
+def test_connections_are_shared(connections):
+  first = slycat.web.server.remote._acquire_connection("host", "user", "secret")
+  second = slycat.web.server.remote._acquire_connection("host", "user", "secret")
+  assert first is second
+  assert len(connections) == 1
+
+  # Callers must supply the same credentials to share a connection.
+  assert slycat.web.server.remote._acquire_connection("host", "user", "wrong") is not first
+  assert slycat.web.server.remote._acquire_connection("other", "user", "secret") is not first
+  assert len(connections) == 3
+
+def test_connection_session_limit(connections, monkeypatch):
+  monkeypatch.setattr(slycat.web.server.remote, "max_sessions_per_connection", 2)
+  ssh = [slycat.web.server.remote._acquire_connection("host", "user", "secret") for i in range(3)]
+  assert ssh[0] is ssh[1]
+  assert ssh[2] is not ssh[0]
+  slycat.web.server.remote._release_connection(ssh[0])
+  assert slycat.web.server.remote._acquire_connection("host", "user", "secret") is ssh[0]
+
+def test_failed_connections_are_replaced(connections):
+  first = slycat.web.server.remote._acquire_connection("host", "user", "secret")
+  first.transport.active = False
+  assert slycat.web.server.remote._acquire_connection("host", "user", "secret") is not first
+  slycat.web.server.remote._release_connection(first)
+  assert len(slycat.web.server.remote.connection_pool[slycat.web.server.remote._connection_key("host", "user", "secret")]) == 1
+
+def test_idle_connections_are_closed(connections, monkeypatch):
+  ssh = slycat.web.server.remote._acquire_connection("host", "user", "secret")
+  slycat.web.server.remote._release_connection(ssh)
+  slycat.web.server.remote._check_connections()
+  assert ssh.transport.active
+  monkeypatch.setattr(slycat.web.server.remote, "connection_idle_timeout", -1)
+  slycat.web.server.remote._check_connections()
+  assert not ssh.transport.active
+  assert slycat.web.server.remote.connection_pool == {}
+
+def test_connections_failing_keepalive_are_closed(connections, monkeypatch):
+  def send_ignore():
+    raise EOFError("connection reset")
+  errors = []
+  monkeypatch.setattr(cherrypy.log, "error", lambda message, *args, **kwargs: errors.append(message))
+  ssh = slycat.web.server.remote._acquire_connection("host", "user", "secret")
+  slycat.web.server.remote._release_connection(ssh)
+  ssh.transport.send_ignore = send_ignore
+  slycat.web.server.remote._check_connections()
+  assert not ssh.transport.active
+  assert slycat.web.server.remote.connection_pool == {}
+  assert "connection reset" in errors[-1]
+
+def test_connections_checked_within_idle_timeout():
+  assert slycat.web.server.remote.connection_check_interval < slycat.web.server.remote.connection_idle_timeout
+
+class BrowseAgent(object):
+  concurrent = False
+
+  def __init__(self, names):
+    self.names = names
+    self.mtime = 1
+    self.requests = 0
+
+  def request(self, command, content=False):
+    if command.get("mtime") == self.mtime:
+      return {"ok": True, "message": "Directory not modified.", "path": command["path"], "mtime": self.mtime}
+    self.requests += 1
+    return {"ok": True, "path": command["path"], "mtime": self.mtime, "names": self.names, "sizes": [len(name) for name in self.names],
+      "types": ["d" if name.startswith("d") else "f" for name in self.names], "mtimes": ["2017-01-01T00:00:00"] * len(self.names),
+      "mime-types": [None] * len(self.names)}
+
+class BrowseSFTP(object):
+  def __init__(self, names):
+    self.names = names
+    self.mtime = 1
+    self.requests = 0
+
+  def stat(self, path):
+    attributes = paramiko.SFTPAttributes()
+    attributes.st_mtime = self.mtime
+    return attributes
+
+  def listdir_attr(self, path):
+    self.requests += 1
+    attributes = []
+    for name in self.names:
+      attributes.append(paramiko.SFTPAttributes())
+      attributes[-1].filename = name
+      attributes[-1].st_mode = 0o100644
+      attributes[-1].st_size = len(name)
+      attributes[-1].st_mtime = 0
+    return attributes
+
+def test_browse_pages():
+  slycat.web.server.remote.listing_cache.clear()
+  agent = BrowseAgent(["a", "bbb", "cc", "dir"])
+  session = slycat.web.server.remote.Session("127.0.0.1", "user", "host", None, None, agent)
+
+  with session:
+    first = session.browse("/home", None, None, None, None, sort="size", limit=3)
+    assert first["names"] == ["a", "cc", "bbb"]
+    assert first["total"] == 4
+    second = session.browse("/home", None, None, None, None, sort="size", limit=3, token=first["token"])
+    assert second["names"] == ["dir"]
+    assert second["token"] is None
+    assert session.browse("/home", None, None, None, None, sort="type")["names"] == ["dir", "a", "bbb", "cc"]
+    assert "token" not in session.browse("/home", None, None, None, None, reverse=True)
+  assert agent.requests == 1
+
+  with pytest.raises(cherrypy.HTTPError):
+    session.browse("/home", None, None, None, None, sort="color")
+  with pytest.raises(cherrypy.HTTPError):
+    session.browse("/home", None, None, None, None, token="-1")
+
+def test_browse_cache_revalidation(monkeypatch):
+  slycat.web.server.remote.listing_cache.clear()
+  agent = BrowseAgent(["a"])
+  # Listings are revalidated by the agent, without using sftp.
+  session = slycat.web.server.remote.Session("127.0.0.1", "user", "host", None, None, agent)
+
+  with session:
+    session.browse("/home", None, None, None, None)
+    assert session.browse("/home", None, None, None, None)["names"] == ["a"]
+    assert agent.requests == 1
+    # Modifying the directory invalidates its listing.
+    agent.mtime = 2
+    session.browse("/home", None, None, None, None)
+    assert agent.requests == 2
+    # So does time.
+    monkeypatch.setattr(slycat.web.server.remote, "listing_cache_lifetime", -1)
+    session.browse("/home", None, None, None, None)
+    assert agent.requests == 3
+
+def test_browse_cache_revalidation_with_sftp():
+  slycat.web.server.remote.listing_cache.clear()
+  sftp = BrowseSFTP(["a"])
+  session = slycat.web.server.remote.Session("127.0.0.1", "user", "host", None, sftp, None)
+
+  with session:
+    session.browse("/home", None, None, None, None)
+    assert session.browse("/home", None, None, None, None)["names"] == ["a"]
+    assert sftp.requests == 1
+    sftp.mtime = 2
+    session.browse("/home", None, None, None, None)
+    assert sftp.requests == 2
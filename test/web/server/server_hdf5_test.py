@@ -0,0 +1,80 @@
+import pytest
+import threading
+import time
+import slycat.web.server.hdf5 as hdf5
+
+def test_readers_share_lock():
+  lock = hdf5.ReadWriteLock()
+  entered = []
+  def read():
+    with lock.reader():
+      entered.append(True)
+      time.sleep(0.1)
+  threads = [threading.Thread(target=read) for i in range(4)]
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  assert len(entered) == 4
+  assert time.time() - start < 0.35
+
+def test_writer_excludes_readers():
+  lock = hdf5.ReadWriteLock()
+  events = []
+  def write():
+    with lock.writer():
+      events.append("write-begin")
+      time.sleep(0.1)
+      events.append("write-end")
+  def read():
+    with lock.reader():
+      events.append("read")
+  writer = threading.Thread(target=write)
+  writer.start()
+  time.sleep(0.02)
+  reader = threading.Thread(target=read)
+  reader.start()
+  writer.join()
+  reader.join()
+  assert events == ["write-begin", "write-end", "read"]
+
+def test_writer_is_reentrant():
+  lock = hdf5.ReadWriteLock()
+  with lock.writer():
+    with lock.writer():
+      with lock.reader():
+        pass
+  with lock.writer():
+    pass
+
+def test_upgrade_is_refused():
+  lock = hdf5.ReadWriteLock()
+  with lock.reader():
+    with pytest.raises(RuntimeError):
+      lock.acquire_write()
+
+def test_manager_shares_locks_per_array():
+  manager = hdf5.LockManager()
+  first = manager.get("abc")
+  assert manager.get("abc") is first
+  assert manager.get("def") is not first
+
+def test_pool_reuses_read_handles(tmpdir):
+  import h5py
+  hdf5.path.root = str(tmpdir)
+  array = "0123456789abcdef"
+  array_path = hdf5.path(array)
+  tmpdir.mkdir(array[0:2]).mkdir(array[2:4]).mkdir(array[4:6])
+  h5py.File(array_path, mode="w").close()
+
+  pool = hdf5.HandlePool(size=2)
+  with pool.acquire(array) as first:
+    pass
+  with pool.acquire(array) as second:
+    assert second is first
+  with pool.acquire(array, "r+") as third:
+    assert third is not first
+    assert third.mode == "r+"
+  pool.invalidate(array)
+  assert not third.id.valid
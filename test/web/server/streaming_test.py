@@ -1,2 +1,32 @@
 import pytest
 import slycat.web.server.streaming
+import cherrypy
+import StringIO
+
+def serve(byte_range=None, size=100):
+  cherrypy.request.headers = {} if byte_range is None else {"range": byte_range}
+  cherrypy.response.headers = {}
+  stream = StringIO.StringIO("".join(chr(i) for i in range(size)))
+  content = "".join(slycat.web.server.streaming.serve(stream, size, "application/octet-stream", chunk_size=16))
+  return cherrypy.response.status, cherrypy.response.headers, content
+
+def test_serve_all():
+  status, headers, content = serve()
+  assert status == "200"
+  assert headers["content-length"] == "100"
+  assert len(content) == 100
+
+def test_serve_range():
+  status, headers, content = serve("bytes=10-49")
+  assert status == "206"
+  assert headers["content-range"] == "bytes 10-49/100"
+  assert content == "".join(chr(i) for i in range(10, 50))
+
+def test_serve_suffix_range():
+  status, headers, content = serve("bytes=-10")
+  assert headers["content-range"] == "bytes 90-99/100"
+  assert len(content) == 10
+
+def test_serve_unsatisfiable_range():
+  with pytest.raises(cherrypy.HTTPError):
+    serve("bytes=200-300")
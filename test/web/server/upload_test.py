@@ -1,2 +1,29 @@
 import pytest
+import StringIO
 import slycat.web.server.upload
+
+@pytest.fixture
+def session(tmpdir):
+  slycat.web.server.upload.root.path = str(tmpdir)
+  return slycat.web.server.upload.Session("uid", "client", "mid", True, "parser", ["aid"], {})
+
+def assembled(session, fid):
+  with open(slycat.web.server.upload.assembled_path(session._uid, fid), "rb") as file:
+    return file.read()
+
+def test_parts_assembled_in_order(session):
+  session.put_upload_file_part(0, 2, "ghi")
+  session.put_upload_file_part(0, 0, "abc")
+  assert assembled(session, 0) == "abc"
+  session.put_upload_file_part(0, 1, StringIO.StringIO("def"))
+  assert assembled(session, 0) == "abcdefghi"
+
+def test_status(session):
+  session.put_upload_file_part(1, 0, "abc")
+  session.put_upload_file_part(0, 1, "def")
+  assert session.get_upload_status() == {"received": [[0, 1], [1, 0]], "finished": False}
+
+def test_resend_ignored(session):
+  session.put_upload_file_part(0, 0, "abc")
+  session.put_upload_file_part(0, 0, "abc")
+  assert assembled(session, 0) == "abc"
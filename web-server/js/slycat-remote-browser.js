@@ -26,6 +26,11 @@ define("slycat-remote-browser", ["slycat-server-root", "slycat-web-client", "kno
       component.browser_updating = ko.observable(false);
       component.progress = params.progress != undefined ? params.progress : ko.observable(undefined);
       component.progress_status = params.progress_status != undefined ? params.progress_status : ko.observable('');
+      // Large directories are retrieved a page at a time.
+      component.page_size = 1000;
+      component.token = ko.observable(null);
+      component.total = ko.observable(0);
+      component.loading_more = ko.observable(false);
 
       component.icon_map = {
         "application/x-directory" : "<span class='fa fa-folder-o'></span>",
@@ -140,6 +145,7 @@ define("slycat-remote-browser", ["slycat-server-root", "slycat-web-client", "kno
         {
           hostname : component.hostname(),
           path : path,
+          limit : component.page_size,
           success : function(results)
           {
             component.browse_error(false);
@@ -157,6 +163,8 @@ define("slycat-remote-browser", ["slycat-server-root", "slycat-web-client", "kno
             for(var i = 0; i != results.names.length; ++i)
               files.push({name:results.names[i], size:results.sizes[i], type:results.types[i], mtime:results.mtimes[i], mime_type:results["mime-types"][i]});
             mapping.fromJS(files, component.raw_files);
+            component.token(results.token === undefined ? null : results.token);
+            component.total(results.total === undefined ? results.names.length : results.total);
             component.browser_updating(false);
           },
           error : function(results)
@@ -170,6 +178,39 @@ define("slycat-remote-browser", ["slycat-server-root", "slycat-web-client", "kno
         });
       }
 
+      component.browse_more = function()
+      {
+        if(component.token() === null || component.loading_more())
+          return;
+        var path = component.path();
+        component.loading_more(true);
+        client.post_remote_browse(
+        {
+          hostname : component.hostname(),
+          path : path,
+          limit : component.page_size,
+          token : component.token(),
+          success : function(results)
+          {
+            component.loading_more(false);
+            // Ignore pages that arrive after the user has moved elsewhere.
+            if(path != component.path())
+              return;
+            var files = [];
+            for(var i = 0; i != results.names.length; ++i)
+              files.push(mapping.fromJS({name:results.names[i], size:results.sizes[i], type:results.types[i], mtime:results.mtimes[i], mime_type:results["mime-types"][i]}));
+            ko.utils.arrayPushAll(component.raw_files, files);
+            component.token(results.token);
+            component.total(results.total);
+          },
+          error : function(results)
+          {
+            component.loading_more(false);
+            component.browse_error(true);
+          }
+        });
+      }
+
       component.browse_path = function(formElement)
       {
         component.browse(component.path_input());
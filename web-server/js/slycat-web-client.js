@@ -373,6 +373,38 @@ define("slycat-web-client", ["slycat-server-root", "jquery", "URI"], function(se
     });
   };
 
+  module.post_model_arrayset_downsample = function(params)
+  {
+    var parameters = {x: params.x, y: params.y, width: params.width, height: params.height};
+    if(params.viewport)
+      parameters.viewport = params.viewport;
+    if(params.filters)
+      parameters.filters = params.filters;
+    if(params.selection)
+      parameters.selection = params.selection;
+    if(params.columns)
+      parameters.columns = params.columns;
+
+    $.ajax(
+    {
+      contentType: "application/json",
+      dataType: "json",
+      type: "POST",
+      url: server_root + "models/" + params.mid + "/arraysets/" + params.aid + "/arrays/" + (params.array || "0") + "/downsample",
+      data: JSON.stringify(parameters),
+      success: function(result)
+      {
+        if(params.success)
+          params.success(result);
+      },
+      error: function(request, status, reason_phrase)
+      {
+        if(params.error)
+          params.error(request, status, reason_phrase);
+      },
+    });
+  };
+
   module.get_model_command = function(params)
   {
     $.ajax(
@@ -991,12 +1023,20 @@ define("slycat-web-client", ["slycat-server-root", "jquery", "URI"], function(se
 
   module.post_remote_browse = function(params)
   {
+    var data = {};
+    if(params.sort !== undefined)
+      data.sort = params.sort;
+    if(params.reverse !== undefined)
+      data.reverse = params.reverse;
+    if(params.limit !== undefined)
+      data.limit = params.limit;
+    if(params.token !== undefined)
+      data.token = params.token;
+
     $.ajax(
     {
       contentType: "application/json",
-      data: JSON.stringify(
-      {
-      }),
+      data: JSON.stringify(data),
       type: "POST",
       url: server_root + "remotes/" + params.hostname + "/browse" + params.path,
       success: function(result)
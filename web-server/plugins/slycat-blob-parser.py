@@ -13,5 +13,5 @@ def parse(database, model, input, files, aids, **kwargs):
     slycat.web.server.put_model_file(database, model, aid, file, content_type, input)
 
 def register_slycat_plugin(context):
-  context.register_parser("slycat-blob-parser", "Binary Files", [], parse)
+  context.register_parser("slycat-blob-parser", "Binary Files", [], parse, streaming=True)
 
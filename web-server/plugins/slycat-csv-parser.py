@@ -1,73 +1,177 @@
 import csv
+import itertools
 import time
 import numpy
 import slycat.email
 import slycat.web.server
+import StringIO
 
+# Upper bound on the number of cells held in memory at once while parsing.
+block_cells = 1000000
 
-def parse_file(file):
+
+class _Promotion(Exception):
     """
-  parses out a csv file into numpy array by column (data), the dimension meta data(dimensions),
-  and sets attributes (attributes)
-  :param file: csv file to be parsed
-  :returns: attributes, dimensions, data
+  raised when a column inferred to be float64 turns out to contain a value
+  that isn't a number, after the column's type has been updated to string
   """
-    import cherrypy
-    def isfloat(value):
-        try:
-            float(value)
-            return True
-        except ValueError:
-            return False
+    pass
+
+
+def _lines(file, block_size=1024 * 1024):
+    """
+  iterates over the lines of a csv file a block at a time, accepting CRLF,
+  CR-only (written by Excel for Mac) and LF line endings, like str.splitlines()
+  :param file: csv file, as a file-like object
+  :returns: iterator over lines, without their line endings
+  """
+    pending = ""
+    for block in iter(lambda: file.read(block_size), ""):
+        lines = (pending + block).splitlines(True)
+        # The last line may be incomplete, or end with a CR whose LF is in the next block.
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r\n")
+    if pending:
+        yield pending.rstrip("\r\n")
+
+
+def _reader(file):
+    return csv.reader(_lines(file), delimiter=",", doublequote=True, escapechar=None, quotechar='"',
+                      quoting=csv.QUOTE_MINIMAL, skipinitialspace=True)
 
+
+def _rows(file):
+    """
+  starts reading a csv file from the beginning, skipping empty rows
+  :param file: csv file, as a seekable file-like object
+  :returns: column names, iterator over the remaining rows
+  """
+    file.seek(0)
+    rows = itertools.ifilter(None, _reader(file))
+    return next(rows, []), rows
+
+
+def _block(rows, width, block_rows):
+    """
+  reads the next block of rows, so memory use is bounded by the block size
+  instead of the file size
+  :param rows: iterator over csv rows
+  :param width: number of columns, shorter rows are padded with empty values and longer rows truncated
+  :param block_rows: maximum number of rows to read
+  :returns: two dimensional numpy string array, or None at the end of the file
+  """
+    block = [row if len(row) == width else (row + [""] * width)[:width] for row in
+             itertools.islice(rows, block_rows)]
+    return numpy.array(block) if block else None
+
+
+def _float(column):
+    """
+  converts a numpy string array to float64, treating empty values as NaN
+  :raises ValueError: if a value isn't a number
+  """
+    return numpy.where(column == "", "nan", column).astype("float64")
+
+
+def _type(column):
+    """
+  infers the type of a column from a sample of its values
+  :returns: "float64", "string", or None if the sample is empty
+  """
+    try:
+        _float(column)
+    except ValueError:
+        return "string"
+    return "float64" if numpy.any(column != "") else None
+
+
+def scan_file(file):
+    """
+  makes a first pass through a csv file, reading the column names, counting
+  rows and inferring column types from the first block of rows. Columns with
+  no values in the first block are inferred from the first block that has
+  some, and columns with no values at all are strings.
+  :param file: csv file to be parsed, as a seekable file-like object
+  :returns: attributes, dimensions, block_rows
+  """
+    import cherrypy
     cherrypy.log.error("parsing:::::::")
-    rows = [row for row in
-            csv.reader(file.splitlines(), delimiter=",", doublequote=True, escapechar=None, quotechar='"',
-                       quoting=csv.QUOTE_MINIMAL, skipinitialspace=True)]
-    if len(rows) < 2:
-        slycat.email.send_error("slycat-csv-parser.py parse_file", "File must contain at least two rows.")
+    names, rows = _rows(file)
+    if len(names) < 1:
+        slycat.email.send_error("slycat-csv-parser.py scan_file", "File must contain at least one column.")
+        raise Exception("File must contain at least one column.")
+
+    block_rows = max(1, block_cells // len(names))
+    types = [None] * len(names)
+    row_count = 0
+    while None in types:
+        block = _block(rows, len(names), block_rows)
+        if block is None:
+            break
+        row_count += len(block)
+        for index, type in enumerate(types):
+            if type is None:
+                types[index] = _type(block[:, index])
+    row_count += sum(1 for row in rows)
+
+    if row_count < 1:
+        slycat.email.send_error("slycat-csv-parser.py scan_file", "File must contain at least two rows.")
         raise Exception("File must contain at least two rows.")
 
-    attributes = []
-    dimensions = [{"name": "row", "type": "int64", "begin": 0, "end": len(rows[1:])}]
-    data = []
-    # go through the csv by column
-    for column in zip(*rows):
-        column_has_floats = False
-
-        # start from 1 to avoid the column name
-        for value in column[1:]:
-            if isfloat(value):
-                column_has_floats = True
-                try:  # note NaN's are floats
-                    output_list = map(lambda x: 'NaN' if x == '' else x, column[1:])
-                    data.append(numpy.array(output_list).astype("float64"))
-                    attributes.append({"name": column[0], "type": "float64"})
-
-                # could not convert something to a float defaulting to string
-                except Exception as e:
-                    column_has_floats = False
-                    cherrypy.log.error("found floats but failed to convert, switching to string types Trace: %s" % e)
-                break
-        if not column_has_floats:
-            data.append(numpy.array(column[1:]))
-            attributes.append({"name": column[0], "type": "string"})
+    attributes = [{"name": name, "type": type or "string"} for name, type in zip(names, types)]
+    dimensions = [{"name": "row", "type": "int64", "begin": 0, "end": row_count}]
+    return attributes, dimensions, block_rows
 
-    if len(attributes) < 1:
-        slycat.email.send_error("slycat-csv-parser.py parse_file", "File must contain at least one column.")
-        raise Exception("File must contain at least one column.")
 
-    return attributes, dimensions, data
+def parse_blocks(database, model, file, attributes, dimensions, block_rows):
+    """
+  makes a second pass through a csv file, converting it a block at a time
+  and reporting progress as it goes. If a float64 column contains a value
+  that isn't a number, the column is promoted to string and _Promotion is
+  raised, so the caller can start over.
+  :param database: slycat.web.server.database.couchdb.connect()
+  :param model: database.get("model", self._mid)
+  :param file: csv file to be parsed, as a seekable file-like object
+  :param attributes: attributes returned by scan_file()
+  :param dimensions: dimensions returned by scan_file()
+  :param block_rows: maximum number of rows per block
+  :returns: iterator over numpy arrays, one per column for each block
+  """
+    import cherrypy
+    row_count = dimensions[0]["end"]
+    end = 0
+    names, rows = _rows(file)
+    while True:
+        block = _block(rows, len(attributes), block_rows)
+        if block is None:
+            return
+        columns = []
+        for index, attribute in enumerate(attributes):
+            column = block[:, index]
+            if attribute["type"] == "float64":
+                try:
+                    column = _float(column)
+                except ValueError:
+                    cherrypy.log.error("column %s isn't numeric after row %s, switching to string type" % (attribute["name"], end))
+                    attribute["type"] = "string"
+                    raise _Promotion()
+            columns.append(column)
+        end += len(block)
+        slycat.web.server.update_model(database, model, progress=float(end) / row_count,
+                                       message="Parsed %s of %s rows." % (end, row_count))
+        for column in columns:
+            yield column
 
 
 def parse(database, model, input, files, aids, **kwargs):
     """
     parses a file as a csv and then uploads the parsed data to associated storage for a
-    model
+    model, one block of rows at a time
     :param database: slycat.web.server.database.couchdb.connect()
     :param model: database.get("model", self._mid)
     :param input: boolean
-    :param files: files to be parsed
+    :param files: files to be parsed, as strings or seekable file-like objects
     :param aids: artifact ID
     :param kwargs:
     """
@@ -76,17 +180,29 @@ def parse(database, model, input, files, aids, **kwargs):
         slycat.email.send_error("slycat-csv-parser.py parse", "Number of files and artifact IDs must match.")
         raise Exception("Number of files and artifact ids must match.")
 
-    parsed = [parse_file(file) for file in files]
+    files = [StringIO.StringIO(file) if isinstance(file, basestring) else file for file in files]
+    scanned = [scan_file(file) for file in files]
 
     array_index = int(kwargs.get("array", "0"))
-    for (attributes, dimensions, data), aid in zip(parsed, aids):
+    for file, (attributes, dimensions, block_rows), aid in zip(files, scanned, aids):
+        row_count = dimensions[0]["end"]
+        hyperchunks = ";".join(["%s/.../%s:%s" % (array_index, begin, min(begin + block_rows, row_count)) for begin in
+                                range(0, row_count, block_rows)])
         slycat.web.server.put_model_arrayset(database, model, aid, input)
-        slycat.web.server.put_model_array(database, model, aid, 0, attributes, dimensions)
-        slycat.web.server.put_model_arrayset_data(database, model, aid, "%s/.../..." % array_index, data)
+        while True:
+            slycat.web.server.put_model_array(database, model, aid, 0, attributes, dimensions)
+            try:
+                slycat.web.server.put_model_arrayset_data(database, model, aid, hyperchunks,
+                                                          parse_blocks(database, model, file, attributes,
+                                                                       dimensions, block_rows))
+                break
+            except _Promotion:
+                # A column's type changed, so start over.
+                pass
     end = time.time()
     model["db_creation_time"] = (end - start)
     database.save(model)
 
 
 def register_slycat_plugin(context):
-    context.register_parser("slycat-csv-parser", "Comma separated values (CSV)", ["table"], parse)
+    context.register_parser("slycat-csv-parser", "Comma separated values (CSV)", ["table"], parse, streaming=True)
@@ -8,7 +8,7 @@ def parse_file(file):
     """
     parses out a .dat file into numpy array by column (data), the dimension meta data(dimensions),
     and sets attributes (attributes)
-    :param file: dakota file to be parsed
+    :param file: dakota file to be parsed, as a string or file-like object
     :returns: attributes, dimensions, data
     """
     import cherrypy
@@ -20,7 +20,9 @@ def parse_file(file):
             return False
 
     cherrypy.log.error("parsing:::::::")
-    rows = [row.split() for row in StringIO.StringIO(file)]
+    if isinstance(file, basestring):
+        file = StringIO.StringIO(file)
+    rows = [row.split() for row in file]
     if len(rows) < 2:
         slycat.email.send_error("slycat-dakota-parser.py parse_file", "File must contain at least two rows.")
         raise Exception("File must contain at least two rows.")
@@ -72,4 +74,4 @@ def parse(database, model, input, files, aids, **kwargs):
 
 
 def register_slycat_plugin(context):
-    context.register_parser("slycat-dakota-parser", "Dakota tabular", ["table"], parse)
+    context.register_parser("slycat-dakota-parser", "Dakota tabular", ["table"], parse, streaming=True)
@@ -0,0 +1,37 @@
+import h5py
+import numpy
+import StringIO
+import slycat.distance
+import slycat.email
+import slycat.web.server
+
+block_size = 16 * 1024 * 1024
+
+def parse(database, model, input, files, aids, **kwargs):
+  """Store condensed distance matrices (see :mod:`slycat.distance`) as arrayset artifacts, one block at a time.
+
+  Each artifact contains a single array with one "distance" attribute along a
+  "pair" dimension, in condensed order.
+  """
+  if len(files) != len(aids):
+    slycat.email.send_error("slycat-distance-matrix-parser.py parse", "Number of files and artifact ids must match.")
+    raise Exception("Number of files and artifact ids must match.")
+
+  for file, aid in zip(files, aids):
+    if isinstance(file, basestring):
+      file = StringIO.StringIO(file)
+    with h5py.File(file, "r") as source:
+      distances = slycat.distance.open(source)
+      size = len(distances)
+      if size != slycat.distance.size(int(distances.attrs["count"])):
+        slycat.email.send_error("slycat-distance-matrix-parser.py parse", "Distance matrix size doesn't match its observation count.")
+        raise Exception("Distance matrix size doesn't match its observation count.")
+
+      blocks = [(begin, min(begin + block_size, size)) for begin in range(0, size, block_size)]
+      slycat.web.server.put_model_arrayset(database, model, aid, input)
+      slycat.web.server.put_model_array(database, model, aid, 0, [dict(name="distance", type="float64")], [dict(name="pair", begin=0, end=size)])
+      if blocks:
+        slycat.web.server.put_model_arrayset_data(database, model, aid, ";".join(["0/0/%s:%s" % block for block in blocks]), (slycat.distance.read(distances, begin, end) for begin, end in blocks))
+
+def register_slycat_plugin(context):
+  context.register_parser("slycat-distance-matrix-parser", "Condensed distance matrix (HDF5)", [], parse, streaming=True)
@@ -8,8 +8,8 @@ def register_slycat_plugin(context):
   import numpy
   import os
   import re
-  import scipy.cluster.hierarchy
-  import scipy.spatial.distance
+  import slycat.distance
+  import slycat.timeseries
   import slycat.web.server.database.couchdb
   import slycat.web.server
   import slycat.email
@@ -17,18 +17,6 @@ def register_slycat_plugin(context):
   import traceback
   import urlparse
 
-  def csv_distance(left_index, left_path, right_index, right_path):
-    return csv_distance.matrix[left_index][right_index]
-  csv_distance.matrix = None
-
-  # Map measure names to functions
-  measures = {
-    # "identity" : identity_distance,
-    # "jaccard" : jaccard_distance,
-    # "euclidean-rgb" : euclidean_rgb_distance,
-    "csv" : csv_distance,
-    }
-
   # Maps the slycat-agent functions to their respective distance matrix type
   distance_matrix_types = {
     "jaccard-distance": "jaccard",
@@ -40,23 +28,20 @@ def register_slycat_plugin(context):
   }
 
   def generate_filename(column, uid, type):
-    return "slycat_%s_%s_%s_distance_matrix.csv" % (column, uid, type)
-
-  def compute_distance(left, right, storage, cluster_name, measure_name, measure, columns):
-    distance = numpy.empty(len(left))
-    for index in range(len(left)):
-      i = left[index]
-      j = right[index]
-      row_i, column_i = storage[i]
-      uri_i = columns[column_i][1][row_i]
-      path_i = urlparse.urlparse(uri_i).path
-      row_j, column_j = storage[j]
-      uri_j = columns[column_j][1][row_j]
-      path_j = urlparse.urlparse(uri_j).path
-      distance[index] = measure(i, path_i, j, path_j)
-      print "Computed %s distance for %s, %s -> %s: %s." % (measure_name, cluster_name, i, j, distance[index])
-    return distance
+    return "slycat_%s_%s_%s_distance_matrix.hdf5" % (column, uid, type)
+
+  def load_distances(database, model, aid, count):
+    """Load the condensed distances between the first `count` observations from a distance matrix artifact.
 
+    The artifact may contain a condensed matrix stored by the
+    slycat-distance-matrix-parser, or a square matrix uploaded as CSV.
+    """
+    metadata = slycat.web.server.get_model_arrayset_metadata(database, model, aid)
+    if metadata[0]["dimensions"][0]["name"] == "pair":
+      distances = list(slycat.web.server.get_model_arrayset_data(database, model, aid, "0/0/..."))[0]
+      return slycat.distance.leading(distances, count)
+    matrix = numpy.array(list(slycat.web.server.get_model_arrayset_data(database, model, aid, ".../.../...")), dtype="float64")
+    return matrix[:count, :count][numpy.triu_indices(count, k=1)]
 
   def media_columns(database, model, verb, type, command, **kwargs):
     """Identify columns in the input data that contain media URIs (image or video)."""
@@ -103,8 +88,6 @@ def register_slycat_plugin(context):
         for column_index, column_info in enumerate(column_infos):
           columns.append((column_info['name'], column_data[column_index]))
 
-        csv_distance.matrix = list(slycat.web.server.get_model_arrayset_data(database, model, "distance-matrix", ".../.../..."))
-
         # Create a mapping from unique cluster names to column rows.
         clusters = collections.defaultdict(list)
         for column_index, (name, column) in enumerate(columns):
@@ -122,64 +105,17 @@ def register_slycat_plugin(context):
           progress_begin = float(index) / float(len(clusters))
           progress_end = float(index + 1) / float(len(clusters))
 
-          # Compute a distance matrix comparing every image to every other ...
-          observation_count = len(storage)
-          left, right = numpy.triu_indices(observation_count, k=1)
-          distance = compute_distance(left, right, storage, name, cluster_measure, measures[cluster_measure], columns)
+          # Load the distances between every image and every other ...
+          distance = load_distances(database, model, "distance-matrix", len(storage))
 
           # Use the distance matrix to cluster observations ...
           print "Clustering %s" % name
-          #distance = scipy.spatial.distance.squareform(distance_matrix)
-          linkage = scipy.cluster.hierarchy.linkage(distance, method=str(cluster_linkage))
+          linkage = slycat.distance.linkage(distance, method=str(cluster_linkage))
           cluster_linkages[name] = linkage
 
-          # Identify exemplar waveforms for each cluster ...
-          distance_matrix = scipy.spatial.distance.squareform(distance)
-
-          summed_distances = numpy.zeros(shape=(observation_count))
-          exemplars = dict()
-          cluster_membership = []
-
-          for i in range(observation_count):
-            exemplars[i] = i
-            cluster_membership.append(set([i]))
-
+          # Identify exemplar images for each cluster ...
           print "Identifying examplars for %s" % (name)
-          for i in range(len(linkage)):
-            cluster_id = i + observation_count
-            (f_cluster1, f_cluster2, height, total_observations) = linkage[i]
-            cluster1 = int(f_cluster1)
-            cluster2 = int(f_cluster2)
-            # Housekeeping: assemble the membership of the new cluster
-            cluster_membership.append(cluster_membership[cluster1].union(cluster_membership[cluster2]))
-            # We need to update the distance from each member of the new
-            # cluster to all the other members of the cluster.  That means
-            # that for all the members of cluster1, we need to add in the
-            # distances to members of cluster2, and for all members of
-            # cluster2, we need to add in the distances to members of
-            # cluster1.
-            for cluster1_member in cluster_membership[cluster1]:
-              for cluster2_member in cluster_membership[cluster2]:
-                summed_distances[cluster1_member] += distance_matrix[cluster1_member][cluster2_member]
-
-            for cluster2_member in cluster_membership[int(cluster2)]:
-              for cluster1_member in cluster_membership[cluster1]:
-                summed_distances[cluster2_member] += distance_matrix[cluster2_member][cluster1_member]
-
-            min_summed_distance = None
-            max_summed_distance = None
-
-            exemplar_id = 0
-            for member in cluster_membership[cluster_id]:
-              if min_summed_distance is None or summed_distances[member] < min_summed_distance:
-                min_summed_distance = summed_distances[member]
-                exemplar_id = member
-
-              if max_summed_distance is None or summed_distances[member] > min_summed_distance:
-                max_summed_distance = summed_distances[member]
-
-            exemplars[cluster_id] = exemplar_id
-          cluster_exemplars[name] = exemplars
+          cluster_exemplars[name] = slycat.timeseries.exemplars(linkage, distance)
 
         # Ingest the raw data into Slycat.
         # Store an alphabetized collection of cluster names.
@@ -244,69 +180,20 @@ def register_slycat_plugin(context):
         cluster_exemplars = {}
 
         for index, (name, storage) in enumerate(sorted(clusters.items())):
-          csv_distance.matrix = list(slycat.web.server.get_model_arrayset_data(database, model, "distance-matrix-%s" % name, ".../.../..."))
-
           progress_begin = float(index) / float(len(clusters))
           progress_end = float(index + 1) / float(len(clusters))
 
-          # Compute a distance matrix comparing every image to every other ...
-          observation_count = len(storage)
-          left, right = numpy.triu_indices(observation_count, k=1)
-          distance = compute_distance(left, right, storage, name, cluster_measure, measures[cluster_measure], columns)
+          # Load the distances between every image and every other ...
+          distance = load_distances(database, model, "distance-matrix-%s" % name, len(storage))
 
           # Use the distance matrix to cluster observations ...
           print "Clustering %s" % name
-          #distance = scipy.spatial.distance.squareform(distance_matrix)
-          linkage = scipy.cluster.hierarchy.linkage(distance, method=str(cluster_linkage))
+          linkage = slycat.distance.linkage(distance, method=str(cluster_linkage))
           cluster_linkages[name] = linkage
 
-          # Identify exemplar waveforms for each cluster ...
-          distance_matrix = scipy.spatial.distance.squareform(distance)
-
-          summed_distances = numpy.zeros(shape=(observation_count))
-          exemplars = dict()
-          cluster_membership = []
-
-          for i in range(observation_count):
-            exemplars[i] = i
-            cluster_membership.append(set([i]))
-
+          # Identify exemplar images for each cluster ...
           print "Identifying examplars for %s" % (name)
-          for i in range(len(linkage)):
-            cluster_id = i + observation_count
-            (f_cluster1, f_cluster2, height, total_observations) = linkage[i]
-            cluster1 = int(f_cluster1)
-            cluster2 = int(f_cluster2)
-            # Housekeeping: assemble the membership of the new cluster
-            cluster_membership.append(cluster_membership[cluster1].union(cluster_membership[cluster2]))
-            # We need to update the distance from each member of the new
-            # cluster to all the other members of the cluster.  That means
-            # that for all the members of cluster1, we need to add in the
-            # distances to members of cluster2, and for all members of
-            # cluster2, we need to add in the distances to members of
-            # cluster1.
-            for cluster1_member in cluster_membership[cluster1]:
-              for cluster2_member in cluster_membership[cluster2]:
-                summed_distances[cluster1_member] += distance_matrix[cluster1_member][cluster2_member]
-
-            for cluster2_member in cluster_membership[int(cluster2)]:
-              for cluster1_member in cluster_membership[cluster1]:
-                summed_distances[cluster2_member] += distance_matrix[cluster2_member][cluster1_member]
-
-            min_summed_distance = None
-            max_summed_distance = None
-
-            exemplar_id = 0
-            for member in cluster_membership[cluster_id]:
-              if min_summed_distance is None or summed_distances[member] < min_summed_distance:
-                min_summed_distance = summed_distances[member]
-                exemplar_id = member
-
-              if max_summed_distance is None or summed_distances[member] > min_summed_distance:
-                max_summed_distance = summed_distances[member]
-
-            exemplars[cluster_id] = exemplar_id
-          cluster_exemplars[name] = exemplars
+          cluster_exemplars[name] = slycat.timeseries.exemplars(linkage, distance)
 
         # Ingest the raw data into Slycat.
         # Store an alphabetized collection of cluster names.
@@ -387,7 +274,7 @@ def register_slycat_plugin(context):
 
     def callback():
       for name in image_columns_names:
-        slycat.web.server.post_model_file(model["_id"], True, sid, "%s" % generate_filename(name, uid, distance_matrix_types[fn]), "distance-matrix-%s" % name, "slycat-csv-parser")
+        slycat.web.server.post_model_file(model["_id"], True, sid, "%s" % generate_filename(name, uid, distance_matrix_types[fn]), "distance-matrix-%s" % name, "slycat-distance-matrix-parser")
       finish_with_image_columns_names(database, model, image_columns_names)
 
     stop_event = threading.Event()
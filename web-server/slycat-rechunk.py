@@ -0,0 +1,114 @@
+# Copyright 2013, Sandia Corporation. Under the terms of Contract
+# DE-AC04-94AL85000 with Sandia Corporation, the U.S. Government retains certain
+# rights in this software.
+
+"""Convert existing arraysets in a data store to the chunked, compressed
+layout used for new arrays.  Run this while the server is stopped - files are
+rewritten to a temporary file alongside the original, then renamed over it.
+"""
+
+import argparse
+import h5py
+import logging
+import os
+import re
+import slycat.hdf5
+import sys
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--data-store", default="data-store", help="Path to the hdf5 data storage directory.  Default: %(default)s")
+parser.add_argument("--chunk-bytes", type=int, default=None, help="Target uncompressed chunk size in bytes.  Default: %d" % slycat.hdf5.storage_options.defaults["chunk-bytes"])
+parser.add_argument("--compression", default=None, choices=["gzip", "lzf", "none"], help="Compression filter for numeric attributes.  Default: gzip")
+parser.add_argument("--compression-level", type=int, default=None, help="Compression level when using gzip.")
+parser.add_argument("--no-shuffle", action="store_true", help="Don't apply the shuffle filter to numeric attributes.")
+parser.add_argument("--force", action="store_true", help="Rewrite attributes even if they're already chunked.")
+parser.add_argument("--dry-run", action="store_true", help="Report the files that would be converted without changing anything.")
+arguments = parser.parse_args()
+
+logging.getLogger().setLevel(logging.INFO)
+logging.getLogger().addHandler(logging.StreamHandler())
+logging.getLogger().handlers[0].setFormatter(logging.Formatter("{} - %(levelname)s - %(message)s".format(sys.argv[0])))
+
+config = {}
+if arguments.chunk_bytes is not None:
+  config["chunk-bytes"] = arguments.chunk_bytes
+if arguments.compression is not None or arguments.compression_level is not None or arguments.no_shuffle:
+  numeric = dict(slycat.hdf5.storage_options.defaults["filters"]["default"])
+  if arguments.compression == "none":
+    numeric.pop("compression", None)
+    numeric.pop("compression_opts", None)
+  elif arguments.compression is not None:
+    numeric["compression"] = arguments.compression
+    if arguments.compression != "gzip":
+      numeric.pop("compression_opts", None)
+  if arguments.compression_level is not None:
+    numeric["compression_opts"] = arguments.compression_level
+  if arguments.no_shuffle:
+    numeric["shuffle"] = False
+  config["filters"] = {"default": numeric}
+slycat.hdf5.configure_storage(config)
+
+attribute_path = re.compile(r"^/array/\d+/attribute/\d+$")
+
+def attribute_type(dataset):
+  if h5py.check_dtype(vlen=dataset.dtype) is not None:
+    return "string"
+  return dataset.dtype.name
+
+def needs_conversion(file):
+  found = []
+  def visit(name, item):
+    if isinstance(item, h5py.Dataset) and attribute_path.match(item.name) and (arguments.force or item.chunks is None):
+      found.append(item.name)
+  file.visititems(visit)
+  return found
+
+def copy_attribute(source, target, name):
+  options = slycat.hdf5.storage_options(attribute_type(source), source.shape)
+  result = target.create_dataset(name, source.shape, dtype=source.dtype, **options)
+  for key, value in source.attrs.items():
+    result.attrs[key] = value
+  if source.size == 0:
+    return
+  # Copy along the first dimension in whole chunks, so memory use is bounded by the chunk size.
+  step = options["chunks"][0] if "chunks" in options else source.shape[0]
+  for begin in range(0, source.shape[0], step):
+    result[begin : begin + step] = source[begin : begin + step]
+
+def copy_group(source, target):
+  for key, value in source.attrs.items():
+    target.attrs[key] = value
+  for name, item in source.items():
+    if isinstance(item, h5py.Group):
+      copy_group(item, target.create_group(name))
+    elif attribute_path.match(item.name):
+      copy_attribute(item, target, name)
+    else:
+      source.copy(item, target, name=name)
+
+for directory, subdirectories, filenames in os.walk(arguments.data_store):
+  for filename in sorted(filenames):
+    if not filename.endswith(".hdf5"):
+      continue
+    path = os.path.join(directory, filename)
+    try:
+      with h5py.File(path, "r") as source:
+        attributes = needs_conversion(source)
+        if not attributes:
+          continue
+        logging.info("Converting %s attributes in %s", len(attributes), path)
+        if arguments.dry_run:
+          continue
+        temporary_path = path + ".rechunk"
+        with h5py.File(temporary_path, "w") as target:
+          copy_group(source, target)
+    except Exception as e:
+      logging.error("Couldn't convert %s: %s", path, e)
+      if os.path.exists(path + ".rechunk"):
+        os.remove(path + ".rechunk")
+      continue
+    if arguments.dry_run:
+      continue
+    before = os.path.getsize(path)
+    os.rename(temporary_path, path)
+    logging.info("Rewrote %s: %s bytes -> %s bytes", path, before, os.path.getsize(path))